@@ -5,6 +5,13 @@ import HGF.hgf_config
 import HGF.hgf_fit
 import HGF.hgf_pres
 import HGF.hgf_sim
+import HGF.hgf_batch
+import HGF.hgf_async
+import HGF.hgf_io
+import HGF.hgf_stream
+import HGF.hgf_hooks
+import HGF.hgf_multi
+import HGF.hgf_forecast
 
 
 import pkg_resources
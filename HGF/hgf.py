@@ -7,52 +7,83 @@ Code adapted by Jorie van Haren (2021) """
 
 # load nessecary packages
 import numpy as np
-import statsmodels.api as sm
 import pandas as pd
 from scipy import optimize
 
-# load config files
+# load config files and per trial hooks
 from HGF.hgf_config import *
+from HGF.hgf_hooks import _hookfuns
+
+# trajectory fields the perceptual functions can record
+TRAJ_BINARY     = ['mu', 'sa', 'mu_hat', 'sa_hat', 'v', 'w', 'da', 'ud', 'psi', 'epsi', 'wt']
+TRAJ_CONTINUOUS = ['mu', 'sa', 'mu_hat', 'sa_hat', 'v', 'w', 'da', 'dau', 'ud', 'psi', 'epsi', 'wt']
 
 ####################
 ## MAIN FUNCTIONS ##
 ####################
 
-def hgf_binary(r, p, trans=False):
-    """calculate trajectorie of agent's representations under HGF"""
-    
+def hgf_binary(r, p, trans=False, record=None, state=None, out=None, dtype=None, sink=None, hooks=None):
+    """calculate trajectorie of agent's representations under HGF
+    optional record = list of trajectory fields to keep (see TRAJ_BINARY),
+                      default None uses r['c_prc']['record'] or else keeps all fields
+             state  = dict with the last trial of a previous run (mu, pi, v, w, da rows and the trial count),
+                      used instead of the priors to continue a sequence chunk by chunk (see hgf_stream),
+                      the dict is updated in place with the last trial of this run (an empty dict starts from the priors)
+             out    = preallocated array of shape (trials+1, traj_width(r, record)) the trajectories are written to,
+                      e.g. a memory-map or shared memory block, row 0 holds the priors
+             dtype  = storage dtype of the trajectories (e.g. np.float32), default None uses r['c_prc']['dtype'],
+                      precisions are always updated in float64
+             sink   = output sink (e.g. hgf_io.MemmapSink), the inputs are filtered in chunks of sink.chunksize
+                      trials and every trajectory chunk is passed to sink.write(start, traj), so memory stays fixed,
+                      returns [sink.result(), None]
+             hooks  = list of per trial hooks (see hgf_hooks), e.g. alerts on large prediction errors or a profiler,
+                      without hooks the update loop runs as is
+    all traj entries and infStates are views into one contiguous buffer (see traj_width)"""
+    
+    if sink is not None: return(_tosink(hgf_binary, r, p, trans, record, dtype, sink, hooks))
     if trans: p = r['c_prc']['transp_prc_fun'](r, p) # transform parameters to native space
-    p_dict = _unpack_para(p, r)            # get parameters unpacked
-    u = np.insert(r['u'], 0, 0)            # add zeroth trial
+    layout = prc_layout(r['c_prc'])        # parameter slices and model variant (computed once per config)
+    p_dict = layout.unpack(p)              # get parameters unpacked
+    u = np.insert(_inputvalues(r), 0, 0)   # add zeroth trial
     n = len(u)                             # length of trials inc. prior
-    l = r['c_prc']['n_levels']             # get number of levels
+    l = layout.n_levels                    # get number of levels
+    enhanced = layout.enhanced             # enhanced hgf updates
     
     # set time dim for irregular intervals, or set to ones for reggular
     if r['c_prc']['irregular_intervals']:
-        t = r['u'][1,:]  # make sure this deminsion is [2, x] second being time
+        t = np.insert(r['u'][1,:], 0, 0)   # make sure this deminsion is [2, x] second being time deltas
     else:
         t = np.ones(n)
     
-    # initialize what to update
-    mu = np.empty((n, l)) * np.nan         # mu represnetation
-    pi = np.empty((n, l)) * np.nan         # pi representation
-    mu_hat = np.empty((n, l)) * np.nan     # mu^ quantity
-    pi_hat = np.empty((n, l)) * np.nan     # pi^ quantity
-    v = np.empty((n, l)) * np.nan           
-    w = np.empty((n, l-1)) * np.nan
-    da = np.empty((n, l)) * np.nan         # prediction errors
+    # initialize what to update, as views into one buffer (row 0 holds the priors)
+    record = _recordfields(r, record, TRAJ_BINARY)
+    buf, x = _trajbuffer(r, n, record, TRAJ_BINARY, out, dtype)
+    mu = x['mu']                           # mu represnetation
+    pi = x['pi']                           # pi representation
+    mu_hat = x['mu_hat']                   # mu^ quantity
+    pi_hat = x['pi_hat']                   # pi^ quantity
+    v = x['v']
+    w = x['w']
+    da = x['da']                           # prediction errors
     
     # initial priors, for all remaining this will remain nan
-    mu[0,0] = _sgm(p_dict['mu_0'][0], 1)
-    mu[0,1:] = p_dict['mu_0'][1:]
-    pi[0,0] = np.inf
-    pi[0,1:] = p_dict['sa_0'][1:]**-1   # silence warning, inf resulst for sim model is fine
+    if state:  # or continue from the last trial of a previous run
+        _loadstate(state, mu=mu, pi=pi, v=v, w=w, da=da)
+    else:
+        mu[0,0] = _sgm(p_dict['mu_0'][0], 1)
+        mu[0,1:] = p_dict['mu_0'][1:]
+        pi[0,0] = np.inf
+        pi[0,1:] = p_dict['sa_0'][1:]**-1   # silence warning, inf resulst for sim model is fine
+    ign = _ignmask(r, n)                # ignored trials (shifted for the zeroth trial)
+    t0 = state.get('trials', 0) if state else 0   # trials of previous runs, for hook trial numbers
+    on_trial, on_level = _hookfuns(hooks)          # None without hooks
     
     # represnetation update loop!
     for trial in range(1, n):
         
         # check if trail has to be ignored
-        if not trial in r['ign']:
+        if not ign[trial]:
+            if on_level: on_level(-1)
 
             # make second level initial pred. (weighted by time)
             mu_hat[trial,1] = mu[trial-1,1] + (t[trial]*p_dict['rho'][1])     
@@ -68,6 +99,7 @@ def hgf_binary(r, p, trans=False):
 
             # prediction error
             da[trial,0] = mu[trial,0] - mu_hat[trial,0]
+            if on_level: on_level(0)
             
             ####LOOP OVER LEVELS - TAKING SPECIAL CARE OF 2ND AND LAST LEVEL####
             for lvl in range(1, l):
@@ -114,7 +146,7 @@ def hgf_binary(r, p, trans=False):
                         
                     ##---------------------------------------------------------------------------------------------------------##   
                     # updates using enhanced hgf binary model
-                    if 'ehgf' in r['c_prc']['model']:
+                    if enhanced:
                         mu[trial,lvl] = mu_hat[trial,lvl] + \
                                         0.5 * pi_hat[trial,lvl]**-1 * \
                                         p_dict['ka'][lvl-1] * \
@@ -145,6 +177,7 @@ def hgf_binary(r, p, trans=False):
                         
                 # prediction error    
                 da[trial,lvl] = (pi[trial,lvl]**-1 + (mu[trial,lvl] - mu_hat[trial, lvl])**2)  *  pi_hat[trial,lvl] -1
+                if on_level: on_level(lvl)
 
         # if trial is ignored we do not update anything
         else: 
@@ -157,107 +190,132 @@ def hgf_binary(r, p, trans=False):
             v[trial,:]  = v[trial-1,:]
             w[trial,:]  = w[trial-1,:]
             da[trial,:] = da[trial-1,:]
-    
-    # learing rates
-    sgmmu2    = _sgm(p_dict['ka'][0] * mu[:,1], 1)
-    dasgmmu2  = u - sgmmu2   
-    lr1       = np.divide(np.diff(sgmmu2), dasgmmu2[1:n])
-    lr1[da[1:n,1]==0] = 0
-    
-    # remove rep. priors and dummy value
-    mu       = np.delete(mu,0, axis=0)
-    pi       = np.delete(pi,0, axis=0)
-    mu_hat   = np.delete(mu_hat,0, axis=0)
-    pi_hat   = np.delete(pi_hat,0, axis=0)
-    v        = np.delete(v,0, axis=0)
-    w        = np.delete(w,0, axis=0)
-    da       = np.delete(da,0, axis=0)
-    
-    # store results in dict
-    traj = {}
-    traj['mu']      = mu
-    traj['sa']      = pi**-1
-    traj['mu_hat']  = mu_hat
-    traj['sa_hat']  = pi_hat**-1
-    traj['v']       = v
-    traj['w']       = w
-    traj['da']      = da
-    traj['ud']      = mu - mu_hat  # updates with respect to prediction
-    
-    # precision weight on pred error
-    psi          = np.empty([n-1,l])
-    psi[:]       = np.nan
-    psi[:,1]     = pi[:,1]**-1
-    psi[:,2:l]   = np.divide(pi_hat[:,1:l-1], pi[:,2:l])
-    traj['psi']  = psi
-    
-    # epsions (precision weighted pred. errors)
-    epsi         = np.empty([n-1,l])
-    epsi[:]      = np.nan
-    epsi[:,1:l]  = np.multiply(psi[:,1:l], da[:,:l-1])
-    traj['epsi'] = epsi
-    
-    # learning rate
-    wt           = np.empty([n-1,l])
-    wt[:]        = np.nan    
-    wt[:,0]      = lr1
-    wt[:,1]      = psi[:,1]
-    wt[:,2:l]    = np.multiply(0.5 * (v[:,1:l-1] * 
-                                      np.diagonal(p_dict['ka'][1:l-1].reshape(1,len(p_dict['ka'][1:l-1])))), 
-                                      psi[:,2:l])
-    traj['wt']   = wt
-    
-    # matrics observational model DIMENSIONALLITY PROBLEMS
-    infStates    = np.empty([n-1,l,4])
-    infStates[:] = np.nan
-    infStates[:,:,0]  = traj['mu_hat']
-    infStates[:,:,1]  = traj['sa_hat']
-    infStates[:,:,2]  = traj['mu']
-    infStates[:,:,3]  = traj['sa']
+
+        if on_trial: on_trial(t0 + trial - 1, x, trial)
+    
+    # keep last trial for a next run
+    if state is not None:
+        _savestate(state, mu=mu, pi=pi, v=v, w=w, da=da)
+        state['trials'] = t0 + n - 1
+
+    # variances and matrics observational model (views, no copies)
+    np.divide(1, pi_hat[1:], out=x['sa_hat'][1:])
+    np.divide(1, pi[1:], out=x['sa'][1:])
+    infStates = buf[1:,:4*l].reshape(n-1, l, 4)
+    
+    # remove rep. priors and dummy value (views, no copies)
+    mu_0     = mu
+    mu       = mu[1:]
+    pi       = pi[1:]
+    mu_hat   = mu_hat[1:]
+    pi_hat   = pi_hat[1:]
+    v        = v[1:]
+    w        = w[1:]
+    da       = da[1:]
+    
+    # updates with respect to prediction
+    if 'ud' in record: np.subtract(mu, mu_hat, out=x['ud'][1:])
+    
+    # derived quantities, only computed on request
+    if 'psi' in x:
+        # precision weight on pred error
+        psi          = x['psi'][1:]
+        psi[:,1]     = pi[:,1]**-1
+        psi[:,2:l]   = np.divide(pi_hat[:,1:l-1], pi[:,2:l])
+    
+    if 'epsi' in record:
+        # epsions (precision weighted pred. errors)
+        epsi         = x['epsi'][1:]
+        epsi[:,1:l]  = np.multiply(psi[:,1:l], da[:,:l-1])
+    
+    if 'wt' in record:
+        # learing rates
+        sgmmu2    = _sgm(p_dict['ka'][0] * mu_0[:,1], 1)
+        dasgmmu2  = u - sgmmu2   
+        lr1       = np.divide(np.diff(sgmmu2), dasgmmu2[1:n])
+        lr1[da[:,1]==0] = 0
+        
+        # learning rate
+        wt           = x['wt'][1:]
+        wt[:,0]      = lr1
+        wt[:,1]      = psi[:,1]
+        wt[:,2:l]    = np.multiply(0.5 * (v[:,1:l-1] * 
+                                          np.diagonal(p_dict['ka'][1:l-1].reshape(1,len(p_dict['ka'][1:l-1])))), 
+                                          psi[:,2:l])
+    
+    # store requested results in dict
+    traj = {field: x[field][1:] for field in TRAJ_BINARY if field in record}
     return([traj, infStates])
 
-def ehgf_binary(r, p, trans=False):
+def ehgf_binary(r, p, trans=False, record=None, state=None, out=None, dtype=None, sink=None, hooks=None):
     """Allias function for hgf_binary with r['c_prc']['model'] set to 'ehgf_binary'"""
-    # set model manually to ehgf_binary for enhanced model
-    r['c_prc']['model'] = 'ehgf_binary'
-    return(hgf_binary(r, p, trans=trans))
-
-
-
-def hgf(r, p, trans=False):
-    """calculate trajectorie of agent's representations under HGF"""
-    
+    # set model to ehgf_binary for enhanced model (on a copy of r, the callers r is not changed)
+    r = _setmodel(r, 'ehgf_binary')
+    return(hgf_binary(r, p, trans=trans, record=record, state=state, out=out, dtype=dtype, sink=sink, hooks=hooks))
+
+
+
+def hgf(r, p, trans=False, record=None, state=None, out=None, dtype=None, sink=None, hooks=None):
+    """calculate trajectorie of agent's representations under HGF
+    optional record = list of trajectory fields to keep (see TRAJ_CONTINUOUS),
+                      default None uses r['c_prc']['record'] or else keeps all fields
+             state  = dict with the last trial of a previous run (mu, pi, v, w, da rows and the trial count),
+                      used instead of the priors to continue a sequence chunk by chunk (see hgf_stream),
+                      the dict is updated in place with the last trial of this run (an empty dict starts from the priors)
+             out    = preallocated array of shape (trials+1, traj_width(r, record)) the trajectories are written to,
+                      e.g. a memory-map or shared memory block, row 0 holds the priors
+             dtype  = storage dtype of the trajectories (e.g. np.float32), default None uses r['c_prc']['dtype'],
+                      precisions are always updated in float64
+             sink   = output sink (e.g. hgf_io.MemmapSink), the inputs are filtered in chunks of sink.chunksize
+                      trials and every trajectory chunk is passed to sink.write(start, traj), so memory stays fixed,
+                      returns [sink.result(), None]
+             hooks  = list of per trial hooks (see hgf_hooks), e.g. alerts on large prediction errors or a profiler,
+                      without hooks the update loop runs as is
+    all traj entries and infStates are views into one contiguous buffer (see traj_width)"""
+    
+    if sink is not None: return(_tosink(hgf, r, p, trans, record, dtype, sink, hooks))
     if trans: p = r['c_prc']['transp_prc_fun'](r, p) # transform parameters to native space
-    p_dict = _unpack_para(p, r)            # get parameters unpacked
-    u = np.insert(r['u'], 0, 0)            # add zeroth trial
+    layout = prc_layout(r['c_prc'])        # parameter slices and model variant (computed once per config)
+    p_dict = layout.unpack(p)              # get parameters unpacked
+    u = np.insert(_inputvalues(r), 0, 0)   # add zeroth trial
     n = len(u)                             # length of trials inc. prior
-    l = r['c_prc']['n_levels']             # get number of levels
+    l = layout.n_levels                    # get number of levels
+    enhanced = layout.enhanced             # enhanced hgf updates
     
     # set time dim for irregular intervals, or set to ones for reggular
     if r['c_prc']['irregular_intervals']:
-        t = r['u'][1,:]  # make sure this deminsion is [2, x] second being time
+        t = np.insert(r['u'][1,:], 0, 0)   # make sure this deminsion is [2, x] second being time deltas
     else:
         t = np.ones(n)
     
-    # initialize what to update
-    mu = np.empty((n, l)) * np.nan         # mu represnetation
-    pi = np.empty((n, l)) * np.nan         # pi representation
-    mu_hat = np.empty((n, l)) * np.nan     # mu^ quantity
-    pi_hat = np.empty((n, l)) * np.nan     # pi^ quantity
-    v = np.empty((n, l)) * np.nan           
-    w = np.empty((n, l-1)) * np.nan
-    da = np.empty((n, l)) * np.nan         # prediction errors
-    dau = np.empty((n, 1)) * np.nan
+    # initialize what to update, as views into one buffer (row 0 holds the priors)
+    record = _recordfields(r, record, TRAJ_CONTINUOUS)
+    buf, x = _trajbuffer(r, n, record, TRAJ_CONTINUOUS, out, dtype)
+    mu = x['mu']                           # mu represnetation
+    pi = x['pi']                           # pi representation
+    mu_hat = x['mu_hat']                   # mu^ quantity
+    pi_hat = x['pi_hat']                   # pi^ quantity
+    v = x['v']
+    w = x['w']
+    da = x['da']                           # prediction errors
+    dau = x['dau']
     
     # initial priors, for all remaining this will remain nan
-    mu[0,:] = p_dict['mu_0']
-    pi[0,:] = p_dict['sa_0']**-1
+    if state:  # or continue from the last trial of a previous run
+        _loadstate(state, mu=mu, pi=pi, v=v, w=w, da=da)
+    else:
+        mu[0,:] = p_dict['mu_0']
+        pi[0,:] = p_dict['sa_0']**-1
+    ign = _ignmask(r, n)                # ignored trials (shifted for the zeroth trial)
+    t0 = state.get('trials', 0) if state else 0   # trials of previous runs, for hook trial numbers
+    on_trial, on_level = _hookfuns(hooks)          # None without hooks
     
     # represnetation update loop!
     for trial in range(1, n):
         
         # check if trail has to be ignored
-        if not trial in r['ign']:  
+        if not ign[trial]:
+            if on_level: on_level(-1)
 
             ####1ST LVL####
             # make first level pred, and precision of prediction
@@ -278,6 +336,7 @@ def hgf(r, p, trans=False):
             # volatility prediction error
             da[trial,0] = (pi[trial,0]**-1 + (mu[trial,0] - mu_hat[trial,0])**2) * \
                           pi_hat[trial,0] - 1
+            if on_level: on_level(0)
             
             ####LOOP OVER LEVELS - TAKING SPECIAL CARE OF 2ND AND LAST LEVEL####
             for lvl in range(1, l):
@@ -310,7 +369,7 @@ def hgf(r, p, trans=False):
 
                 ##---------------------------------------------------------------------------------------------------------##    
                 # UPDATES USING ENCHANCED HGF MODEL
-                if 'ehgf' in r['c_prc']['model']:
+                if enhanced:
                     mu[trial,lvl] = mu_hat[trial,lvl] + \
                                     0.5 * pi_hat[trial,lvl]**-1 * \
                                     p_dict['ka'][lvl-1] * \
@@ -342,6 +401,7 @@ def hgf(r, p, trans=False):
                         
                 # prediction error    
                 da[trial,lvl] = (pi[trial,lvl]**-1 + (mu[trial,lvl] - mu_hat[trial, lvl])**2)  *  pi_hat[trial,lvl] -1
+                if on_level: on_level(lvl)
 
         # if trial is ignored we do not update anything
         else: 
@@ -354,89 +414,79 @@ def hgf(r, p, trans=False):
             v[trial,:]  = v[trial-1,:]
             w[trial,:]  = w[trial-1,:]
             da[trial,:] = da[trial-1,:]
-    
-    # remove rep. priors and dummy value
-    mu       = np.delete(mu,0, axis=0)
-    pi       = np.delete(pi,0, axis=0)
-    mu_hat   = np.delete(mu_hat,0, axis=0)
-    pi_hat   = np.delete(pi_hat,0, axis=0)
-    v        = np.delete(v,0, axis=0)
-    w        = np.delete(w,0, axis=0)
-    da       = np.delete(da,0, axis=0)
-    dau      = np.delete(dau, 0)
-    
-    # store results in dict
-    traj = {}
-    traj['mu']      = mu
-    traj['sa']      = pi**-1
-    traj['mu_hat']  = mu_hat
-    traj['sa_hat']  = pi_hat**-1
-    traj['v']       = v
-    traj['w']       = w
-    traj['da']      = da
-    traj['dau']     = dau.reshape(len(dau),1)
-    traj['ud']      = mu - mu_hat  # updates with respect to prediction
-    
-    # precision weight on pred error
-    psi          = np.empty([n-1,l])
-    psi[:]       = np.nan
-    psi[:,0]     = (p_dict['al'] * pi[:,0])**-1
-    psi[:,1:l]   = np.divide(pi_hat[:,0:l-1], pi[:,1:l])
-    traj['psi']  = psi
-    
-    # epsions (precision weighted pred. errors)
-    epsi         = np.empty([n-1,l])
-    epsi[:]      = np.nan
-    epsi[:,0]    = np.multiply(psi[:,0], dau)
-    epsi[:,1:l]  = np.multiply(psi[:,1:l], da[:,:l-1])
-    traj['epsi'] = epsi
-    
-    # learning rate
-    wt           = np.empty([n-1,l])
-    wt[:]        = np.nan    
-    wt[:,0]      = psi[:,0]
-    wt[:,1:l]    = np.multiply(0.5 * (v[:,0:l-1] * 
-                                      np.diagonal(p_dict['ka'][0:l-1].reshape(1,len(p_dict['ka'][0:l-1])))), 
-                                      psi[:,1:l])
-    traj['wt']   = wt
-    
-    # matrics observational model DIMENSIONALLITY PROBLEMS
-    infStates    = np.empty([n-1,l,4])
-    infStates[:] = np.nan
-    infStates[:,:,0]  = traj['mu_hat']
-    infStates[:,:,1]  = traj['sa_hat']
-    infStates[:,:,2]  = traj['mu']
-    infStates[:,:,3]  = traj['sa']
+
+        if on_trial: on_trial(t0 + trial - 1, x, trial)
+    
+    # keep last trial for a next run
+    if state is not None:
+        _savestate(state, mu=mu, pi=pi, v=v, w=w, da=da)
+        state['trials'] = t0 + n - 1
+
+    # variances and matrics observational model (views, no copies)
+    np.divide(1, pi_hat[1:], out=x['sa_hat'][1:])
+    np.divide(1, pi[1:], out=x['sa'][1:])
+    infStates = buf[1:,:4*l].reshape(n-1, l, 4)
+    
+    # remove rep. priors and dummy value (views, no copies)
+    mu       = mu[1:]
+    pi       = pi[1:]
+    mu_hat   = mu_hat[1:]
+    pi_hat   = pi_hat[1:]
+    v        = v[1:]
+    w        = w[1:]
+    da       = da[1:]
+    dau      = dau[1:]
+    
+    # updates with respect to prediction
+    if 'ud' in record: np.subtract(mu, mu_hat, out=x['ud'][1:])
+    
+    # derived quantities, only computed on request
+    if 'psi' in x:
+        # precision weight on pred error
+        psi          = x['psi'][1:]
+        psi[:,0]     = (p_dict['al'] * pi[:,0])**-1
+        psi[:,1:l]   = np.divide(pi_hat[:,0:l-1], pi[:,1:l])
+    
+    if 'epsi' in record:
+        # epsions (precision weighted pred. errors)
+        epsi         = x['epsi'][1:]
+        epsi[:,0]    = np.multiply(psi[:,0], dau[:,0])
+        epsi[:,1:l]  = np.multiply(psi[:,1:l], da[:,:l-1])
+    
+    if 'wt' in record:
+        # learning rate
+        wt           = x['wt'][1:]
+        wt[:,0]      = psi[:,0]
+        wt[:,1:l]    = np.multiply(0.5 * (v[:,0:l-1] * 
+                                          np.diagonal(p_dict['ka'][0:l-1].reshape(1,len(p_dict['ka'][0:l-1])))), 
+                                          psi[:,1:l])
+    
+    # store requested results in dict
+    traj = {field: x[field][1:] for field in TRAJ_CONTINUOUS if field in record}
     return([traj, infStates])
 
-def ehgf(r, p, trans=False):
+def ehgf(r, p, trans=False, record=None, state=None, out=None, dtype=None, sink=None, hooks=None):
     """Allias function for hgf with r['c_prc']['model'] set to 'ehgf'"""
-    # set model manually to ehgf_binary for enhanced model
-    r['c_prc']['model'] = 'ehgf'
-    return(hgf(r, p, trans=trans))
+    # set model to ehgf for enhanced model (on a copy of r, the callers r is not changed)
+    r = _setmodel(r, 'ehgf')
+    return(hgf(r, p, trans=trans, record=record, state=state, out=out, dtype=dtype, sink=sink, hooks=hooks))
+
+
+def traj_width(r, record=None, dtype=None):
+    """number of columns of the trajectory buffer of the perceptual model in r (see the out argument
+    of the perceptual functions), the buffer has one row per trial plus one for the priors"""
+    layout = prc_layout(r['c_prc'])
+    fields = TRAJ_BINARY if layout.binary else TRAJ_CONTINUOUS
+    dtype  = _trajdtype(r, dtype)
+    return(_trajcolumns(layout.n_levels, _recordfields(r, record, fields), fields, dtype != np.float64)[1])
 
 
 ## Transform parameters
 
 def hgf_transp(r, ptrans):
     """transform parameters to native space"""
-    # initialize nan array
-    pvec = np.empty(len(ptrans))
-    pvec[:] = np.nan
-    
-    # get number of levels
-    l = r['c_prc']['n_levels']
-    
-    # trans to native space
-    pvec[0:l]          = ptrans[0:l]
-    pvec[l:2*l]        = np.exp(ptrans[l:2*l])
-    pvec[2*l:3*l]      = ptrans[2*l:3*l]
-    pvec[3*l:4*l-1]    = np.exp(ptrans[3*l:4*l-1])
-    pvec[4*l-1:5*l-1]  = ptrans[4*l-1:5*l-1]
-    # for continuus hgf
-    if not 'binary' in r['c_prc']['model']:
-        pvec[5*l-1]    = np.exp(ptrans[5*l-1])
-    return(pvec)
+    # sa_0, ka (and pi_u for continuus hgf) are estimated in log space, see PrcLayout
+    return(prc_layout(r['c_prc']).transp(ptrans))
 
 def unitsq_sqm_transp(r, ptrans):
     """transform parameters to native space"""
@@ -465,7 +515,7 @@ def bayes_optimal_binary(r, infStates, ptrans):
     res[:]   = np.nan
     
     # remove irregulars 
-    u = r['u'][:]                
+    u = _inputvalues(r)
     u = np.delete(u, r['irr'])     # for inputs
     x = infStates[:,0,0]
     x = np.delete(x, r['irr'])     # and for predictions
@@ -490,7 +540,7 @@ def bayes_optimal(r, infStates, ptrans):
     res[:]   = np.nan
     
     # remove irregulars 
-    u = r['u'][:]                
+    u = _inputvalues(r)
     u = np.delete(u, r['irr'])     # for inputs
 
     # predictions
@@ -524,7 +574,7 @@ def gaussian_obs(r, infStates, ptrans):
     res[:]   = np.nan
     
     # remove irregulars 
-    u = r['u'][:]                
+    u = _inputvalues(r)
     u = np.delete(u, r['irr'])     # for inputs
     
     # zeta to native
@@ -558,7 +608,7 @@ def unitsq_sgm(r, infStates, ptrans):
     res[:]   = np.nan
     
     # remove irregulars 
-    u = r['u'][:]                
+    u = _inputvalues(r)
     u = np.delete(u, r['irr'])     # for inputs
     
     # zeta to native
@@ -591,23 +641,130 @@ def unitsq_sgm(r, infStates, ptrans):
 
 def _unpack_para(p, r):
     """inside function, not to be called from outside
-    takes in parameters and unpack them"""
-    # get number of levels
-    l = r['c_prc']['n_levels']
-    
-    # unpack parameters into dict
-    p_dict = {}
-    p_dict['mu_0']    = p[0:l]
-    p_dict['sa_0']    = p[l:2*l]
-    p_dict['rho']     = p[2*l:3*l]
-    p_dict['ka']      = p[3*l:4*l-1]
-    p_dict['om']      = p[4*l-1:5*l-2]
-    with np.errstate(divide='ignore'): p_dict['th'] = np.exp(p[5*l-2])
-    # for continuus hgf
-    if not 'binary' in r['c_prc']['model']:
-        p_dict['pi_u']  = p[5*l-1]
-        p_dict['al']    = 1/p[5*l-1]
-    return(p_dict)
+    takes in parameters and unpack them (slices of the cached PrcLayout)"""
+    return(prc_layout(r['c_prc']).unpack(p))
+
+
+def _setmodel(r, model):
+    """inside function, not to be called from outside
+    returns r with the model name of r['c_prc'] set, r itself is left untouched
+    (shallow copies only when the name differs, so concurrent calls never share a written config)"""
+    if r['c_prc']['model'] == model: return(r)
+    if isinstance(r['c_prc'], PrcConfig): return({**r, 'c_prc': r['c_prc'].replace(model=model)})
+    return({**r, 'c_prc': {**r['c_prc'], 'model': model}})
+
+
+def _recordfields(r, record, fields):
+    """inside function, not to be called from outside
+    returns set of trajectory fields to record, record given as argument overrides
+    r['c_prc']['record'], None keeps all fields"""
+    if record is None: record = r['c_prc'].get('record', None)
+    if record is None: return(set(fields))
+    record = set(record)
+    if not record <= set(fields):
+        raise ValueError('Unknown trajectory fields {}, choose from {}'.format(sorted(record - set(fields)), fields))
+    return(record)
+
+
+def _trajcolumns(l, record, fields, split=False):
+    """inside function, not to be called from outside
+    column layout of the trajectory buffer, returns dict of column slices per field and the buffer width
+    mu^, sa^, mu and sa are interleaved per level, so that the first 4*l columns are infStates,
+    with split the precisions are not part of the buffer (kept in float64 next to a lower precision buffer)"""
+    cols  = {'mu_hat': slice(0, 4*l, 4), 'sa_hat': slice(1, 4*l, 4),
+             'mu'    : slice(2, 4*l, 4), 'sa'    : slice(3, 4*l, 4)}
+    width = 4*l
+    sizes = [] if split else [('pi', l), ('pi_hat', l)]
+    sizes += [('v', l), ('w', l-1), ('da', l)]
+    if 'dau' in fields: sizes.append(('dau', 1))
+    if record & {'psi', 'epsi', 'wt'}: sizes.append(('psi', l))  # also needed for epsi and wt
+    sizes += [(field, l) for field in ['ud', 'epsi', 'wt'] if field in record]
+    for field, size in sizes:
+        cols[field] = slice(width, width+size)
+        width += size
+    return(cols, width)
+
+
+def _trajbuffer(r, n, record, fields, out=None, dtype=None):
+    """inside function, not to be called from outside
+    returns nan filled buffer of n rows (or out) and dict of views into it for every field
+    for buffers below float64 precision the precisions pi and pi^ are kept in a separate float64 array"""
+    l     = r['c_prc']['n_levels']
+    dtype = _trajdtype(r, dtype) if out is None else out.dtype
+    split = dtype != np.float64
+    cols, width = _trajcolumns(l, record, fields, split)
+    if out is None:
+        buf = np.empty((n, width), dtype=dtype)
+    elif out.shape != (n, width):
+        raise ValueError('out should have shape {}, not {}'.format((n, width), out.shape))
+    else:
+        buf = out
+    buf[:] = np.nan
+    x = {field: buf[:,col] for field, col in cols.items()}
+    if split:
+        prec = np.full((n, 2*l), np.nan)
+        x['pi'], x['pi_hat'] = prec[:,:l], prec[:,l:]
+    return(buf, x)
+
+
+def _trajdtype(r, dtype=None):
+    """inside function, not to be called from outside
+    storage dtype of the trajectories, dtype given as argument overrides r['c_prc']['dtype']"""
+    if dtype is None: dtype = r['c_prc'].get('dtype', None)
+    return(np.dtype(np.float64 if dtype is None else dtype))
+
+
+def _tosink(prc_fun, r, p, trans, record, dtype, sink, hooks=None):
+    """inside function, not to be called from outside
+    runs prc_fun over r['u'] in chunks of sink.chunksize trials, continuing the representations between
+    chunks, and writes every trajectory chunk to sink, returns [trajectories of the sink, None]"""
+    if trans: p = r['c_prc']['transp_prc_fun'](r, p)
+    size, n, state = getattr(sink, 'chunksize', 100000), r['u'].shape[-1], {}
+    for start in range(0, n, size):
+        u  = r['u'][..., start:start+size]
+        rc = {**r, 'u': u, 'ign': np.argwhere(np.isnan(u))}
+        traj, infStates = prc_fun(rc, p, record=record, state=state, dtype=dtype, hooks=hooks)
+        sink.write(start, traj)
+    return([sink.result(), None])
+
+
+def _inputvalues(r):
+    """inside function, not to be called from outside
+    input values of r['u'], for irregular intervals r['u'] is [2, x] with the time deltas second"""
+    return(r['u'][0] if np.ndim(r['u']) == 2 else r['u'])
+
+
+def _ignmask(r, n):
+    """inside function, not to be called from outside
+    boolean mask of ignored trials over the n trials including the zeroth (prior) trial
+    r['ign'] holds input indices (argwhere of nan inputs), trial k of the loop is input k-1"""
+    ign = np.zeros(n, dtype=bool)
+    idx = np.asarray(r['ign'], dtype=int)
+    if idx.size: ign[idx.reshape(len(idx), -1)[:,-1] + 1] = True
+    return(ign)
+
+
+def _loadstate(state, **rows):
+    """inside function, not to be called from outside
+    sets the zeroth (prior) trial of the given arrays to a stored state"""
+    for key, arr in rows.items(): arr[0] = state[key]
+
+
+def _savestate(state, **rows):
+    """inside function, not to be called from outside
+    stores the last trial of the given arrays in state"""
+    for key, arr in rows.items(): state[key] = arr[-1].copy()
+
+
+def _acf(x, nlags):
+    """inside function, not to be called from outside
+    autocorrelation of x for lags 0..nlags computed with an FFT (nan counts as 0)"""
+    x = np.nan_to_num(np.asarray(x, dtype=float))
+    x = x - x.mean()
+    n = len(x)
+    f = np.fft.rfft(x, n=1 << int(2*n-1).bit_length())   # zero padded, no circular overlap
+    ac = np.fft.irfft(f * np.conj(f))[:nlags+1]
+    return(ac / ac[0] if ac[0] != 0 else ac)
 
 
 def _sgm(x, a):
@@ -0,0 +1,125 @@
+""" Asyncio wrappers for model fitting and model simulation of the Hierarchical Gaussian Filter
+blocking fits and simulations are offloaded to an executor, so an event loop stays responsive
+
+Model implemented as discribed in: Mathys, C. D., Lomakina, E. I., Daunizeau, J., Iglesias, S., Brodersen, K. H., Friston, K. J., & Stephan, K. E. (2014). Uncertainty in perception and the Hierarchical Gaussian Filter. Frontiers in human neuroscience, 8, 825.
+
+Code adapted by Jorie van Haren (2021) """
+
+# load nessecary packages
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# load config files, fit and sim functions
+from HGF.hgf_config import *
+from HGF.hgf_fit import fitModel, _batchOpt
+from HGF.hgf_sim import simModel
+
+##########################
+## MAIN ASYNC FUNCTIONS ##
+##########################
+
+async def fit_async(responses, inputs,
+                    per_model=ehgf_binary_config,
+                    obs_model=unitsq_sgm_config,
+                    opt_model=quasinewton_optim_config,
+                    overwrite_opt=False,
+                    executor=None,
+                    timeout=None):
+    """Coroutine version of fitModel (see fitModel for the model inputs)
+    optional inputs:
+            executor = concurrent.futures executor to run the fit in (see make_executor)
+                       default None uses the default executor of the running loop
+            timeout  = seconds to wait for the result, raises asyncio.TimeoutError when exceeded
+    note: on cancellation or timeout a fit that did not start yet is dropped,
+          a fit that already runs in a worker finishes in the background and its result is discarded
+    output:
+            returns the dict r of fitModel
+    """
+    func = functools.partial(fitModel, responses, inputs,
+                             per_model=per_model,
+                             obs_model=obs_model,
+                             opt_model=opt_model,
+                             overwrite_opt=overwrite_opt)
+    return(await _run(func, executor, timeout))
+
+
+async def simulate_async(inputs, prc_model, prc_pvec,
+                         executor=None,
+                         timeout=None,
+                         **kwargs):
+    """Coroutine version of simModel (see simModel for the model inputs)
+    remaining keyword arguments (obs_model, obs_pvec, overwrite_opt, seed) are passed to simModel
+    optional inputs:
+            executor = concurrent.futures executor to run the simulation in (see make_executor)
+            timeout  = seconds to wait for the result, raises asyncio.TimeoutError when exceeded
+    output:
+            returns the dict r of simModel
+    """
+    func = functools.partial(simModel, inputs, prc_model, prc_pvec, **kwargs)
+    return(await _run(func, executor, timeout))
+
+
+async def fit_many_async(cohort,
+                         per_model=ehgf_binary_config,
+                         obs_model=unitsq_sgm_config,
+                         opt_model=quasinewton_optim_config,
+                         overwrite_opt=False,
+                         executor=None,
+                         limit=None,
+                         timeout=None,
+                         return_exceptions=False,
+                         max_time=None,
+                         max_eval=None):
+    """Fit many subjects concurrently with at most limit fits in flight
+    input:
+            cohort = list of (responses, inputs) tuples, or a dict {subject: (responses, inputs)}
+    optional inputs:
+            limit   = maximum number of concurrent fits, default None means no bound
+            timeout = seconds per fit
+            max_time = wall-clock budget of the optimization per fit (c_opt maxTime, see fitModel),
+                       unlike timeout the fit still returns its best point so far
+            max_eval = maximum number of objective evaluations per fit (c_opt maxEval)
+            return_exceptions = if True failed or timed out fits return their exception
+                                instead of cancelling the remaining fits
+    output:
+            returns a list of r dicts in cohort order (or dict {subject: r} for dict input)
+    """
+    items = list(cohort.items()) if isinstance(cohort, dict) else list(enumerate(cohort))
+    sem   = asyncio.Semaphore(limit) if limit else None
+    batch_opt = _batchOpt(overwrite_opt, max_time, max_eval)  # residual diagnostics off unless set in overwrite_opt
+
+    async def one(data):
+        responses, inputs = data
+        if sem is None:
+            return(await fit_async(responses, inputs, per_model, obs_model, opt_model,
+                                   batch_opt, executor=executor, timeout=timeout))
+        async with sem:
+            return(await fit_async(responses, inputs, per_model, obs_model, opt_model,
+                                   batch_opt, executor=executor, timeout=timeout))
+
+    fits = await asyncio.gather(*[one(data) for key, data in items],
+                                return_exceptions=return_exceptions)
+    if isinstance(cohort, dict):
+        return(dict(zip(cohort.keys(), fits)))
+    return(fits)
+
+
+def make_executor(kind='thread', max_workers=None):
+    """create an executor for the async functions
+    kind = 'thread' (numpy releases the GIL in its array functions) or
+           'process' (full parallelism, inputs and results are pickled)"""
+    if kind == 'thread':    return(ThreadPoolExecutor(max_workers=max_workers))
+    elif kind == 'process': return(ProcessPoolExecutor(max_workers=max_workers))
+    raise ValueError("executor kind should be 'thread' or 'process', not '{}'".format(kind))
+
+
+## Helper functions
+
+async def _run(func, executor, timeout):
+    """internal function, runs func in executor and awaits it with an optional timeout"""
+    loop = asyncio.get_running_loop()
+    fut  = loop.run_in_executor(executor, func)
+    if timeout is None:
+        return(await fut)
+    return(await asyncio.wait_for(fut, timeout))
@@ -0,0 +1,408 @@
+""" Fuctions for fitting many subjects and models of the Hierarchical Gaussian Filter in parallel
+and comparing the resulting models on group level
+
+Model implemented as discribed in: Mathys, C. D., Lomakina, E. I., Daunizeau, J., Iglesias, S., Brodersen, K. H., Friston, K. J., & Stephan, K. E. (2014). Uncertainty in perception and the Hierarchical Gaussian Filter. Frontiers in human neuroscience, 8, 825.
+
+Random effects model comparison as discribed in: Stephan, K. E., Penny, W. D., Daunizeau, J., Moran, R. J., & Friston, K. J. (2009). Bayesian model selection for group studies. Neuroimage, 46(4), 1004-1017.
+
+Code adapted by Jorie van Haren (2021) """
+
+# load nessecary packages
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from scipy.special import digamma
+
+# load config files and fit functions
+from HGF.hgf_config import *
+from HGF.hgf_fit import _dataPrep, _fitPrepped, _batchOpt
+
+# prepared cohort data, set once per pool worker (see _initWorker)
+_cohort = {}
+_worker = {'outdir' : None, 'segments' : []}
+
+##########################
+## MAIN BATCH FUNCTIONS ##
+##########################
+
+def compareModels(cohort, models,
+                  opt_model=quasinewton_optim_config,
+                  n_jobs=None,
+                  xp_samples=int(1e5),
+                  seed=0,
+                  backend='process',
+                  max_time=None,
+                  max_eval=None):
+    """Fit every subject of a cohort under every model of a model space and compare models
+    using random effects Bayesian model selection
+    input:
+            cohort = list of (responses, inputs) tuples, one per subject
+                     or a dict {subject: (responses, inputs)}
+            models = list of (per_model, obs_model, overwrite_opt) tuples (see fitModel)
+                     - overwrite_opt may be False, e.g. (hgf_binary_config, unitsq_sgm_config, False)
+                     - residual diagnostics are off unless overwrite_opt sets c_opt resDiag
+    optional inputs:
+            opt_model  = what optimization model to use for all fits
+            n_jobs     = number of worker processes (default all cores), 1 fits serially
+            xp_samples = number of dirichlet samples used for the exceedance probabilities
+            seed       = random seed for exceedance probability sampling
+            backend    = 'process' (worker processes) or 'thread' (thread pool in this process,
+                         no data transport, numpy releases the GIL in its array functions)
+            max_time   = wall-clock budget per fit in seconds (c_opt maxTime, see fitModel)
+            max_eval   = maximum number of objective evaluations per fit (c_opt maxEval)
+    output:
+            returns a dict c with
+            c['subjects'] / c['models'] = row and column labels
+            c['LME'], c['AIC'], c['BIC'] = (n_subjects, n_models) arrays
+            c['fits'] = nested list of fitted r dicts [subject][model]
+            c['bms']  = random effects model comparison (see bms)
+    """
+    # prepare all subject data once, shared by all model fits
+    subjects, preps = _prepCohort(cohort)
+
+    # every combination of subject and model is one job
+    jobs = [(s, m) for s in range(len(subjects)) for m in range(len(models))]
+    tasks = [(subjects[s],) + tuple(models[m][:2]) + (_batchOpt(models[m][2], max_time, max_eval), opt_model) for s, m in jobs]
+    fits = _runFits(preps, tasks, n_jobs, backend)
+
+    # collect results in subject by model matrices
+    c = {}
+    c['subjects'] = subjects
+    c['models']   = _modelLabels(models)
+    c['fits']     = [[None] * len(models) for s in subjects]
+    for (s, m), r in zip(jobs, fits):
+        c['fits'][s][m] = r
+    for item in ['LME', 'AIC', 'BIC']:
+        c[item] = np.array([[r['optim'][item] for r in row] for row in c['fits']])
+
+    # random effects model comparison over the log model evidences
+    c['bms'] = bms(c['LME'], n_samples=xp_samples, seed=seed)
+    return(c)
+
+
+def fitGroup(cohort,
+             per_model=ehgf_binary_config,
+             obs_model=unitsq_sgm_config,
+             opt_model=quasinewton_optim_config,
+             overwrite_opt=False,
+             n_jobs=None,
+             backend='process',
+             max_iter=20,
+             tol=1e-3,
+             min_var=1e-3,
+             max_time=None,
+             max_eval=None):
+    """Hierarchical (empirical Bayes) group fit of one model
+    alternates between fitting all subjects in parallel under the current group prior, warm-started
+    from their previous estimates, and setting the group prior of every free parameter to the mean and
+    variance of the subject posteriors (mean of the posterior means, their spread plus the mean posterior
+    variance), until the group prior changes less than tol
+    input:
+            cohort = list of (responses, inputs) tuples, one per subject
+                     or a dict {subject: (responses, inputs)}
+    optional inputs:
+            per_model, obs_model, opt_model, overwrite_opt = model to fit (see fitModel),
+                       the configured priors are the starting group prior, the posterior variances come from
+                       finite difference hessians (c_opt numHess) unless overwrite_opt sets numHess
+            n_jobs     = number of workers (default all cores), 1 fits serially
+            backend    = 'process' or 'thread' (see compareModels)
+            max_iter   = maximum number of group iterations
+            tol        = convergence, largest change of a group mean or standard deviation
+            min_var    = lower bound of the group prior variances
+            max_time / max_eval = budget per subject fit (see compareModels)
+    output:
+            returns a dict g with
+            g['subjects'] = subject labels
+            g['fits']     = fitted r dicts of the last iteration, in subject order
+            g['priormus'] / g['priorsas'] = group prior, transformed perceptual + observation parameters
+            g['free']     = indices of the parameters with a group prior
+            g['history']  = list of dicts per iteration (priormus, priorsas, sum of negLj, change, seconds)
+            g['converged'], g['iterations']
+    """
+    subjects, preps = _prepCohort(cohort)
+    base = _batchOpt(overwrite_opt, max_time, max_eval)
+    base['c_opt'].setdefault('numHess', True)  # warm-started fits take few iterations, see _optimrun
+
+
+    # configured priors, the starting group prior
+    c_prc = {**per_model(), **base.get('c_prc', {})}
+    c_obs = {**obs_model(), **base.get('c_obs', {})}
+    prior = {'mus'  : np.concatenate([c_prc['priormus'], c_obs['priormus']]).astype(float),
+             'sas'  : np.concatenate([c_prc['priorsas'], c_obs['priorsas']]).astype(float),
+             'n_prc': len(c_prc['priormus'])}
+    group, warm, history = None, [None] * len(subjects), []
+    for it in range(max_iter):
+        start = time.time()
+
+        # fit all subjects under the current group prior, warm-started from their last estimates
+        tasks = []
+        for s, subj in enumerate(subjects):
+            over = {item: dict(val) for item, val in base.items()}
+            if group is not None:
+                over.setdefault('c_prc', {}).update({'priormus': group['mus'][:group['n_prc']],
+                                                     'priorsas': group['sas'][:group['n_prc']]})
+                over.setdefault('c_obs', {}).update({'priormus': group['mus'][group['n_prc']:],
+                                                     'priorsas': group['sas'][group['n_prc']:]})
+            over['c_opt']['init'] = warm[s]
+            tasks.append((subj, per_model, obs_model, over, opt_model))
+        fits = _runFits(preps, tasks, n_jobs, backend)
+        warm = [np.asarray(r['optim']['final']) for r in fits]
+
+        # new group prior from the subject posteriors
+        prev  = group
+        group = _groupPrior(fits, prior, min_var)
+        if prev is None: change = np.inf
+        else:            change = np.max(np.abs(np.concatenate([group['mus'][group['free']] - prev['mus'][group['free']],
+                                                                 np.sqrt(group['sas'][group['free']]) - np.sqrt(prev['sas'][group['free']])])))
+        history.append({'priormus': group['mus'], 'priorsas': group['sas'], 'change': change,
+                        'negLj': np.sum([r['optim']['negLj'] for r in fits]), 'seconds': time.time() - start})
+        if change < tol: break
+
+    g = {}
+    g['subjects']   = subjects
+    g['fits']       = fits
+    g['priormus']   = group['mus']
+    g['priorsas']   = group['sas']
+    g['free']       = group['free']
+    g['history']    = history
+    g['converged']  = bool(history[-1]['change'] < tol)
+    g['iterations'] = len(history)
+    return(g)
+
+
+def bms(lme, n_samples=int(1e5), seed=0, tol=1e-6, max_iter=1000):
+    """Random effects Bayesian model selection on a (n_subjects, n_models) log model evidence matrix
+    variational estimate of the dirichlet posterior over model frequencies
+    output:
+            returns a dict with
+            ['alpha'] = dirichlet parameters of posterior model frequencies
+            ['exp_r'] = expected model frequencies
+            ['xp']    = exceedance probabilities (probability a model is more frequent than all others)
+            ['g']     = (n_subjects, n_models) posterior probability of each model per subject
+    """
+    lme = np.asarray(lme, dtype=float)
+    n_models = lme.shape[1]
+
+    # iterate dirichlet parameters starting from a flat prior
+    alpha0 = np.ones(n_models)
+    alpha  = alpha0.copy()
+    for it in range(max_iter):
+        log_u = lme + digamma(alpha) - digamma(alpha.sum())
+        log_u = log_u - log_u.max(axis=1, keepdims=True)  # avoid overflow
+        g     = np.exp(log_u)
+        g     = g / g.sum(axis=1, keepdims=True)
+        prev  = alpha
+        alpha = alpha0 + g.sum(axis=0)
+        if np.linalg.norm(alpha - prev) < tol: break
+
+    # exceedance probabilities by sampling from the dirichlet posterior
+    rng     = np.random.default_rng(seed)
+    samples = rng.dirichlet(alpha, size=n_samples)
+    xp      = np.bincount(samples.argmax(axis=1), minlength=n_models) / n_samples
+
+    out = {}
+    out['alpha'] = alpha
+    out['exp_r'] = alpha / alpha.sum()
+    out['xp']    = xp
+    out['g']     = g
+    return(out)
+
+
+## Helper functions
+
+def _prepCohort(cohort):
+    """internal function, not to be used from outside
+    returns subject labels and prepared data dicts (see _dataPrep) for a cohort"""
+    if isinstance(cohort, dict):
+        subjects = list(cohort.keys())
+        data     = list(cohort.values())
+    else:
+        subjects = list(range(len(cohort)))
+        data     = list(cohort)
+    preps = {subj: _dataPrep(np.asarray(y), np.asarray(u)) for subj, (y, u) in zip(subjects, data)}
+    return(subjects, preps)
+
+
+def _runFits(preps, tasks, n_jobs=None, backend='process'):
+    """internal function, not to be used from outside
+    fits all tasks (subject, per_model, obs_model, overwrite_opt, opt_model)
+    in a shared worker pool and returns fitted r dicts in task order
+    inputs are placed in shared memory and results are written to memory-mapped
+    files, so workers only receive and return descriptors of large arrays
+    with backend 'thread' the fits run in a thread pool on the prepared dicts directly"""
+    if backend not in ['process', 'thread']:
+        raise ValueError("backend should be 'process' or 'thread', not '{}'".format(backend))
+    if n_jobs is None: n_jobs = os.cpu_count()
+    n_jobs = max(1, min(n_jobs, len(tasks)))
+
+    # serial fallback, no need for a pool
+    if n_jobs == 1:
+        return([_fitTask(task, preps) for task in tasks])
+
+    # fits do not change shared state, so threads can share the prepared dicts
+    if backend == 'thread':
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            return(list(pool.map(_fitTask, tasks, [preps] * len(tasks))))
+
+    # place inputs in shared memory, workers attach to them once
+    segments = []
+    outdir   = tempfile.mkdtemp(prefix='hgf_')
+    try:
+        shared = {subj: _shareArrays(prep, segments) for subj, prep in preps.items()}
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=_initWorker,
+                                 initargs=(shared, outdir)) as pool:
+            fits = [_loadArrays(r, preps[task[0]]) for task, r in zip(tasks, pool.map(_fitTask, tasks))]
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+        shutil.rmtree(outdir, ignore_errors=True)
+    return(fits)
+
+
+def _initWorker(shared, outdir):
+    """internal function, attaches a pool worker to the shared cohort data"""
+    _cohort.clear()
+    _cohort.update({subj: _attachArrays(prep) for subj, prep in shared.items()})
+    _worker['outdir'] = outdir
+
+
+def _fitTask(task, preps=None):
+    """internal function, fits one subject under one model
+    in a pool worker (preps None) trajectories are written directly into a memory-mapped file,
+    other large result arrays are written to disk after the fit"""
+    subj, per_model, obs_model, overwrite_opt, opt_model = task
+    if preps is not None:
+        return(_fitPrepped(preps[subj], per_model, obs_model, opt_model, overwrite_opt))
+    stem, bufs = os.path.join(_worker['outdir'], uuid.uuid4().hex), []
+    r = _fitPrepped(_cohort[subj], per_model, obs_model, opt_model, overwrite_opt,
+                    traj_out=_trajFile('{}_traj.npy'.format(stem), bufs))
+    return(_dumpArrays(r, stem, bufs[0] if bufs else None))
+
+
+## Zero-copy transport helpers
+
+def _shareArrays(prep, segments):
+    """internal function, not to be used from outside
+    copies input arrays (u, y) of a prepared dict into shared memory
+    returns a copy of prep with these arrays replaced by ('shm', name, shape, dtype) descriptors"""
+    prep = dict(prep)
+    for key in ['u', 'y']:
+        arr = np.ascontiguousarray(prep[key])
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        segments.append(shm)
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        prep[key] = ('shm', shm.name, arr.shape, arr.dtype.str)
+    return(prep)
+
+
+def _attachArrays(prep):
+    """internal function, not to be used from outside
+    replaces shared memory descriptors by read-only array views on the segment"""
+    prep = dict(prep)
+    for key, val in prep.items():
+        if isinstance(val, tuple) and val[:1] == ('shm',):
+            shm = shared_memory.SharedMemory(name=val[1])
+            _worker['segments'].append(shm)  # keep segment mapped for lifetime of worker
+            arr = np.ndarray(val[2], dtype=np.dtype(val[3]), buffer=shm.buf)
+            arr.flags.writeable = False
+            prep[key] = arr
+    return(prep)
+
+
+def _trajFile(path, bufs):
+    """internal function, not to be used from outside
+    traj_out function for _fitPrepped, maps the trajectory buffer to a new .npy file at path (kept in bufs)"""
+    def out(shape, dtype):
+        bufs.append(np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape))
+        return(bufs[-1])
+    return(out)
+
+
+def _dumpArrays(r, stem, buf=None):
+    """internal function, not to be used from outside
+    trajectories that are views into the memory-mapped buffer buf (see _trajFile) become
+    ('npycols', path, column, n_columns, step) descriptors, the remaining trajectories and per trial
+    optimization results of r are written into memory-mapped .npy files
+    returns a copy of r without inputs and with these arrays replaced by ('npy', path) descriptors"""
+    r = dict(r)
+    r.pop('u'), r.pop('y')
+    if buf is not None: buf.flush()
+    for item, keys in [('traj', list(r['traj'].keys())), ('optim', ['yhat', 'res', 'resAC'])]:
+        r[item] = dict(r[item])
+        for key in keys:
+            if key not in r[item]: continue
+            arr = np.asarray(r[item][key])
+            if buf is not None and item == 'traj' and np.shares_memory(arr, buf):
+                # buf[1:, col:col+n*step:step], located by its offset in the buffer
+                col = (arr.ctypes.data - buf.ctypes.data) // buf.itemsize - buf.shape[1]
+                r[item][key] = ('npycols', buf.filename, col, arr.shape[1], arr.strides[1] // buf.itemsize)
+                continue
+            path = '{}_{}_{}.npy'.format(stem, item, key)
+            out  = np.lib.format.open_memmap(path, mode='w+', dtype=arr.dtype, shape=arr.shape)
+            out[...] = arr
+            out.flush()
+            del out
+            r[item][key] = ('npy', path)
+    return(r)
+
+
+def _loadArrays(r, prep):
+    """internal function, not to be used from outside
+    restores inputs and maps the files written by _dumpArrays back into r
+    arrays are mapped read-only and the files are unlinked directly, the mapping stays valid
+    until the arrays are released"""
+    r['u'], r['y'] = prep['u'], prep['y']
+    mapped = {}
+    for item in ['traj', 'optim']:
+        for key, val in r[item].items():
+            if not isinstance(val, tuple) or val[:1] not in [('npy',), ('npycols',)]: continue
+            if val[1] not in mapped: mapped[val[1]] = np.load(val[1], mmap_mode='r')
+            if val[0] == 'npy': r[item][key] = mapped[val[1]]
+            else:               r[item][key] = mapped[val[1]][1:, val[2]:val[2]+val[3]*val[4]:val[4]]
+    for path in mapped:
+        try:    os.remove(path)
+        except OSError: pass  # e.g. windows, removed with the directory instead
+    return(r)
+
+
+def _groupPrior(fits, prior, min_var):
+    """internal function, not to be used from outside
+    group prior (transformed perceptual + observation parameters) from subject posteriors
+    only parameters that are free in every subject get a new prior, the others keep the configured values
+    of prior (including data dependent placeholders, so they are set per subject again)"""
+    mus, sas = prior['mus'].copy(), prior['sas'].copy()
+
+    # posterior means and variances of the free parameters of every subject
+    frees, means, vars_ = [], [], []
+    for r in fits:
+        sa   = np.concatenate([r['c_prc']['priorsas'], r['c_obs']['priorsas']])
+        free = np.nonzero([0 if np.isnan(i) else i for i in sa])[0]
+        var  = np.full(len(sa), np.nan)
+        var[free] = np.diag(r['optim']['Sigma'])
+        frees.append(set(free))
+        means.append(np.asarray(r['optim']['final'], dtype=float))
+        vars_.append(var)
+    free  = np.array(sorted(set.intersection(*frees)), dtype=int)
+    means = np.array(means)[:, free]
+    vars_ = np.array(vars_)[:, free]
+
+    # empirical Bayes update of the gaussian group prior
+    mus[free] = means.mean(axis=0)
+    sas[free] = np.maximum(((means - mus[free])**2 + vars_).mean(axis=0), min_var)
+    return({'mus': mus, 'sas': sas, 'free': free, 'n_prc': prior['n_prc']})
+
+
+def _modelLabels(models):
+    """internal function, returns readable labels for a list of models"""
+    labels = ['{}/{}'.format(m[0].__name__.replace('_config', ''),
+                             m[1].__name__.replace('_config', '')) for m in models]
+    # number duplicates (e.g. same models with different level overwrites)
+    return(['{} ({})'.format(lab, i) if labels.count(lab) > 1 else lab
+            for i, lab in enumerate(labels)])
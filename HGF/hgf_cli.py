@@ -0,0 +1,230 @@
+""" Command line entry point for batch model fitting and model simulation of the Hierarchical Gaussian Filter
+subjects are read from a directory or manifest of plain text files (same format as demo_files/)
+
+usage:  hgf fit      DATA -o OUT [-j N] [--per-model ehgf_binary] [--obs-model unitsq_sgm] [--store fits.sqlite]
+        hgf simulate DATA -o OUT [-j N] --prc-model ehgf_binary --prc-pvec "nan,0,1,..." [--obs-model unitsq_sgm --obs-pvec 5]
+        hgf bench    DATA [-j N] [--repeat 3]
+
+DATA is either
+  - a directory with <subject>_input.txt files and (optional) <subject>_response.txt files
+  - a manifest (.csv or .tsv) with columns subject, inputs and (optional) responses,
+    paths are relative to the manifest
+
+results are stored per subject with save_fit (load them with HGF.hgf_io.load_fit) as
+<subject>_fit_<fingerprint>.npz / <subject>_sim_<fingerprint>.npz, with the first characters of a fingerprint
+of the model options, subjects whose result file for the same options already exists in OUT are skipped,
+so an interrupted run can simply be restarted (and a run with other options does not skip anything),
+with --store a subject is only skipped when its fit is also in the store
+
+Model implemented as discribed in: Mathys, C. D., Lomakina, E. I., Daunizeau, J., Iglesias, S., Brodersen, K. H., Friston, K. J., & Stephan, K. E. (2014). Uncertainty in perception and the Hierarchical Gaussian Filter. Frontiers in human neuroscience, 8, 825.
+
+Code adapted by Jorie van Haren (2021) """
+
+# load nessecary packages
+import os
+import io
+import csv
+import sys
+import time
+import hashlib
+import argparse
+import contextlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# load fit and sim functions
+from HGF.hgf_fit import fitModel, _storedfunc, _storedconfig, _batchOpt
+from HGF.hgf_sim import simModel
+from HGF.hgf_io import save_fit
+from HGF.hgf_store import open_store, store_fit, has_fit, config_fingerprint, data_hash
+
+INPUT_SUFFIX      = '_input.txt'
+RESPONSE_SUFFIX   = '_response.txt'
+FINGERPRINT_CHARS = 10  # characters of the options fingerprint in result file names
+
+#######################
+## MAIN CLI FUNCTION ##
+#######################
+
+def main(argv=None):
+    """run the hgf command line interface, returns exit code"""
+    args = _parser().parse_args(argv)
+    subjects = readSubjects(args.data)
+    if not subjects:
+        print('No subjects found in {}'.format(args.data))
+        return(1)
+
+    # fits are also appended to a result store (written from this process only)
+    con = None
+    if getattr(args, 'store', None): con = open_store(args.store)
+
+    # skip subjects that are already done with the same options (resume)
+    if args.command in ['fit', 'simulate']:
+        os.makedirs(args.out, exist_ok=True)
+        args.fingerprint = _fingerprint(args)
+        todo = [s for s in subjects if not _done(args, s, con)]
+        print('{} subjects, {} already done, {} to run'.format(len(subjects), len(subjects)-len(todo), len(todo)))
+    else:
+        todo = [s for s in subjects for rep in range(args.repeat)]
+
+    # run subjects on the worker pool
+    start, results = time.time(), []
+    n_jobs = max(1, min(args.jobs, len(todo))) if todo else 1
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(_runSubject, args, s) for s in todo]
+        for fut in as_completed(futures):
+            res = fut.result()
+            if con is not None and 'fit' in res:
+                store_fit(con, res['subject'], res.pop('fit'), args.fingerprint, res.pop('data_hash'),
+                          seconds=res['time'], traj_path=os.path.abspath(_outPath(args, res['subject'])))
+            results.append(res)
+            print(' {:<24} {:<6} {:8.2f}s {}'.format(str(res['subject']), res['status'], res['time'], res.get('error', '')))
+    total = time.time() - start
+
+    # summarize
+    failed = [res for res in results if res['status'] != 'ok']
+    if args.command == 'bench' and results:
+        times = np.array([res['time'] for res in results if res['status'] == 'ok'])
+        if times.size:
+            print('\nBENCH: {} runs on {} workers in {:.2f}s ({:.2f} runs/s)'.format(times.size, n_jobs, total, times.size/total))
+            print(' per run: mean {:.3f}s, median {:.3f}s, min {:.3f}s, max {:.3f}s'.format(
+                  times.mean(), np.median(times), times.min(), times.max()))
+    if con is not None: con.close()
+    print('\nDone: {} ok, {} failed ({:.2f}s)'.format(len(results)-len(failed), len(failed), total))
+    return(1 if failed else 0)
+
+
+def readSubjects(data):
+    """read subject list from a directory or a .csv/.tsv manifest
+    returns list of dicts with subject, inputs path and responses path (or None)"""
+    subjects = []
+    if os.path.isdir(data):
+        for fname in sorted(os.listdir(data)):
+            if not fname.endswith(INPUT_SUFFIX): continue
+            subj = fname[:-len(INPUT_SUFFIX)]
+            resp = os.path.join(data, subj + RESPONSE_SUFFIX)
+            subjects.append({'subject'  : subj,
+                             'inputs'   : os.path.join(data, fname),
+                             'responses': resp if os.path.exists(resp) else None})
+    else:
+        root = os.path.dirname(os.path.abspath(data))
+        with open(data, newline='') as f:
+            for row in csv.DictReader(f, delimiter='\t' if data.endswith('.tsv') else ','):
+                resp = (row.get('responses') or '').strip()
+                subjects.append({'subject'  : row['subject'].strip(),
+                                 'inputs'   : os.path.join(root, row['inputs'].strip()),
+                                 'responses': os.path.join(root, resp) if resp else None})
+    return(subjects)
+
+
+## Helper functions
+
+def _parser():
+    """internal function, builds the argument parser"""
+    parser = argparse.ArgumentParser(prog='hgf', description='Batch fitting and simulation of the Hierarchical Gaussian Filter')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    for name, helptext in [('fit', 'fit models to every subject'),
+                           ('simulate', 'simulate every subject'),
+                           ('bench', 'time model fits without writing results')]:
+        p = sub.add_parser(name, help=helptext)
+        p.add_argument('data', help='directory with <subject>{} files or a .csv/.tsv manifest'.format(INPUT_SUFFIX))
+        p.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of parallel workers')
+        p.add_argument('-v', '--verbose', action='store_true', help='show output of the fit functions')
+        if name != 'bench':
+            p.add_argument('-o', '--out', required=True, help='output directory for per subject results')
+        if name == 'fit':
+            p.add_argument('--store', default=None, help='sqlite result store, fits already in the store are skipped')
+        if name == 'bench':
+            p.add_argument('--repeat', type=int, default=1, help='number of fits per subject')
+        if name in ['fit', 'bench']:
+            p.add_argument('--per-model', default='ehgf_binary', help='perceptual model (e.g. hgf, ehgf, hgf_binary)')
+            p.add_argument('--obs-model', default='unitsq_sgm', help='observation model (e.g. bayes_optimal_binary)')
+            p.add_argument('--opt-model', default='quasinewton_optim', help='optimization model')
+            p.add_argument('--res-diag', action='store_true', help='compute residual diagnostics (autocorrelation) for every fit')
+            p.add_argument('--max-time', type=float, default=None, help='wall-clock budget per fit in seconds')
+            p.add_argument('--max-eval', type=int, default=None, help='maximum number of objective evaluations per fit')
+        else:
+            p.add_argument('--prc-model', required=True, help='perceptual model function (e.g. hgf, ehgf_binary)')
+            p.add_argument('--prc-pvec', required=True, help='comma separated perceptual parameters (nan allowed)')
+            p.add_argument('--obs-model', default=None, help='observation model function (e.g. unitsq_sgm)')
+            p.add_argument('--obs-pvec', type=float, default=None, help='observation parameter')
+            p.add_argument('--seed', type=int, default=0, help='random seed for simulated responses')
+    return(parser)
+
+
+def _fingerprint(args):
+    """internal function, fingerprint of the model options of a fit or simulate run
+    (the config fingerprint of the result store for fits)"""
+    if args.command == 'fit':
+        return(config_fingerprint(_storedconfig(args.per_model),
+                                  _storedconfig(args.obs_model),
+                                  _storedconfig(args.opt_model),
+                                  _batchOpt({'c_opt': {'resDiag': args.res_diag}}, args.max_time, args.max_eval)))
+    options = [args.prc_model, args.prc_pvec, args.obs_model, args.obs_pvec, args.seed]
+    return(hashlib.sha1(repr(options).encode()).hexdigest())
+
+
+def _outPath(args, subj):
+    """internal function, result file of a subject for the options of args"""
+    return(os.path.join(args.out, '{}_{}_{}.npz'.format(subj, 'fit' if args.command == 'fit' else 'sim',
+                                                        args.fingerprint[:FINGERPRINT_CHARS])))
+
+
+def _done(args, subj, con=None):
+    """internal function, whether a subject has a result file for these options (and with a store,
+    whether its fit is stored too, else the fit is redone and the file and stored row are replaced)"""
+    if not os.path.exists(_outPath(args, subj['subject'])): return(False)
+    if con is None: return(True)
+    subj['data_hash'] = data_hash(*_loadSubject(subj))
+    return(has_fit(con, subj['subject'], args.fingerprint, subj['data_hash']))
+
+
+def _loadSubject(subj):
+    """internal function, returns responses and inputs of a subject"""
+    inputs    = np.loadtxt(subj['inputs'], dtype=float)
+    responses = np.loadtxt(subj['responses'], dtype=float) if subj['responses'] else np.array([])
+    return(responses, inputs)
+
+
+def _runSubject(args, subj):
+    """internal function, runs one subject inside a worker and writes its result file"""
+    res   = {'subject': subj['subject'], 'status': 'ok'}
+    start = time.time()
+    try:
+        responses, inputs = _loadSubject(subj)
+        if getattr(args, 'store', None):
+            res['data_hash'] = subj.get('data_hash') or data_hash(responses, inputs)
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            if args.command in ['fit', 'bench']:
+                r = fitModel(responses, inputs,
+                             per_model=_storedconfig(args.per_model),
+                             obs_model=_storedconfig(args.obs_model),
+                             opt_model=_storedconfig(args.opt_model),
+                             overwrite_opt=_batchOpt({'c_opt': {'resDiag': args.res_diag}}, args.max_time, args.max_eval))
+            else:
+                kwargs = {}
+                if args.obs_model: kwargs = {'obs_model': _storedfunc(args.obs_model), 'obs_pvec': args.obs_pvec}
+                r = simModel(inputs, _storedfunc(args.prc_model),
+                             np.array([float(i) for i in args.prc_pvec.split(',')]),
+                             seed=args.seed, **kwargs)
+        if args.command != 'bench':
+            save_fit(_outPath(args, subj['subject']), r)
+        if getattr(args, 'store', None):
+            res['fit'] = _summary(r)
+    except Exception as e:
+        res['status'] = 'failed'
+        res['error']  = repr(e)
+    res['time'] = time.time() - start
+    return(res)
+
+
+def _summary(r):
+    """internal function, r without trajectories and per trial data (send back to be stored)"""
+    r = {key: val for key, val in r.items() if key not in ['traj', 'u', 'y']}
+    r['optim'] = {key: val for key, val in r['optim'].items() if key not in ['yhat', 'res', 'resAC']}
+    return(r)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,7 +8,7 @@ Code adapted by Jorie van Haren (2021) """
 # load nessecary packages
 import numpy as np
 import sys
-import statsmodels.api as sm
+import functools
 from scipy import optimize
 
 ###################
@@ -31,6 +31,8 @@ def hgf_binary_config():
     c['model']      = 'hgf_binary'       # model name
     c['n_levels']   = 3                  # number of levels (min 3)
     c['irregular_intervals'] = False     # input intervals, if input intervals are irregual must be set to True
+    c['record']     = None               # trajectory fields to keep (e.g. ['mu', 'sa']), None keeps all
+    c['dtype']      = 'float64'          # storage dtype of recorded trajectories, 'float32' halves memory (precisions and fitting stay float64)
     
     # initial mus and sigmas (of length n_levels)
     # set for all except first two levels
@@ -88,6 +90,8 @@ def hgf_config():
     c['model']      = 'hgf'       # model name
     c['n_levels']   = 2                  # number of levels (min 2)
     c['irregular_intervals'] = False     # input intervals, if input intervals are irregual must be set to True
+    c['record']     = None               # trajectory fields to keep (e.g. ['mu', 'sa']), None keeps all
+    c['dtype']      = 'float64'          # storage dtype of recorded trajectories, 'float32' halves memory (precisions and fitting stay float64)
     
     # initial mus and sigmas (of length n_levels)
     # set for all except first level
@@ -146,6 +150,8 @@ def ehgf_config():
     c['model']      = 'ehgf'             # model name
     c['n_levels']   = 2                  # number of levels (min 2)
     c['irregular_intervals'] = False     # input intervals, if input intervals are irregual must be set to True
+    c['record']     = None               # trajectory fields to keep (e.g. ['mu', 'sa']), None keeps all
+    c['dtype']      = 'float64'          # storage dtype of recorded trajectories, 'float32' halves memory (precisions and fitting stay float64)
     
     # initial mus and sigmas (of length n_levels)
     # set for all except first level
@@ -203,6 +209,8 @@ def ehgf_binary_config():
     c['model']      = 'ehgf_binary'      # model name
     c['n_levels']   = 3                  # number of levels (min 3)
     c['irregular_intervals'] = False     # input intervals, if input intervals are irregual must be set to True
+    c['record']     = None               # trajectory fields to keep (e.g. ['mu', 'sa']), None keeps all
+    c['dtype']      = 'float64'          # storage dtype of recorded trajectories, 'float32' halves memory (precisions and fitting stay float64)
     
     # initial mus and sigmas (of length n_levels)
     # set for all except first two levels
@@ -381,7 +389,17 @@ def quasinewton_optim_config():
     c['maxIter']   = 1e3    # optimization option: maximum number of itterations 
     c['maxRegu']   = 4     # optimization option: maximum regu
     c['maxRst']    = 4     # optimization option: 
-    c['nRandInit'] = 0
+    c['nRandInit'] = 0      # number of extra starts drawn from the priors (raced against the prior mean start)
+    c['raceIter']  = 5      # optimizer iterations per start per racing round
+    c['raceMargin']= 10     # starts whose neg. log-joint is worse than the best by this margin are pruned
+    c['randSeed']  = 0      # random seed of the extra starts
+    c['init']      = None   # warm start, transformed parameters (perceptual + observation) to start from
+    c['maxTime']   = None   # wall-clock budget of the optimization in seconds (None for no limit)
+    c['maxEval']   = None   # maximum number of objective evaluations (None for no limit)
+    c['numHess']   = False  # hessian (H, Sigma, LME) by finite differences instead of the BFGS estimate
+    c['resDiag']   = True   # residual diagnostics after the fit (off by default in batch fits)
+    c['resLags']   = 40     # number of residual autocorrelation lags (None for all)
+    c['ljungBox']  = False  # also compute the Ljung-Box statistic (LBQ, LBp) over resLags
     
     ##########################################
     
@@ -390,3 +408,143 @@ def quasinewton_optim_config():
     
     return(c)
     
+
+
+
+# configuration objects
+
+class PrcLayout:
+    """Frozen layout of the perceptual parameter vector (see priormus) of a model with n_levels levels
+    index slices, the mask of parameters that are estimated in log space and the model variant flags
+    (binary, enhanced) are computed once, use prc_layout(c_prc) for the cached layout of a config"""
+    __slots__ = ('model', 'n_levels', 'binary', 'enhanced', 'size',
+                 'mu_0', 'sa_0', 'rho', 'ka', 'om', 'th', 'pi_u', 'logmask')
+
+    def __init__(self, model, n_levels):
+        l = int(n_levels)
+        binary = 'binary' in model
+        size   = 5*l-1 if binary else 5*l
+        logmask = np.zeros(size, dtype=bool)
+        logmask[l:2*l] = logmask[3*l:4*l-1] = True   # sa_0 and ka
+        if not binary: logmask[5*l-1] = True          # pi_u
+        logmask.flags.writeable = False
+
+        for key, val in [('model', model), ('n_levels', l), ('binary', binary),
+                         ('enhanced', 'ehgf' in model), ('size', size),
+                         ('mu_0', slice(0, l)), ('sa_0', slice(l, 2*l)), ('rho', slice(2*l, 3*l)),
+                         ('ka', slice(3*l, 4*l-1)), ('om', slice(4*l-1, 5*l-2)), ('th', 5*l-2),
+                         ('pi_u', None if binary else 5*l-1), ('logmask', logmask)]:
+            object.__setattr__(self, key, val)
+
+    def __setattr__(self, key, val):
+        raise AttributeError('{} is frozen'.format(type(self).__name__))
+
+    def __repr__(self):
+        return('PrcLayout(model={!r}, n_levels={})'.format(self.model, self.n_levels))
+
+    def unpack(self, p):
+        """native parameter vector p to dict of parameters (views of p)"""
+        p_dict = {'mu_0': p[self.mu_0], 'sa_0': p[self.sa_0], 'rho': p[self.rho],
+                  'ka'  : p[self.ka],   'om'  : p[self.om]}
+        with np.errstate(divide='ignore'): p_dict['th'] = np.exp(p[self.th])
+        if self.pi_u is not None:
+            p_dict['pi_u'] = p[self.pi_u]
+            p_dict['al']   = 1/p[self.pi_u]
+        return(p_dict)
+
+    def transp(self, ptrans):
+        """transformed parameter vector to native space"""
+        pvec = np.array(ptrans, dtype=float)
+        pvec[self.logmask] = np.exp(pvec[self.logmask])
+        return(pvec)
+
+    @classmethod
+    def from_dict(cls, c):
+        """(cached) layout of config dict c"""
+        return(prc_layout(c))
+
+    def to_dict(self):
+        return({'model': self.model, 'n_levels': self.n_levels})
+
+
+class PrcConfig:
+    """Frozen perceptual config, built once from a config dict (e.g. PrcConfig.from_dict(hgf_binary_config()))
+    it can be used as r['c_prc'] in place of the dict, read access (c['key'], c.get, in, keys, items, values,
+    iteration, len) works as for the dict, arrays are read-only, and the parameter layout is available as c.layout"""
+    __slots__ = ('model', 'n_levels', 'irregular_intervals', 'record', 'dtype',
+                 'priormus', 'priorsas', 'prc_fun', 'transp_prc_fun', 'layout', '_extra')
+    _FIELDS = ('model', 'n_levels', 'irregular_intervals', 'record', 'dtype',
+               'priormus', 'priorsas', 'prc_fun', 'transp_prc_fun')
+
+    def __init__(self, **c):
+        for key in self._FIELDS:
+            object.__setattr__(self, key, _frozen(c.pop(key, None)))
+        object.__setattr__(self, '_extra', {key: _frozen(val) for key, val in c.items()})
+        object.__setattr__(self, 'layout', prc_layout(self))
+
+    def __setattr__(self, key, val):
+        raise AttributeError('{} is frozen, use replace()'.format(type(self).__name__))
+
+    def __repr__(self):
+        return('PrcConfig(model={!r}, n_levels={})'.format(self.model, self.n_levels))
+
+    def __getitem__(self, key):
+        if key in self._FIELDS: return(getattr(self, key))
+        return(self._extra[key])
+
+    def __contains__(self, key):
+        return(key in self._FIELDS or key in self._extra)
+
+    def get(self, key, default=None):
+        return(self[key] if key in self else default)
+
+    def keys(self):
+        return(list(self._FIELDS) + list(self._extra))
+
+    def items(self):
+        return([(key, self[key]) for key in self.keys()])
+
+    def values(self):
+        return([self[key] for key in self.keys()])
+
+    def __iter__(self):
+        return(iter(self.keys()))
+
+    def __len__(self):
+        return(len(self._FIELDS) + len(self._extra))
+
+    @classmethod
+    def from_dict(cls, c):
+        """frozen config of config dict c (a PrcConfig is returned as is)"""
+        if isinstance(c, cls): return(c)
+        return(cls(**c))
+
+    def to_dict(self):
+        """the config as (writable) config dict"""
+        return({key: np.array(val) if isinstance(val, np.ndarray) else val for key, val in self.items()})
+
+    def replace(self, **changes):
+        """new frozen config with changes applied"""
+        return(PrcConfig(**{**self.to_dict(), **changes}))
+
+
+def prc_layout(c):
+    """parameter layout (PrcLayout) of perceptual config c (dict or PrcConfig), cached per model and n_levels"""
+    if isinstance(c, PrcConfig) and hasattr(c, 'layout'): return(c.layout)
+    return(_prclayout(c['model'], c['n_levels']))
+
+
+@functools.lru_cache(maxsize=None)
+def _prclayout(model, n_levels):
+    """internal function, cached layouts"""
+    return(PrcLayout(model, n_levels))
+
+
+def _frozen(val):
+    """internal function, read-only copy of arrays (other values are kept)"""
+    if isinstance(val, np.ndarray):
+        val = val.copy()
+        val.flags.writeable = False
+    elif isinstance(val, list):
+        val = tuple(val)
+    return(val)
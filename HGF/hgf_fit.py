@@ -8,8 +8,8 @@ Code adapted by Jorie van Haren (2021) """
 # load nessecary packages
 import numpy as np
 import sys
-import statsmodels.api as sm
-from scipy import optimize
+import time
+from scipy import optimize, stats
 
 # load config files and hgf update functions
 from HGF.hgf_config import *
@@ -17,7 +17,7 @@ from HGF.hgf_pres import *
 from HGF.hgf import *
 
 # load extra (non exclusive) helper function
-from HGF.hgf import _unpack_para
+from HGF.hgf import _unpack_para, _inputvalues, _acf, _trajdtype
 
 #######################
 ## MAIN FIT FUNCTION ##
@@ -27,7 +27,8 @@ def fitModel(responses, inputs,
              per_model=ehgf_binary_config, 
              obs_model=unitsq_sgm_config, 
              opt_model=quasinewton_optim_config,
-             overwrite_opt=False):
+             overwrite_opt=False,
+             verbose=True):
     """Main function for fitting parameters of perceptual and obserrvational models
     input:  
             responses =  list or array of binary responses
@@ -42,12 +43,30 @@ def fitModel(responses, inputs,
                          - Dict should have dict['c_prc'], dict['c_obs'], and/or dict['c_opt']
                          - In here you may place keys with own options
                          - e.g. overwrite_optr['c_prc']['rhomu'] = np.array(['np.nan, 0.5, 0.5'])
+                         - budgets, e.g. overwrite_opt['c_opt'] = {'maxTime': 60, 'maxEval': 5000},
+                           checked before every objective evaluation, stop the optimization at the best point
+                           so far (r['optim']['budgetLimited'])
+            verbose    =  default True, print ignored trials, optimization progress and the results
+                          (False for fits in background threads, redirecting stdout there would silence all threads)
     output:
             returns a dict r with inputs, outputs optimizations trajactories and all settings
     """
     
     # initialize r dict
-    r = _dataPrep(responses, inputs)
+    r = _dataPrep(responses, inputs, verbose)
+    return(_fitPrepped(r, per_model, obs_model, opt_model, overwrite_opt, verbose=verbose))
+
+
+## Helper functions
+
+def _fitPrepped(r, per_model, obs_model, opt_model, overwrite_opt=False, traj_out=None, verbose=True):
+    """internal function, not to be used from outside
+    runs the fit of fitModel on an already prepared dict r (see _dataPrep)
+    r is copied shallowly, so one prepared dict can be reused for multiple models
+    traj_out = optional function traj_out(shape, dtype) returning the buffer the final trajectories
+               are written to (the out argument of the perceptual functions, e.g. a memory-mapped file)
+    verbose  = print optimization progress and results (see fitModel)"""
+    r = dict(r)
 
     # set models
     r['c_prc'] = per_model()  # set perceptual model    
@@ -60,8 +79,7 @@ def fitModel(responses, inputs,
     # override with our own settings
     if overwrite_opt != False:
         for item in ['c_prc', 'c_obs', 'c_opt']:
-            if item not in overwrite_opt: overwrite_opt[item] = {}
-            r[item] = {**r[item], **overwrite_opt[item]}
+            r[item] = {**r[item], **overwrite_opt.get(item, {})}
 
     # get functions / models to use from config settings 
     r['c_prc'].update({'prc_fun' : _storedfunc(r['c_prc']['prc_fun']),
@@ -90,7 +108,7 @@ def fitModel(responses, inputs,
 
     # estimate mode of posterior parameter distr. (M.A.P. estimate)
     with np.errstate(divide='ignore'):
-        r = _optim(r, r['c_prc']['prc_fun'], r['c_obs']['obs_fun'], r['c_opt']['opt_fun'])
+        r = _optim(r, r['c_prc']['prc_fun'], r['c_obs']['obs_fun'], r['c_opt']['opt_fun'], verbose)
 
     # get perceptual and observation parameters
     n_prcpars = len(r['c_prc']['priormus'])
@@ -112,21 +130,18 @@ def fitModel(responses, inputs,
     r['p_obs']['ptrans'] = ptrans_obs
 
     # store estimates, predictions and risiduals
-    with np.errstate(divide='ignore'): r['traj'], infStates  = r['c_prc']['prc_fun'](r, r['p_prc']['ptrans'], trans=True)  # ignore /0 warning here, since it will correctly give inf.
+    out = None if traj_out is None else traj_out((len(_inputvalues(r)) + 1, traj_width(r)), _trajdtype(r))
+    with np.errstate(divide='ignore'): r['traj'], infStates  = r['c_prc']['prc_fun'](r, r['p_prc']['ptrans'], trans=True, out=out)  # ignore /0 warning here, since it will correctly give inf.
     _, r['optim']['yhat'], r['optim']['res'] = r['c_obs']['obs_fun'](r, infStates, r['p_obs']['ptrans'])
 
-    # autocorrelation of risiduals
-    res = r['optim']['res']
-    res = np.nan_to_num(res)  # for irregular trials
-    r['optim']['resAC'] = sm.tsa.acf(res, nlags=res.size, fft=True)
+    # residual diagnostics (autocorrelation of risiduals, configured in c_opt)
+    r['optim'].update(_resDiag(r['optim']['res'], r['c_opt']))
 
     # display results
-    printfitmodel(r)
+    if verbose: printfitmodel(r)
     return(r)
 
 
-## Helper functions
-
 def _storedfunc(a):
     """inside function, not to be called from outside
     looks for function names (e.g. within a dict from settings
@@ -144,9 +159,25 @@ def _storedfunc(a):
                 'gaussian_obs'          : gaussian_obs,
                 'unitsq_sgm'            : unitsq_sgm,
                 'optimize.minimize'     : optimize.minimize}
+    if a is None: return(funcdict)
     return(funcdict[a])
 
-def _dataPrep(responses, inputs):
+def _storedname(f):
+    """inside function, not to be called from outside
+    inverse of _storedfunc, returns the name under which function f is stored"""
+    for name, func in _storedfunc(None).items():
+        if func is f: return(name)
+    raise KeyError('function {} is not stored in _storedfunc'.format(f))
+
+def _storedconfig(a):
+    """inside function, not to be called from outside
+    looks for the config function belonging to a model name (e.g. 'hgf' -> hgf_config)
+    - config functions follow the <name>_config naming of hgf_config.py"""
+    # look up in the config module
+    import HGF.hgf_config as configs
+    return(getattr(configs, '{}_config'.format(a)))
+
+def _dataPrep(responses, inputs, verbose=True):
     """internal function, not to be used from outside
     function stores responses, input and info in new dictonary r
     it also defines defaults, values within this dictonary that can later be overwritten
@@ -156,38 +187,67 @@ def _dataPrep(responses, inputs):
     # we first initiate a data dict
     r = {}
     
-    # store responses and inputs
-    r['y'] = np.array(responses)
-    r['u'] = np.array(inputs)
-    
-    # next inputs if we dont have time axis
-    if inputs.ndim == 1: r['u'].reshape(1,len(inputs))
+    # store responses and inputs (no copy, e.g. memory-mapped inputs of hgf_io.load_inputs stay mapped)
+    # inputs with irregular intervals are [2, x], the time deltas second
+    r['y'] = np.asarray(responses)
+    r['u'] = np.asarray(inputs)
+    x      = _inputvalues(r)
     
     # check for ignored trials and irregular trials
     r['ign'] = np.argwhere(np.isnan(r['u']))
     r['irr'] = np.argwhere(np.isnan(r['y']))
     
     # display both ignored and irregular trials
-    print('Ignored trials: {}'.format(r['ign']))
-    print('Irregular trials: {}'.format(r['irr']))
+    if verbose:
+        print('Ignored trials: {}'.format(r['ign']))
+        print('Irregular trials: {}'.format(r['irr']))
     
     ## set placeholder values
     r['plh'] = {}                                 # nested dictionary for storing config files
-    r['plh']['p99991'] = r['u'][0]                # set prior mean of mu_1
-    r['plh']['p99992'] = np.var(r['u'][:20])      # set prior variance of mu_1 (using first 20 inputs/less if size is limited)
+    r['plh']['p99991'] = x[0]                     # set prior mean of mu_1
+    r['plh']['p99992'] = np.var(x[:20])           # set prior variance of mu_1 (using first 20 inputs/less if size is limited)
     r['plh']['p99993'] = np.log(r['plh']['p99992'])    # set prior mean log(sa_1) and alpha using log-var of first 20
     r['plh']['p99994'] = np.log(r['plh']['p99992']) -2 # setprior mean of emega_1 using first 20 log var - 2
     return(r)
 
+def _resDiag(res, c):
+    """internal function, not to be used from outside
+    residual diagnostics as configured in c (c_opt): autocorrelation over resLags lags and optionally
+    the Ljung-Box statistic (LBQ) with its p-value (LBp), returns dict of results (empty if resDiag is off)"""
+    if not c.get('resDiag', True): return({})
+    res  = np.nan_to_num(res)  # for irregular trials
+    lags = c.get('resLags', 40)
+    lags = res.size-1 if lags is None else min(int(lags), res.size-1)
+    out  = {'resAC': _acf(res, lags)}
+    if c.get('ljungBox', False) and lags > 0:
+        k = np.arange(1, lags+1)
+        out['LBQ'] = res.size * (res.size+2) * np.sum(out['resAC'][1:]**2 / (res.size-k))
+        out['LBp'] = stats.chi2.sf(out['LBQ'], lags)
+    return(out)
+
+
+def _batchOpt(overwrite_opt, max_time=None, max_eval=None):
+    """internal function, not to be used from outside
+    overwrite_opt for batch fits, residual diagnostics are off unless set explicitly,
+    and the budgets max_time / max_eval apply unless overwrite_opt sets maxTime / maxEval"""
+    over = {item: dict(val) for item, val in (overwrite_opt or {}).items()}
+    c_opt = over.setdefault('c_opt', {})
+    c_opt.setdefault('resDiag', False)
+    if max_time is not None: c_opt.setdefault('maxTime', max_time)
+    if max_eval is not None: c_opt.setdefault('maxEval', max_eval)
+    return(over)
+
+
 def _negLogJoint(r, prc_fun, obs_fun, ptrans_prc, ptrans_obs):
     """returns the negative log-joint density for 
     perceptual and observational parameters"""
-    # calc. perceptual trajectories, 
-    [dummy, infStates] = prc_fun(r, ptrans_prc, trans=True)
+    # calc. perceptual trajectories, only the inferred states are needed here
+    # always in float64: finite difference gradients are lost in float32 rounding (c_prc dtype is for recorded output)
+    [dummy, infStates] = prc_fun(r, ptrans_prc, trans=True, record=(), dtype=np.float64)
     
     # calc. log-likelihood of observed responses given perceptual trajectories
     trialLogLls, y_hats, res = obs_fun(r, infStates, ptrans_obs)
-    logLl = np.nansum(trialLogLls)
+    logLl = np.nansum(trialLogLls, dtype=np.float64)  # float64 sum, also for float32 trajectories
     negLogLl = -logLl
     
     # calc. log-prior of perceptual parameters
@@ -206,7 +266,7 @@ def _negLogJoint(r, prc_fun, obs_fun, ptrans_prc, ptrans_obs):
     negLogJoint = -(logLl + logPrcPrior + logObsPrior)
     return(negLogJoint, negLogLl)
 
-def _optim(r, prc_fun, obs_fun, opt_fun):
+def _optim(r, prc_fun, obs_fun, opt_fun, verbose=True):
     """internal function, not to be used from outside
     function determines parameters to optimize and does optimalization run(s)
     it records these optimiziation results"""
@@ -223,10 +283,16 @@ def _optim(r, prc_fun, obs_fun, opt_fun):
 
     # initiate by setting the prior mean as starting value for optimization
     init = np.array(r['c_prc']['priormus'].tolist() + r['c_obs']['priormus'].tolist())
+    if r['c_opt'].get('init') is not None:  # warm start of the free parameters (fixed ones stay at the prior)
+        init[opt_idx] = np.asarray(r['c_opt']['init'], dtype=float)[opt_idx]
     dummy1, dummy2= nlj(init)  # check could be error: last p in
     
+    # extra starts drawn from the priors (raced against the prior mean, see _race)
+    sas    = np.array(r['c_prc']['priorsas'].tolist() + r['c_obs']['priorsas'].tolist())
+    starts = _randStarts(init, opt_idx, sas, r['c_opt'])
+
     # do an optimization run and record opt. results
-    optres = _optimrun(nlj, init, opt_idx, r['c_opt']['config'], r['c_opt'])
+    optres = _optimrun(nlj, init, opt_idx, r['c_opt']['config'], r['c_opt'], starts, verbose)
     optres['init']  = np.array(r['c_prc']['priormus'].tolist() + r['c_obs']['priormus'].tolist())
     
     # record opt results
@@ -239,34 +305,60 @@ def _optim(r, prc_fun, obs_fun, opt_fun):
     if np.any(r['y']):
         ndp = np.nansum(r['y'])
     else:
-        ndp = np.nansum(r['u'])
+        ndp = np.nansum(_inputvalues(r))
     
     r['optim']['AIC'] = 2*r['optim']['negLl']  +  2*d
     r['optim']['BIC'] = 2*r['optim']['negLl']  +  2*np.log(ndp)
     return(r)
 
 
-def _optimrun(nlj, init, opt_idx, opt_fun, c_opt):
+def _optimrun(nlj, init, opt_idx, opt_fun, c_opt, starts=None, verbose=True):
     """internal function not to be called from outside
-    does an (1) optimization algorithm run and returns results"""
+    does an (1) optimization algorithm run and returns results,
+    with extra starts (rows of free parameters) all starts are raced and the best one is kept"""
     
     # objective function with respect to parameters that are not optimized
-    obj_fun = lambda p_opt: _restrictfun(nlj, init, opt_idx, p_opt)
+    # budgets are checked before every evaluation (once the run has a point), the run then ends at its best point
+    spent  = {'nfev': 0, 'nit': 0, 'start': time.perf_counter(), 'stopped': None, 'fun': np.inf, 'x': None}
+    budget = c_opt.get('maxTime') is not None or c_opt.get('maxEval') is not None
+    def obj_fun(p_opt):
+        if budget and spent['x'] is not None:
+            spent['stopped'] = _overBudget(spent, c_opt)
+            if spent['stopped'] is not None: raise _BudgetStop(spent['stopped'])
+        spent['nfev'] += 1
+        val = _restrictfun(nlj, init, opt_idx, p_opt)
+        if spent['x'] is None or val < spent['fun']: spent['fun'], spent['x'] = val, np.array(p_opt, dtype=float)
+        return(val)
+
+    # iterations are counted for runs that a budget ends inside an iteration
+    def callback(xk):
+        spent['nit'] += 1
     
     # optimize
-    print("\nInitializing optimization run...\n") 
-    optresz = c_opt['opt_fun'](obj_fun, init[opt_idx], 
-                               method=c_opt['opt_method'],
-                               options={'return_all':True,
-                               'gtol':c_opt['tolGrad'],
-                               'maxiter':c_opt['maxIter'],
-                               'disp':True})
+    race = None
+    if starts is not None and len(starts):
+        if verbose: print("\nRacing {} optimization starts...\n".format(len(starts)+1))
+        optresz, race = _race(obj_fun, np.vstack([init[opt_idx], starts]), c_opt, callback, spent, verbose)
+    else:
+        if verbose: print("\nInitializing optimization run...\n") 
+        optresz = _minimize(obj_fun, init[opt_idx], c_opt, callback, spent,
+                            options={'return_all':True,
+                                     'gtol':c_opt['tolGrad'],
+                                     'maxiter':c_opt['maxIter'],
+                                     'disp':verbose})
     
     optres = {}
     optres['valMin']  = optresz['fun'] 
     optres['argMin']  = optresz['x']
+    optres['success'] = optresz['success']
+    optres['nit']     = optresz['nit']
+    optres['nfev']    = optresz['nfev']
+    optres['seconds'] = time.perf_counter() - spent['start']
+    optres['stopped'] = spent['stopped']            # 'maxTime' or 'maxEval' when a budget ended the run
+    optres['budgetLimited'] = spent['stopped'] is not None
+    if race is not None: optres.update(race)
 #     optres['init']    = init_og
-    final             = init
+    final             = init.copy()
     final[opt_idx]    = optres['argMin']
     optres['final']   = final
     
@@ -274,9 +366,17 @@ def _optimrun(nlj, init, opt_idx, opt_fun, c_opt):
     negLj, negLl = nlj(final)
     d = len(opt_idx)
     
-    # computation of hessian
-    optres['H']       = _get_near_psd(np.linalg.inv(optresz['hess_inv']))
-    optres['Sigma']   = _get_near_psd(optresz['hess_inv'])
+    # computation of hessian, the BFGS estimate or with c_opt['numHess'] by finite differences at the minimum
+    # (outside the budget, the BFGS estimate stays close to the identity for runs of few iterations),
+    # a run ended inside an iteration by a budget has no BFGS estimate and is always computed numerically,
+    # if that is not positive definite the BFGS estimate is kept, or the identity BFGS starts from
+    hess_inv = optresz['hess_inv']
+    if hess_inv is None or c_opt.get('numHess', False):
+        H = _posdef(_numHess(lambda p_opt: _restrictfun(nlj, init, opt_idx, p_opt), optres['argMin']))
+        if H is not None:       hess_inv = np.linalg.inv(H)
+        elif hess_inv is None:  hess_inv = np.eye(d)
+    optres['H']       = _get_near_psd(np.linalg.inv(hess_inv))
+    optres['Sigma']   = _get_near_psd(hess_inv)
     optres['Corr']    = _correlation_from_covariance(optres['Sigma'])
     optres['negLl']   = negLl
     optres['negLj']   = negLj
@@ -309,12 +409,119 @@ def _calclogpriors(r, ptrans, idx):
 def _restrictfun(f, arg, free_idx, free_arg):
     """internal function not to be called from outside
     construction of file handles to restrict function"""
-    # replace dummy arg 
+    # replace dummy arg (on a copy, arg is shared by all evaluations)
+    arg = arg.copy()
     arg[free_idx] = free_arg
     # and evaluate
     val, dummy2 = f(arg) 
     return(val)
 
+def _randStarts(init, opt_idx, sas, c_opt):
+    """internal function not to be called from outside
+    returns c_opt['nRandInit'] starting points of the free parameters drawn from their priors"""
+    n = int(c_opt.get('nRandInit', 0) or 0)
+    if n <= 0 or len(opt_idx) == 0: return(None)
+    rng = np.random.default_rng(c_opt.get('randSeed', 0))
+    return(init[opt_idx] + np.sqrt(sas[opt_idx]) * rng.standard_normal((n, len(opt_idx))))
+
+def _race(obj_fun, starts, c_opt, callback, spent, verbose=True):
+    """internal function not to be called from outside
+    races optimization runs from all starts (rows): every round each remaining start is advanced by
+    c_opt['raceIter'] iterations (continuing its inverse hessian), then starts whose objective is
+    worse than the best by more than c_opt['raceMargin'] are pruned, until all remaining starts converged
+    the starts run one after another in this process (batch fits already spread the subjects over a worker pool,
+    see hgf_batch), racing saves the iterations of pruned starts, it does not run starts in parallel
+    returns the optimizer result of the best start (with summed nit / nfev) and a dict of racing results"""
+    n      = len(starts)
+    runs   = [{'x': x, 'hess_inv': None, 'fun': np.inf, 'nit': 0, 'done': False, 'res': None} for x in starts]
+    alive  = list(range(n))
+    pruned = {}
+    nit, nfev, rounds = 0, 0, 0
+    while True:
+        rounds += 1
+        for i in alive:
+            run = runs[i]
+            if run['done']: continue
+            maxiter = min(c_opt['raceIter'], c_opt['maxIter'] - run['nit'])
+            res = _minimize(obj_fun, run['x'], c_opt, callback, spent,
+                            options={'gtol':c_opt['tolGrad'],
+                                     'maxiter':maxiter,
+                                     'hess_inv0':run['hess_inv'],
+                                     'disp':False})
+            nit, nfev = nit + res['nit'], nfev + res['nfev']
+            run.update({'x': res['x'], 'hess_inv': _posdef(res['hess_inv']), 'res': res,
+                        'fun': res['fun'] if np.isfinite(res['fun']) else np.inf, 'nit': run['nit'] + res['nit']})
+            # converged, failed (e.g. precision loss) or out of iterations
+            run['done'] = res['status'] != 1 or run['nit'] >= c_opt['maxIter'] or not np.isfinite(run['fun'])
+            if spent['stopped'] is not None: break
+
+        # prune dominated starts, the best start always stays
+        best = min(alive, key=lambda i: runs[i]['fun'])
+        for i in list(alive):
+            if i != best and runs[i]['fun'] > runs[best]['fun'] + c_opt['raceMargin']:
+                alive.remove(i)
+                pruned[i] = rounds
+        if verbose: print(' round {}: best start {} at {:.4f}, {} of {} starts left'.format(rounds, best, runs[best]['fun'], len(alive), n))
+        if spent['stopped'] is not None or all(runs[i]['done'] for i in alive): break
+
+    res = runs[best]['res']
+    res['nit'], res['nfev'] = nit, nfev
+    race = {'nStarts'  : n,
+            'bestStart': best,
+            'rounds'   : rounds,
+            'startVals': np.array([run['fun'] for run in runs]),
+            'pruned'   : np.array([pruned.get(i, 0) for i in range(n)])}  # round a start was pruned (0 = not pruned)
+    return(res, race)
+
+class _BudgetStop(Exception):
+    """internal exception, raised by the objective function when a budget (maxTime, maxEval) is used up"""
+
+def _minimize(obj_fun, x0, c_opt, callback, spent, options):
+    """internal function not to be called from outside
+    one optimizer run from x0, a run that a budget ends (_BudgetStop raised by obj_fun) returns
+    the best point of the run, with nit / nfev of the run so far and no inverse hessian (hess_inv None)"""
+    nit, nfev = spent['nit'], spent['nfev']
+    spent['fun'], spent['x'] = np.inf, None
+    try:
+        return(c_opt['opt_fun'](obj_fun, x0, method=c_opt['opt_method'], callback=callback, options=options))
+    except _BudgetStop as stop:
+        return(optimize.OptimizeResult(x=spent['x'], fun=spent['fun'], success=False, status=1,
+                                       message='Budget {} used up.'.format(stop), hess_inv=None,
+                                       nit=spent['nit'] - nit, nfev=spent['nfev'] - nfev))
+
+def _numHess(f, x, step=1e-3):
+    """internal function not to be called from outside
+    hessian of f at x by central finite differences (steps of step * max(1, |x|))"""
+    x = np.asarray(x, dtype=float)
+    d = len(x)
+    h = np.diag(step * np.maximum(1, np.abs(x)))
+    H = np.empty((d, d))
+    for i in range(d):
+        for j in range(i, d):
+            H[i,j] = H[j,i] = (f(x + h[i] + h[j]) - f(x + h[i] - h[j])
+                               - f(x - h[i] + h[j]) + f(x - h[i] - h[j])) / (4 * h[i,i] * h[j,j])
+    return(H)
+
+def _posdef(A):
+    """internal function not to be called from outside
+    returns A (symmetrized) if it is positive definite (to continue BFGS from it), otherwise None (restart)"""
+    if A is None or not np.all(np.isfinite(A)): return(None)
+    A = (A + A.T)/2
+    try:
+        np.linalg.cholesky(A)
+        return(A)
+    except np.linalg.LinAlgError:
+        return(None)
+
+def _overBudget(spent, c_opt):
+    """internal function not to be called from outside
+    returns the name of the exceeded budget (maxTime, maxEval) or None"""
+    if c_opt.get('maxTime') is not None and time.perf_counter() - spent['start'] >= c_opt['maxTime']:
+        return('maxTime')
+    if c_opt.get('maxEval') is not None and spent['nfev'] >= c_opt['maxEval']:
+        return('maxEval')
+    return(None)
+
 def _get_near_psd(A):
     """helper function to get closest definite matrix (if needed)"""
     if not _check_symmetric(A):
@@ -0,0 +1,133 @@
+""" Rolling-origin forecast evaluation with the (continuous) Hierarchical Gaussian Filter
+the inputs are filtered once, after which the predictive distributions of the inputs h trials ahead are
+computed from every origin (every trial) at once, by iterating the prediction step of the model without updates,
+and scored against the observed inputs (log predictive density, RMSE and calibration)
+
+usage:  res = forecastEval(r, p, inputs, horizons=[1, 5, 20])   # r with c_prc (e.g. the r of fitModel)
+        res['mean'][k], res['var'][k]                            # forecasts of every trial made horizons[k] trials earlier
+        res['scores'][5]                                         # {'n', 'lpd', 'rmse', 'bias', 'zvar', 'coverage'}
+
+Model implemented as discribed in: Mathys, C. D., Lomakina, E. I., Daunizeau, J., Iglesias, S., Brodersen, K. H., Friston, K. J., & Stephan, K. E. (2014). Uncertainty in perception and the Hierarchical Gaussian Filter. Frontiers in human neuroscience, 8, 825.
+
+Code adapted by Jorie van Haren (2021) """
+
+# load nessecary packages
+import numpy as np
+from scipy import stats
+
+# load config files and function lookups
+from HGF.hgf_config import prc_layout
+from HGF.hgf_fit import _storedfunc
+
+#############################
+## MAIN FORECAST FUNCTIONS ##
+#############################
+
+def forecastEval(r, p, inputs, horizons=(1,), trans=False, burn=0, noise=True, levels=(0.5, 0.8, 0.95)):
+    """Forecasts of the inputs from every origin and their scores, in one filter run (hgf / ehgf)
+    input:
+            r      = dict with at least c_prc (e.g. {'c_prc': ehgf_config()} or the r of fitModel)
+            p      = perceptual parameters, in native space (or transformed space with trans=True)
+            inputs = array of inputs, nan for missing trials ([2, x] with time deltas for irregular_intervals)
+    optional inputs:
+            horizons = forecast horizons in trials (1 is the one-step-ahead prediction mu_hat / sa_hat)
+            burn     = number of first trials that are not scored
+            noise    = if True the input noise al is added to the predictive variance of the first level,
+                       with False the variances are sa_hat (as in the bayes_optimal observation model)
+            levels   = nominal coverage of the central predictive intervals for the calibration
+    output:
+            returns dict with
+            horizons = array of horizons
+            mean     = (n_horizons, n_trials) predictive means, mean[k,i] is the forecast of trial i
+                       made horizons[k] trials earlier (nan if there is no such origin)
+            var      = (n_horizons, n_trials) predictive variances
+            mu_hat   = (n_trials,) one-step-ahead prediction of the first level, sa_hat its variance
+                       (also for missing trials, where the filter itself has no prediction)
+            scores   = dict {horizon: {'n', 'lpd', 'rmse', 'bias', 'zvar', 'coverage'}} over the scored trials,
+                       lpd the mean log predictive density, zvar the variance of the standardized errors
+                       (1 when calibrated), coverage {level: fraction of trials inside the central interval}
+            traj     = trajectories of the filter run"""
+    layout = prc_layout(r['c_prc'])
+    if layout.binary: raise ValueError('forecastEval supports the continuous models (hgf, ehgf), not {}'.format(layout.model))
+    horizons = np.unique(np.asarray(horizons, dtype=int))
+    if horizons.size == 0 or horizons[0] < 1: raise ValueError('horizons should be at least 1, not {}'.format(horizons))
+    if trans: p = r['c_prc']['transp_prc_fun'](r, p)
+    p = np.asarray(p, dtype=float)
+    p_dict = layout.unpack(p)
+
+    # one filter run over all inputs
+    inputs = np.asarray(inputs, dtype=float)
+    u  = inputs[0] if inputs.ndim > 1 else inputs
+    n  = len(u)
+    rf = {'u': inputs, 'y': np.array([]), 'c_prc': r['c_prc'],
+          'ign': np.argwhere(np.isnan(u)), 'irr': np.array([], dtype=int)}
+    prc_fun = r['c_prc']['prc_fun']
+    if isinstance(prc_fun, str): prc_fun = _storedfunc(prc_fun)
+    with np.errstate(divide='ignore'):
+        traj, infStates = prc_fun(rf, p, record=['mu', 'sa', 'mu_hat', 'sa_hat'])
+
+    # origins are the priors and the posteriors after every trial (origin o predicts trial o+h, 1-based)
+    mu1 = np.concatenate([[p_dict['mu_0'][0]], traj['mu'][:,0]])
+    sa1 = np.concatenate([[p_dict['sa_0'][0]], traj['sa'][:,0]])
+    mu2 = np.concatenate([[p_dict['mu_0'][1]], traj['mu'][:,1]])
+    if r['c_prc']['irregular_intervals']: t = np.insert(inputs[1], 0, 0)
+    else:                                 t = np.ones(n+1)
+    res = _horizons(mu1, sa1, mu2, t, p_dict, horizons, p_dict['al'] if noise else 0.)
+
+    # scores of every horizon
+    scored = ~np.isnan(u)
+    scored[:burn] = False
+    res['scores'] = {int(h): _scores(u, res['mean'][k], res['var'][k], scored, levels) for k, h in enumerate(horizons)}
+    res['traj'] = traj
+    return(res)
+
+
+## Helper functions
+
+def _horizons(mu1, sa1, mu2, t, p_dict, horizons, al):
+    """internal function, predictive distributions of the first level from every origin (vectorized over origins)
+    iterates the prediction step mu^ = mu + t*rho, sa^ = sa + t*exp(ka*mu2 + om) without updates,
+    with the second level at its predicted mean"""
+    n, H = len(mu1) - 1, horizons[-1]
+    rho, ka, om = p_dict['rho'], p_dict['ka'], p_dict['om']
+    tt   = np.concatenate([t, np.full(H, np.nan)])  # time deltas of the targets, nan beyond the last trial
+    T    = np.zeros(n+1)                             # time from origin to target
+    var  = sa1.copy()
+    mean = np.empty((len(horizons), n))
+    pvar = np.empty((len(horizons), n))
+    k    = 0
+    with np.errstate(invalid='ignore', over='ignore'):
+        vol = np.exp(ka[0] * mu2 + om[0])            # volatility of the first level at the origins
+        for h in range(1, H+1):
+            dt   = tt[h:h+n+1]
+            if rho[1] == 0: var += dt * vol
+            else:           var += dt * vol * np.exp(ka[0] * rho[1] * T)
+            T   += dt
+            if h == 1:
+                mu_hat, sa_hat = mu1[:n] + T[:n] * rho[0], var[:n].copy()
+            if h == horizons[k]:
+                # origin o forecasts trial o+h, so trial i is forecast from origin i-h+1 (0-based trials),
+                # horizons beyond the last trial have no origin and stay all nan
+                mean[k], pvar[k] = np.nan, np.nan
+                if h-1 < n:
+                    mean[k,h-1:] = mu1[:n-h+1] + T[:n-h+1] * rho[0]
+                    pvar[k,h-1:] = var[:n-h+1] + al
+                k += 1
+    return({'horizons': horizons, 'mean': mean, 'var': pvar, 'mu_hat': mu_hat, 'sa_hat': sa_hat})
+
+
+def _scores(u, mean, var, scored, levels):
+    """internal function, log predictive density, error and calibration summaries of one horizon"""
+    keep = scored & np.isfinite(mean) & np.isfinite(var)
+    err  = u[keep] - mean[keep]
+    var  = var[keep]
+    if not err.size:
+        return({'n': 0, 'lpd': np.nan, 'rmse': np.nan, 'bias': np.nan, 'zvar': np.nan,
+                'coverage': {lev: np.nan for lev in levels}})
+    z = err / np.sqrt(var)
+    return({'n'       : int(err.size),
+            'lpd'     : float(np.mean(-0.5 * np.log(2 * np.pi * var) - err**2 / (2 * var))),
+            'rmse'    : float(np.sqrt(np.mean(err**2))),
+            'bias'    : float(np.mean(err)),
+            'zvar'    : float(np.var(z)),
+            'coverage': {lev: float(np.mean(np.abs(z) <= stats.norm.ppf(0.5 + lev / 2))) for lev in levels}})
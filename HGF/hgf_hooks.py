@@ -0,0 +1,114 @@
+""" Per trial hooks for instrumentation of the perceptual functions of the Hierarchical Gaussian Filter
+hooks are passed as hooks=[...] to the perceptual functions (hgf_binary, hgf, ...) and hgf_stream,
+without hooks the update loop runs unchanged
+
+a hook is a plain function hook(trial, x, row), or an object with (optional) methods
+        on_trial(trial, x, row) = called after every trial (also ignored trials)
+                                  trial = trial index, counted over all chunks of a stream
+                                  x     = dict of the trajectory buffers mu, pi, mu_hat, pi_hat, v, w, da (and dau)
+                                  row   = row of this trial in x (row 0 holds the priors)
+        on_level(lvl)           = called at the start of a trial update with lvl -1, and after the update
+                                  of every level lvl (0 for the first level), meant for timing
+
+usage:  alert = ThresholdHook('da', 1, 5.)     # prediction errors of the second level above 5
+        prof  = ProfileHook()
+        traj, infStates = hgf_binary(r, p, hooks=[alert, prof])
+        alert.alerts, prof.report()
+
+Model implemented as discribed in: Mathys, C. D., Lomakina, E. I., Daunizeau, J., Iglesias, S., Brodersen, K. H., Friston, K. J., & Stephan, K. E. (2014). Uncertainty in perception and the Hierarchical Gaussian Filter. Frontiers in human neuroscience, 8, 825.
+
+Code adapted by Jorie van Haren (2021) """
+
+# load nessecary packages
+import time
+
+#######################
+## MAIN HOOK CLASSES ##
+#######################
+
+class ThresholdHook:
+    """Alerts on trials where a trajectory field of one level crosses a threshold
+    input:
+            field     = trajectory buffer to watch (e.g. 'da' for prediction errors, 'pi' for precisions)
+            level     = level to watch (0 for the first level)
+            threshold = alert when the value is above threshold (or below with below=True)
+    optional inputs:
+            below     = if True alert on values below threshold (e.g. precision collapses)
+            absolute  = if True the absolute value is compared
+            callback  = function callback(trial, value) called on every alert
+    alerts are collected in hook.alerts as (trial, value) tuples"""
+
+    def __init__(self, field, level, threshold, below=False, absolute=False, callback=None):
+        self.field     = field
+        self.level     = level
+        self.threshold = threshold
+        self.below     = below
+        self.absolute  = absolute
+        self.callback  = callback
+        self.alerts    = []
+
+    def on_trial(self, trial, x, row):
+        value = x[self.field][row, self.level]
+        if self.absolute: value = abs(value)
+        if (value < self.threshold) if self.below else (value > self.threshold):
+            self.alerts.append((trial, float(value)))
+            if self.callback is not None: self.callback(trial, float(value))
+
+
+class ProfileHook:
+    """Measures the time spent in the update of every level
+    report() returns the total seconds, number of updates and mean microseconds per level,
+    the time of the hook calls themselves is included in the measurements"""
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls   = {}
+        self.trials  = 0
+        self._last   = None
+
+    def on_level(self, lvl):
+        now = time.perf_counter()
+        if lvl >= 0:
+            self.seconds[lvl] = self.seconds.get(lvl, 0.) + (now - self._last)
+            self.calls[lvl]   = self.calls.get(lvl, 0) + 1
+        self._last = now
+
+    def on_trial(self, trial, x, row):
+        self.trials += 1
+
+    def report(self):
+        """returns dict {level: {'seconds', 'calls', 'mean_us'}}"""
+        return({lvl: {'seconds': self.seconds[lvl],
+                      'calls'  : self.calls[lvl],
+                      'mean_us': 1e6 * self.seconds[lvl] / self.calls[lvl]} for lvl in sorted(self.seconds)})
+
+    def __str__(self):
+        lines = ['level {}: {:10.4f}s {:10d} updates {:8.2f}us'.format(lvl + 1, rep['seconds'], rep['calls'], rep['mean_us'])
+                 for lvl, rep in self.report().items()]
+        return('\n'.join(['{} trials'.format(self.trials)] + lines))
+
+
+## Helper functions
+
+def _hookfuns(hooks):
+    """internal function, not to be used from outside
+    returns (on_trial, on_level) functions of a list of hooks, None for nothing to call
+    (so the update loop only has to check a local name when there are no hooks)"""
+    if not hooks: return(None, None)
+    trial = [getattr(h, 'on_trial', None) if not _isfunc(h) else h for h in hooks]
+    level = [getattr(h, 'on_level', None) for h in hooks if not _isfunc(h)]
+    return(_combine([f for f in trial if f is not None]), _combine([f for f in level if f is not None]))
+
+
+def _isfunc(h):
+    """internal function, plain function hooks (no on_trial / on_level methods)"""
+    return(callable(h) and not hasattr(h, 'on_trial') and not hasattr(h, 'on_level'))
+
+
+def _combine(funs):
+    """internal function, single function calling all funs (None if there are none)"""
+    if not funs: return(None)
+    if len(funs) == 1: return(funs[0])
+    def call(*args):
+        for f in funs: f(*args)
+    return(call)
@@ -0,0 +1,257 @@
+""" Functions for storing and loading results of the Hierarchical Gaussian Filter
+fits (fitModel) and simulations (simModel) are written to a single uncompressed .npz container,
+function references are stored by name, and per trial arrays can be memory-mapped on load
+text inputs (as in demo_files/) can be converted once into memory-mapped .npy files,
+and trajectories of long runs can be written chunk by chunk to memory-mapped files (MemmapSink)
+
+Model implemented as discribed in: Mathys, C. D., Lomakina, E. I., Daunizeau, J., Iglesias, S., Brodersen, K. H., Friston, K. J., & Stephan, K. E. (2014). Uncertainty in perception and the Hierarchical Gaussian Filter. Frontiers in human neuroscience, 8, 825.
+
+Code adapted by Jorie van Haren (2021) """
+
+# load nessecary packages
+import os
+import json
+import struct
+import zipfile
+import itertools
+import numpy as np
+
+# load config files and function lookups
+import HGF.hgf_config as configs
+from HGF.hgf_fit import _storedfunc, _storedname
+
+# dicts of r that are stored, and per trial arrays that are mapped lazily
+STORED_DICTS = ['p_prc', 'p_obs', 'optim', 'traj', 'c_prc', 'c_obs', 'c_opt', 'c_sim']
+STORED_ARRAYS = ['u', 'y', 'ign', 'irr']
+LAZY = ['traj', 'u', 'y', 'optim/yhat', 'optim/res', 'optim/resAC']
+
+#######################
+## MAIN IO FUNCTIONS ##
+#######################
+
+def save_fit(path, r, traj=True):
+    """Store results r of fitModel or simModel in a compact .npz container at path
+    functions (e.g. prc_fun, config) are stored by their _storedfunc / config names
+    optional input:
+            traj = if False trajectories are not stored (parameters and model quality only)
+    the file is written under a temporary name first, so an existing path is always a complete file"""
+    out = {}
+    for item in STORED_DICTS:
+        if item not in r or (item == 'traj' and not traj): continue
+        if callable(r[item]):  # e.g. c_obs of simModel is a config function
+            out['fn/{}'.format(item)] = np.array(_funcName(r[item]))
+            continue
+        for key, val in r[item].items():
+            if callable(val):  out['fn/{}/{}'.format(item, key)] = np.array(_funcName(val))
+            elif val is None:  out['none/{}/{}'.format(item, key)] = np.array(0)  # e.g. unset options, no pickling
+            else:              out['{}/{}'.format(item, key)]    = np.asarray(val)
+    for item in STORED_ARRAYS:
+        if item in r: out[item] = np.asarray(r[item])
+
+    # write uncompressed, so members can be memory-mapped later
+    tmp = '{}.part'.format(path)
+    with open(tmp, 'wb') as f:
+        np.savez(f, **out)
+    os.replace(tmp, path)
+    return(path)
+
+
+def load_fit(path, traj=True, mmap=True):
+    """Load results stored with save_fit
+    optional inputs:
+            traj = if False only parameters, configs and model quality are read,
+                   trajectory and other per trial data are not touched
+            mmap = if True per trial arrays (traj, u, y, yhat, res) are memory-mapped
+                   read-only instead of read into memory
+    output:
+            returns dict r as returned by fitModel / simModel"""
+    r = {}
+    with np.load(path, allow_pickle=False) as npz, zipfile.ZipFile(path) as zf:
+        for name in npz.files:
+            lazy = any(name == item or name.startswith(item + '/') for item in LAZY)
+            if lazy and not traj: continue
+
+            # read value
+            if name.startswith('fn/'):
+                name, val = name[3:], _funcFromName(str(npz[name]))
+            elif name.startswith('none/'):
+                name, val = name[5:], None
+            elif lazy and mmap:
+                val = _memmapMember(path, zf, name + '.npy')
+                if val is None: val = npz[name]
+            else:
+                val = _fromArray(npz[name])
+
+            # and place it in r
+            if '/' in name:
+                item, key = name.split('/', 1)
+                r.setdefault(item, {})[key] = val
+            else:
+                r[name] = val
+    return(r)
+
+
+def convert_inputs(src, dst=None, column=0, time_column=None, absolute_time=False, chunk_lines=1000000):
+    """Convert a text file of inputs (one trial per line, e.g. demo_files/example_usdchf.txt) into a .npy file
+    the text is read chunk_lines lines at a time, so it is never held in memory as a whole
+    optional inputs:
+            dst           = output path, default src with the extension replaced by .npy
+            column        = column of the input values
+            time_column   = column with the time of every trial, gives [2, x] inputs (values, time deltas)
+                            for irregular_intervals=True
+            absolute_time = if True the time column holds time stamps and is converted to deltas,
+                            the first trial gets the interval of the second
+            chunk_lines   = number of lines parsed at once
+    output:
+            returns the path of the .npy file"""
+    if dst is None: dst = os.path.splitext(src)[0] + '.npy'
+
+    # first pass only counts trials (empty and # lines are skipped, as by np.loadtxt)
+    with open(src) as f:
+        n = sum(1 for line in f if _isData(line))
+    shape = (n,) if time_column is None else (2, n)
+
+    # second pass parses chunks directly into the mapped file
+    tmp = '{}.part'.format(dst)
+    out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float64, shape=shape)
+    cols, pos, last = [column] if time_column is None else [column, time_column], 0, None
+    with open(src) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_lines))
+            if not lines: break
+            lines = [line for line in lines if _isData(line)]
+            if not lines: continue  # np.loadtxt warns on chunks without data
+            chunk = np.loadtxt(lines, dtype=np.float64, usecols=cols, ndmin=2)
+            m = len(chunk)
+            if time_column is None:
+                out[pos:pos+m] = chunk[:,0]
+            else:
+                out[0, pos:pos+m] = chunk[:,0]
+                if absolute_time:
+                    stamps = chunk[:,1]
+                    deltas = np.diff(stamps, prepend=stamps[0] if last is None else last)
+                    last   = stamps[-1]
+                    out[1, pos:pos+m] = deltas
+                else:
+                    out[1, pos:pos+m] = chunk[:,1]
+            pos += m
+    if absolute_time and time_column is not None and n > 1:
+        out[1, 0] = out[1, 1]  # after all chunks, the first chunk may hold only the first trial
+    out.flush()
+    del out
+    os.replace(tmp, dst)
+    return(dst)
+
+
+def load_inputs(path, mmap=True, **kwargs):
+    """Load inputs for fitModel / simModel / hgf_stream.filterStream without reading them into memory
+    text files are converted with convert_inputs first (once, the .npy file next to it is reused
+    as long as it is newer than the text), remaining keyword arguments are passed to convert_inputs
+    output:
+            returns read-only memory-mapped array of inputs, [2, x] for inputs with time deltas"""
+    if not path.endswith('.npy'):
+        npy = kwargs.get('dst') or os.path.splitext(path)[0] + '.npy'
+        if not os.path.exists(npy) or os.path.getmtime(npy) < os.path.getmtime(path):
+            convert_inputs(path, **kwargs)
+        path = npy
+    return(np.load(path, mmap_mode='r' if mmap else None))
+
+
+class MemmapSink:
+    """Output sink for the perceptual functions, simModel and hgf_stream
+    every trajectory field is written to a memory-mapped directory/<field>.npy file of n trials as chunks come in,
+    so long runs have a fixed memory footprint; while running the files can be opened with
+    np.load(path, mmap_mode='r') and directory/progress.json holds the number of trials written
+    input:
+            directory = output directory
+            n         = total number of trials
+            chunksize = number of trials filtered per chunk"""
+
+    def __init__(self, directory, n, chunksize=100000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.n         = int(n)
+        self.chunksize = int(chunksize)
+        self.arrays    = {}
+        self.written   = 0
+
+    def write(self, start, traj):
+        """write trajectory chunk traj (dict of arrays, trials first) starting at trial start"""
+        for key, val in traj.items():
+            if key not in self.arrays:
+                self.arrays[key] = np.lib.format.open_memmap(os.path.join(self.directory, '{}.npy'.format(key)),
+                                                             mode='w+', dtype=val.dtype, shape=(self.n,) + val.shape[1:])
+            self.arrays[key][start:start+len(val)] = val
+            self.written = max(self.written, start + len(val))
+        self._progress()
+
+    def result(self):
+        """flush the files and return dict of the memory-mapped trajectories"""
+        for arr in self.arrays.values(): arr.flush()
+        self._progress()
+        return(dict(self.arrays))
+
+    def _progress(self):
+        tmp = os.path.join(self.directory, 'progress.json.part')
+        with open(tmp, 'w') as f:
+            json.dump({'n': self.n, 'written': self.written, 'fields': sorted(self.arrays)}, f)
+        os.replace(tmp, os.path.join(self.directory, 'progress.json'))
+
+
+## Helper functions
+
+def _isData(line):
+    """internal function, True for lines of a text input file that hold a trial (not empty or # lines)"""
+    return(bool(line.strip()) and not line.lstrip().startswith('#'))
+
+
+def _funcName(f):
+    """internal function, stored name of a model / config function"""
+    if f.__name__.endswith('_config') and getattr(configs, f.__name__, None) is f:
+        return(f.__name__)
+    return(_storedname(f))
+
+
+def _funcFromName(name):
+    """internal function, inverse of _funcName"""
+    if name.endswith('_config'): return(getattr(configs, name))
+    return(_storedfunc(name))
+
+
+def _fromArray(arr):
+    """internal function, 0-d arrays back to python scalars (model names, flags, LME etc.)"""
+    if arr.ndim == 0: return(arr.item())
+    return(arr)
+
+
+def _memmapMember(path, zf, member):
+    """internal function, memory-maps an uncompressed .npy member of a zip (npz) file
+    returns None if the member can not be mapped (compressed, object or empty array)"""
+    info = zf.getinfo(member)
+    if info.compress_type != zipfile.ZIP_STORED: return(None)
+    with open(path, 'rb') as f:
+        # skip the local file header of the member
+        f.seek(info.header_offset)
+        n_name, n_extra = struct.unpack('<HH', f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + n_name + n_extra)
+
+        # read the .npy header
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0): shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:                 shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if dtype.hasobject or int(np.prod(shape)) == 0: return(None)
+    return(np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran else 'C'))
+
+
+def _toJson(x):
+    """internal function, converts (nested) results to json-able python types
+    arrays become lists, non finite numbers become null and functions their names"""
+    if isinstance(x, dict):             return({str(key): _toJson(val) for key, val in x.items()})
+    if isinstance(x, (list, tuple)):    return([_toJson(val) for val in x])
+    if isinstance(x, np.ndarray):       return(_toJson(x.tolist()))
+    if isinstance(x, np.generic):       return(_toJson(x.item()))
+    if isinstance(x, float):            return(x if np.isfinite(x) else None)
+    if callable(x):                     return(x.__name__)
+    return(x)
@@ -0,0 +1,146 @@
+""" Multi-stream filtering with the (continuous) Hierarchical Gaussian Filter
+one parameter vector is applied to many input series at once, the representations of all streams are
+updated together per trial (vectorized over streams), every stream can have its own missing (nan) trials
+
+usage:  res = filterMulti(r, p, inputs)        # r with c_prc (and optionally c_obs / p_obs), inputs (n_streams, n_trials)
+        res['traj']['mu'][s]                   # trajectories of stream s, as traj['mu'] of hgf for that series
+        res['logLl'][s]                        # log-likelihood of stream s (with an observation model)
+
+Model implemented as discribed in: Mathys, C. D., Lomakina, E. I., Daunizeau, J., Iglesias, S., Brodersen, K. H., Friston, K. J., & Stephan, K. E. (2014). Uncertainty in perception and the Hierarchical Gaussian Filter. Frontiers in human neuroscience, 8, 825.
+
+Code adapted by Jorie van Haren (2021) """
+
+# load nessecary packages
+import numpy as np
+
+# load config files and function lookups
+from HGF.hgf_config import prc_layout
+from HGF.hgf_fit import _storedfunc
+
+# trajectory fields of filterMulti
+TRAJ_MULTI = ['mu', 'sa', 'mu_hat', 'sa_hat', 'v', 'w', 'da', 'dau']
+
+##########################
+## MAIN MULTI FUNCTIONS ##
+##########################
+
+def filterMulti(r, p, inputs, responses=None, trans=False, deltas=None, obs_fun=None, ptrans_obs=None):
+    """Filter n_streams input series with one set of perceptual parameters (hgf / ehgf)
+    input:
+            r      = dict with at least c_prc (e.g. {'c_prc': hgf_config()} or the r of fitModel)
+            p      = perceptual parameters, in native space (or transformed space with trans=True)
+            inputs = (n_streams, n_trials) array of inputs, nan for missing trials of a stream
+    optional inputs:
+            responses  = (n_streams, n_trials) array of responses for the observation model, nan for irregular trials
+            deltas     = time deltas for irregular intervals, (n_trials,) shared or (n_streams, n_trials) per stream
+            obs_fun    = observation function for the log-likelihoods, default r['c_obs']['obs_fun'] if present
+            ptrans_obs = transformed observation parameters, default r['p_obs']['ptrans'] if present
+    output:
+            returns dict with
+            traj      = dict of (n_streams, n_trials, n_levels) trajectories ((n_streams, n_trials, 1) for dau),
+                        equal to the traj of hgf / ehgf for every single series
+            infStates = (n_streams, n_trials, n_levels, 4) inferred states, traj entries are views into it
+            logLl     = (n_streams,) log-likelihoods (None without observation model)"""
+    layout = prc_layout(r['c_prc'])
+    if layout.binary: raise ValueError('filterMulti supports the continuous models (hgf, ehgf), not {}'.format(layout.model))
+    if trans: p = r['c_prc']['transp_prc_fun'](r, p)
+    p_dict = layout.unpack(np.asarray(p, dtype=float))
+    rho, ka, om, th, al = p_dict['rho'], p_dict['ka'], p_dict['om'], p_dict['th'], p_dict['al']
+
+    U = np.atleast_2d(np.asarray(inputs, dtype=float))
+    S, n = U.shape
+    l = layout.n_levels
+    enhanced = layout.enhanced
+
+    # time deltas (trial 0 holds the priors)
+    if deltas is None: t = np.ones((S, n+1))
+    else:              t = np.broadcast_to(np.insert(np.atleast_2d(np.asarray(deltas, dtype=float)), 0, 0, axis=1), (S, n+1))
+    ign = np.isnan(U)
+
+    # states of all streams, mu^ sa^ mu sa interleaved as in infStates (row 0 holds the priors)
+    inf    = np.full((S, n+1, l, 4), np.nan)
+    mu_hat, mu = inf[...,0], inf[...,2]
+    pi     = np.full((S, n+1, l), np.nan)
+    pi_hat = np.full((S, n+1, l), np.nan)
+    v      = np.full((S, n+1, l), np.nan)
+    w      = np.full((S, n+1, l-1), np.nan)
+    da     = np.full((S, n+1, l), np.nan)
+    dau    = np.full((S, n+1, 1), np.nan)
+    mu[:,0] = p_dict['mu_0']
+    pi[:,0] = p_dict['sa_0']**-1
+
+    # represnetation update loop, all streams at once
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        for trial in range(1, n+1):
+            tt, u, keep = t[:,trial], U[:,trial-1], ign[:,trial-1]
+
+            ####1ST LVL####
+            mu_hat[:,trial,0] = mu[:,trial-1,0] + tt * rho[0]
+            pi_hat[:,trial,0] = (pi[:,trial-1,0]**-1 + tt * np.exp(ka[0] * mu[:,trial-1,1] + om[0]))**-1
+            dau[:,trial,0]    = u - mu_hat[:,trial,0]
+            pi[:,trial,0]     = pi_hat[:,trial,0] + al**-1
+            mu[:,trial,0]     = mu_hat[:,trial,0] + pi_hat[:,trial,0]**-1 * (pi_hat[:,trial,0]**-1 + al)**-1 * dau[:,trial,0]
+            da[:,trial,0]     = (pi[:,trial,0]**-1 + (mu[:,trial,0] - mu_hat[:,trial,0])**2) * pi_hat[:,trial,0] - 1
+
+            ####HIGHER LEVELS####
+            for lvl in range(1, l):
+                mu_hat[:,trial,lvl] = mu[:,trial-1,lvl] + tt * rho[lvl]
+                if lvl != l-1:
+                    pi_hat[:,trial,lvl] = (pi[:,trial-1,lvl]**-1 + tt * np.exp(ka[lvl] * mu[:,trial-1,lvl+1] + om[lvl]))**-1
+                    v[:,trial,lvl-1]    = tt * np.exp(ka[lvl-1] * mu[:,trial-1,lvl] + om[lvl-1])
+                    w[:,trial,lvl-1]    = v[:,trial,lvl-1] * pi_hat[:,trial,lvl-1]
+                else:
+                    pi_hat[:,trial,l-1] = (pi[:,trial-1,l-1]**-1 + tt * th)**-1
+                    v[:,trial,l-1]      = tt * th
+                    v[:,trial,l-2]      = tt * np.exp(ka[l-2] * mu[:,trial-1,l-1] + om[l-2])
+                    w[:,trial,l-2]      = v[:,trial,l-2] * pi_hat[:,trial,l-2]
+
+                if enhanced:
+                    mu[:,trial,lvl] = mu_hat[:,trial,lvl] + 0.5 * pi_hat[:,trial,lvl]**-1 * ka[lvl-1] * w[:,trial,lvl-1] * da[:,trial,lvl-1]
+                    vv      = tt * np.exp(ka[lvl-1] * mu[:,trial,lvl] + om[lvl-1])
+                    pim_hat = (pi[:,trial-1,lvl-1]**-1 + vv)**-1
+                    ww      = vv * pim_hat
+                    rr      = (vv - pi[:,trial-1,lvl-1]**-1) * pim_hat
+                    dd      = (pi[:,trial,lvl-1]**-1 + (mu[:,trial,lvl-1] - mu_hat[:,trial,lvl-1])**2) * pim_hat - 1
+                    pi[:,trial,lvl] = pi_hat[:,trial,lvl] + np.maximum(0, 0.5 * ka[lvl-1]**2 * ww * (ww + rr * dd))
+                else:
+                    pi[:,trial,lvl] = pi_hat[:,trial,lvl] + 0.5 * ka[lvl-1]**2 * w[:,trial,lvl-1] * \
+                                      (w[:,trial,lvl-1] + (2 * w[:,trial,lvl-1] - 1) * da[:,trial,lvl-1])
+                    mu[:,trial,lvl] = mu_hat[:,trial,lvl] + 0.5 * pi[:,trial,lvl]**-1 * ka[lvl-1] * w[:,trial,lvl-1] * da[:,trial,lvl-1]
+                da[:,trial,lvl] = (pi[:,trial,lvl]**-1 + (mu[:,trial,lvl] - mu_hat[:,trial,lvl])**2) * pi_hat[:,trial,lvl] - 1
+
+            # streams with a missing trial keep their representations
+            if keep.any():
+                for arr in [mu, pi, v, w, da]: arr[keep,trial] = arr[keep,trial-1]
+                mu_hat[keep,trial], pi_hat[keep,trial], dau[keep,trial] = np.nan, np.nan, np.nan
+
+        # variances
+        np.divide(1, pi_hat, out=inf[...,1])
+        np.divide(1, pi, out=inf[...,3])
+
+    # remove priors (views, no copies)
+    infStates = inf[:,1:]
+    traj = {'mu': infStates[...,2], 'sa': infStates[...,3], 'mu_hat': infStates[...,0], 'sa_hat': infStates[...,1],
+            'v': v[:,1:], 'w': w[:,1:], 'da': da[:,1:], 'dau': dau[:,1:]}
+    return({'traj': traj, 'infStates': infStates, 'logLl': _logLls(r, infStates, U, responses, obs_fun, ptrans_obs)})
+
+
+## Helper functions
+
+def _logLls(r, infStates, U, responses, obs_fun, ptrans_obs):
+    """internal function, log-likelihood of every stream under the observation model (None without one)"""
+    if obs_fun is None and 'c_obs' in r and isinstance(r['c_obs'], dict):
+        obs_fun = r['c_obs'].get('obs_fun')
+    if obs_fun is None: return(None)
+    if isinstance(obs_fun, str): obs_fun = _storedfunc(obs_fun)
+    if ptrans_obs is None and 'p_obs' in r: ptrans_obs = r['p_obs']['ptrans']
+    Y = None if responses is None else np.atleast_2d(np.asarray(responses, dtype=float))
+
+    logLl = np.empty(len(U))
+    for s in range(len(U)):
+        y  = np.array([]) if Y is None else Y[s]
+        rc = {'u': U[s], 'y': y, 'c_prc': r['c_prc'], 'c_obs': r.get('c_obs'),
+              'ign': np.argwhere(np.isnan(U[s])), 'irr': np.argwhere(np.isnan(y))}
+        logp, yhat, res = obs_fun(rc, infStates[s], ptrans_obs)
+        logLl[s] = np.nansum(logp, dtype=np.float64)
+    return(logLl)
@@ -12,71 +12,116 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 
 # load extra (non exclusive) helper function
-from HGF.hgf import _sgm
+from HGF.hgf import _sgm, _acf, _inputvalues, TRAJ_CONTINUOUS
 
 ## Construct dataframe function
 
-def constructDataframe(r, sim):
-    """input fitted data r, and simulated data sim (from fitModel and simModel)
-    returns a pandas dataframe for easy plotting"""
-    # construct dataframe
-    df_dict = {}
-    df_dict['u'] = sim['u']
-    df_dict['y'] = sim['y']
-    df_dict['trial'] = np.arange(1, len(sim['u'])+1)
-
-    # add fitted optimization parameters
-    df_dict['fit_yhat']   = r['optim']['yhat']
-    df_dict['fit_res']    = r['optim']['res']
-    df_dict['fit_resAC']  = r['optim']['resAC']
-
-    # loop and add all fitted trajectory parameters
-    for item in r['traj'].keys():
-        for lvl in range(len(r['traj'][item][0,:])):
-            df_dict['fit_{}_lvl{}'.format(item, lvl+1)] = r['traj'][item][:,lvl]
-
-    # loop and add all simulated trajectory parameters
-    for item in sim['traj'].keys():
-        for lvl in range(len(sim['traj'][item][0,:])):
-            df_dict['sim_{}_lvl{}'.format(item, lvl+1)] = sim['traj'][item][:,lvl]
-
-    # finally add this all to a dict
-    df = pd.DataFrame(df_dict)
-    
-    # add priors
-    df = pd.DataFrame([[np.nan] * len(df.columns)], columns=df.columns).append(df, ignore_index=True)
-    for lvl in range(len(r['traj']['mu'][0,:])):
-        # fits
-        df.loc[0, 'fit_mu_lvl{}'.format(lvl+1)] = r['p_prc']['mu_0'][lvl]
-        df.loc[0, 'fit_sa_lvl{}'.format(lvl+1)] = r['p_prc']['sa_0'][lvl]
-    for lvl in range(len(sim['traj']['mu'][0,:])):
-        # simulations
-        df.loc[0, 'sim_mu_lvl{}'.format(lvl+1)] = sim['p_prc']['mu_0'][lvl]
-        df.loc[0, 'sim_sa_lvl{}'.format(lvl+1)] = sim['p_prc']['sa_0'][lvl]
-    
-    # sgm transform
-    if 'binary' in r['c_prc']['model']: 
-        df = df.assign(fit_mu_lvl2_sgm= _sgm(df['fit_mu_lvl2'], 1))
-        df = df.assign(sim_mu_lvl2_sgm= _sgm(df['sim_mu_lvl2'], 1))
-        
-    # calculate higher and lower bound
-    for lvl in range(len(r['traj']['mu'][0,:])):
-        kwargs = {'fit_mu_lvl{}_upper'.format(lvl+1) : df['fit_mu_lvl{}'.format(lvl+1)] + np.sqrt(df['fit_sa_lvl{}'.format(lvl+1)])}
-        df = df.assign(**kwargs)
-        kwargs = {'fit_mu_lvl{}_lower'.format(lvl+1) : df['fit_mu_lvl{}'.format(lvl+1)] - np.sqrt(df['fit_sa_lvl{}'.format(lvl+1)])}
-        df = df.assign(**kwargs)
-        
-    for lvl in range(len(sim['traj']['mu'][0,:])):
-        kwargs = {'sim_mu_lvl{}_upper'.format(lvl+1) : df['sim_mu_lvl{}'.format(lvl+1)] + np.sqrt(df['sim_sa_lvl{}'.format(lvl+1)])}
-        df = df.assign(**kwargs)
-        kwargs = {'sim_mu_lvl{}_lower'.format(lvl+1) : df['sim_mu_lvl{}'.format(lvl+1)] - np.sqrt(df['sim_sa_lvl{}'.format(lvl+1)])}
-        df = df.assign(**kwargs)
+def constructDataframe(r=None, sim=None, frame=True):
+    """input fitted data r and/or simulated data sim (from fitModel and simModel)
+    returns a pandas dataframe for easy plotting, the first row holds the priors
+    all columns are written into one preallocated array, so large results are not copied per column,
+    building the frame costs about one copy of its data (a memory bound floor, no faster construction exists)
+    optional frame = if False a dict of column arrays is returned instead of a dataframe
+                     (accepted by the plot functions as well)"""
+    if r is None and sim is None: raise ValueError('constructDataframe needs a fit r and/or a simulation sim')
+    base = sim if sim is not None else r
+    u    = _inputvalues(base)
+    n    = len(u)
+    y    = base.get('y', [])
+    if len(y) != n: y = np.full(n, np.nan)
+    sources = [(prefix, res) for prefix, res in [('fit', r), ('sim', sim)] if res is not None]
+
+    # column plan: name, values (or None for derived columns) and prior value
+    cols = [('u', u, np.nan), ('y', y, np.nan), ('trial', np.arange(1, n+1), np.nan)]
+    if r is not None:
+        for key in ['yhat', 'res']:
+            if len(r['optim'].get(key, [])) == n: cols.append(('fit_{}'.format(key), r['optim'][key], np.nan))
+        # residual autocorrelation per lag (resLags+1 rows), nan padded, all nan without residual diagnostics
+        resAC = np.full(n, np.nan)
+        ac    = np.asarray(r['optim'].get('resAC', []), dtype=float).ravel()[:n]
+        resAC[:len(ac)] = ac
+        cols.append(('fit_resAC', resAC, np.nan))
+    for prefix, res in sources:
+        for item, val in res['traj'].items():
+            val = val.reshape(n, -1)
+            for lvl in range(val.shape[1]):
+                prior = res['p_prc']['{}_0'.format(item)][lvl] if item in ['mu', 'sa'] else np.nan
+                cols.append(('{}_{}_lvl{}'.format(prefix, item, lvl+1), val[:,lvl], prior))
+    derived = [('{}_mu_lvl2_sgm'.format(prefix), 'sgm', prefix, 2) for prefix, res in sources
+               if 'binary' in res['c_prc']['model'] and 'mu' in res['traj']]
+    for prefix, res in sources:
+        if 'mu' in res['traj'] and 'sa' in res['traj']:
+            for lvl in range(res['traj']['mu'].shape[1]):
+                derived += [('{}_mu_lvl{}_upper'.format(prefix, lvl+1), 'upper', prefix, lvl+1),
+                            ('{}_mu_lvl{}_lower'.format(prefix, lvl+1), 'lower', prefix, lvl+1)]
+
+    # single allocation, prior row first
+    names = [name for name, val, prior in cols] + [name for name, kind, prefix, lvl in derived]
+    data  = np.empty((n+1, len(names)), order='F')  # column-major, every column is contiguous
+    for j, (name, val, prior) in enumerate(cols):
+        data[0,j]  = prior
+        data[1:,j] = val
+    idx = {name: j for j, name in enumerate(names)}
+    for j, (name, kind, prefix, lvl) in enumerate(derived, len(cols)):
+        mu, out = data[:,idx['{}_mu_lvl{}'.format(prefix, lvl)]], data[:,j]
+        if kind == 'sgm':
+            out[:] = _sgm(mu, 1)
+        else:  # bounds, mu -/+ sqrt(sa)
+            np.sqrt(data[:,idx['{}_sa_lvl{}'.format(prefix, lvl)]], out=out)
+            if kind == 'upper': np.add(mu, out, out=out)
+            else:               np.subtract(mu, out, out=out)
+    if not frame: return({name: data[:,j] for j, name in enumerate(names)})
+    return(pd.DataFrame(data, columns=names, copy=False))
+
+
+def constructLongDataframe(results, source='fit'):
+    """input results of many subjects, dict {subject: r} or list of r (from fitModel or simModel)
+    returns a long format pandas dataframe with one row per subject, trial and level
+    (columns subject, source, trial, level, u, y, the trajectory fields and mu_upper / mu_lower),
+    trial 0 holds the priors, fields with fewer levels (e.g. w) are nan padded"""
+    items = list(results.items()) if isinstance(results, dict) else list(enumerate(results))
+    fields = [field for field in TRAJ_CONTINUOUS if any(field in res['traj'] for key, res in items)]
+    names  = ['trial', 'level', 'u', 'y'] + fields + (['mu_upper', 'mu_lower'] if {'mu', 'sa'} <= set(fields) else [])
+
+    # single allocation for all subjects
+    sizes = [(len(_inputvalues(res)) + 1) * res['traj']['mu' if 'mu' in res['traj'] else fields[0]].shape[1] for key, res in items]
+    data  = np.full((sum(sizes), len(names)), np.nan)
+    codes = np.repeat(np.arange(len(items)), sizes)
+    col   = {name: j for j, name in enumerate(names)}
+    start = 0
+    for (key, res), size in zip(items, sizes):
+        u  = _inputvalues(res)
+        n  = len(u)
+        l  = size // (n+1)
+        block = data[start:start+size].reshape(n+1, l, len(names))  # view, rows are trial-major
+        block[:,:,col['trial']] = np.arange(n+1)[:,None]
+        block[:,:,col['level']] = np.arange(1, l+1)[None,:]
+        block[1:,:,col['u']]    = u[:,None]
+        if len(res.get('y', [])) == n: block[1:,:,col['y']] = np.asarray(res['y'])[:,None]
+        for field in fields:
+            if field not in res['traj']: continue
+            val = res['traj'][field].reshape(n, -1)
+            block[1:,:val.shape[1],col[field]] = val
+        for field in ['mu', 'sa']:
+            if field in col: block[0,:,col[field]] = res['p_prc']['{}_0'.format(field)][:l]
+        if 'mu_upper' in col:
+            np.sqrt(block[:,:,col['sa']], out=block[:,:,col['mu_upper']])
+            np.subtract(block[:,:,col['mu']], block[:,:,col['mu_upper']], out=block[:,:,col['mu_lower']])
+            np.add(block[:,:,col['mu']], block[:,:,col['mu_upper']], out=block[:,:,col['mu_upper']])
+        start += size
+
+    df = pd.DataFrame(data, columns=names, copy=False)
+    df.insert(0, 'source', pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), [source]))
+    df.insert(0, 'subject', pd.Categorical.from_codes(codes, [str(key) for key, res in items]))
     return(df)
 
 
 ## Plotting functions
+# all plot functions take the output of constructDataframe (dataframe or dict of columns),
+# long sequences are downsampled to at most max_points per line (min and max of every bucket, so peaks stay visible),
+# max_points=None plots every trial, and with path the figure is written to file and closed
 
-def plot_binary_expect(df, r, fit='sim'):
+def plot_binary_expect(df, r, fit='sim', max_points=4000, path=None):
     """Function to plot binary expectations over all levels"""
 
     # configure plot size
@@ -92,11 +137,10 @@ def plot_binary_expect(df, r, fit='sim'):
 
         if lvl > 1:
             # plot main results
-            ax[pltnr].plot(df['{}_mu_lvl{}'.format(fit,lvl)])
-            ax[pltnr].fill_between(df['trial'], 
-                                   df['{}_mu_lvl{}_upper'.format(fit,lvl)], 
-                                   df['{}_mu_lvl{}_lower'.format(fit,lvl)], 
-                                   alpha=0.2)
+            _line(ax[pltnr], df['{}_mu_lvl{}'.format(fit,lvl)], max_points)
+            _band(ax[pltnr], df['{}_mu_lvl{}_upper'.format(fit,lvl)], 
+                             df['{}_mu_lvl{}_lower'.format(fit,lvl)], max_points, 
+                             alpha=0.2)
 
             ax[pltnr].set_ylabel('μ{}'.format(lvl), fontsize=16)
             ax[pltnr].tick_params(axis='y', which='major', labelsize=16)
@@ -104,16 +148,12 @@ def plot_binary_expect(df, r, fit='sim'):
             ax[pltnr].set_title('Posterior expectations of x{}'.format(lvl), fontsize=18)
         else:
 
-            # adjust to make better visible
-            df.loc[df['y'] == 1, 'y'] = 0.96
-            df.loc[df['y'] == 0, 'y'] = 0.04
-
-            # plot actual and response
-            ax[pltnr].scatter(df['trial'],df['u'], label='Stimuli', color='orange')
-            ax[pltnr].scatter(df['trial'],df['y'], label='Response', color='green')
+            # plot actual and response (adjusted to make better visible)
+            _scatter(ax[pltnr], df['u'], max_points, label='Stimuli', color='orange')
+            _scatter(ax[pltnr], _binaryvisible(df['y']), max_points, label='Response', color='green')
 
             # plot the mu expectation
-            ax[pltnr].plot(df['{}_mu_lvl2_sgm'.format(fit)])
+            _line(ax[pltnr], df['{}_mu_lvl2_sgm'.format(fit)], max_points)
 
             # set legend and ylabel
             ax[pltnr].legend(fontsize=16)
@@ -127,10 +167,10 @@ def plot_binary_expect(df, r, fit='sim'):
     plt.xticks(fontsize=16)
     plt.suptitle('Binary expectations\n',fontsize=22);
     plt.tight_layout()
-    return(ax)
+    return(_finish(fig, ax, path))
     
     
-def plot_binary_learningrate(df, fit='sim'):
+def plot_binary_learningrate(df, fit='sim', max_points=4000, path=None):
     """Function to plot learningrate for output level"""
 
     # configure plot size
@@ -140,17 +180,13 @@ def plot_binary_learningrate(df, fit='sim'):
                            figsize=(12, 8), 
                            gridspec_kw={'height_ratios': [3, 1]})
 
-    # adjust to make better visible
-    df.loc[df['y'] == 1, 'y'] = 0.96
-    df.loc[df['y'] == 0, 'y'] = 0.04
-
-    # plot actual and response
-    ax[0].scatter(df['trial'],df['u'], label='Stimuli', alpha=0.5, color='orange')
-    ax[0].scatter(df['trial'],df['y'], label='Response', alpha=0.5, color='green')
+    # plot actual and response (adjusted to make better visible)
+    _scatter(ax[0], df['u'], max_points, label='Stimuli', alpha=0.5, color='orange')
+    _scatter(ax[0], _binaryvisible(df['y']), max_points, label='Response', alpha=0.5, color='green')
 
     # plot the mu expectation
-    ax[0].plot(df['{}_mu_lvl2_sgm'.format(fit)], color='black', lw=2, ls='--',  alpha=0.5)        
-    ax[1].plot(df['sim_wt_lvl1'], color='red', lw=2)
+    _line(ax[0], df['{}_mu_lvl2_sgm'.format(fit)], max_points, color='black', lw=2, ls='--',  alpha=0.5)        
+    _line(ax[1], df['sim_wt_lvl1'], max_points, color='red', lw=2)
 
     # set legend and ylabel
     ax[0].legend(fontsize=16)
@@ -168,10 +204,10 @@ def plot_binary_learningrate(df, fit='sim'):
     plt.suptitle('Learning rate',fontsize=22);
     
     plt.tight_layout()
-    return(ax)
+    return(_finish(fig, ax, path))
     
     
-def plot_expect(df, r, fit='sim', pres_post=True):
+def plot_expect(df, r, fit='sim', pres_post=True, max_points=4000, path=None):
     """Function to plot expectations over all levels"""
 
     # configure plot size
@@ -187,11 +223,10 @@ def plot_expect(df, r, fit='sim', pres_post=True):
         
         # plot main results
         if pres_post == True or lvl > 1:
-            ax[pltnr].plot(df['{}_mu_lvl{}'.format(fit,lvl)], alpha=0.8)
-            ax[pltnr].fill_between(df['trial'], 
-                                   df['{}_mu_lvl{}_upper'.format(fit,lvl)], 
-                                   df['{}_mu_lvl{}_lower'.format(fit,lvl)], 
-                                   alpha=0.3)
+            _line(ax[pltnr], df['{}_mu_lvl{}'.format(fit,lvl)], max_points, alpha=0.8)
+            _band(ax[pltnr], df['{}_mu_lvl{}_upper'.format(fit,lvl)], 
+                             df['{}_mu_lvl{}_lower'.format(fit,lvl)], max_points, 
+                             alpha=0.3)
 
         if lvl > 1:
             # set labels 
@@ -201,8 +236,8 @@ def plot_expect(df, r, fit='sim', pres_post=True):
         
         else:
             # plot actual and response
-            ax[pltnr].scatter(df['trial'],df['u'], label='Stimuli', alpha=0.8, s=3, color='orange')
-            ax[pltnr].scatter(df['trial'],df['y'], label='Response', alpha=0.8, s=3, color='green')
+            _scatter(ax[pltnr], df['u'], max_points, label='Stimuli', alpha=0.8, s=3, color='orange')
+            _scatter(ax[pltnr], df['y'], max_points, label='Response', alpha=0.8, s=3, color='green')
 
             # set legend and ylabel
             ax[pltnr].legend(fontsize=16)
@@ -216,10 +251,10 @@ def plot_expect(df, r, fit='sim', pres_post=True):
     plt.xticks(fontsize=16)
     plt.suptitle('Expectations\n',fontsize=22);
     plt.tight_layout()
-    return(ax)
+    return(_finish(fig, ax, path))
     
     
-def plot_learningrate(df, fit='sim', alpha_mu=0.5):
+def plot_learningrate(df, fit='sim', alpha_mu=0.5, max_points=4000, path=None):
     """Function to plot learningrate for output level"""
 
     # configure plot size
@@ -230,12 +265,12 @@ def plot_learningrate(df, fit='sim', alpha_mu=0.5):
                            gridspec_kw={'height_ratios': [3, 1]})
 
     # plot actual and response
-    ax[0].scatter(df['trial'],df['u'], label='Stimuli', alpha=0.5, s=4, color='orange')
-    ax[0].scatter(df['trial'],df['y'], label='Response', alpha=0.5, s=4, color='green')
+    _scatter(ax[0], df['u'], max_points, label='Stimuli', alpha=0.5, s=4, color='orange')
+    _scatter(ax[0], df['y'], max_points, label='Response', alpha=0.5, s=4, color='green')
 
     # plot the mu expectation
-    ax[0].plot(df['{}_mu_lvl1'.format(fit)], color='black', lw=1, ls='--',  alpha=alpha_mu)
-    ax[1].plot(df['sim_wt_lvl1'], color='red', lw=2)
+    _line(ax[0], df['{}_mu_lvl1'.format(fit)], max_points, color='black', lw=1, ls='--',  alpha=alpha_mu)
+    _line(ax[1], df['sim_wt_lvl1'], max_points, color='red', lw=2)
 
     # set legend and ylabel
     ax[0].legend(fontsize=16)
@@ -252,10 +287,10 @@ def plot_learningrate(df, fit='sim', alpha_mu=0.5):
     plt.xticks(fontsize=16)
     plt.suptitle('Learning rate',fontsize=22);
     plt.tight_layout()
-    return(ax)
+    return(_finish(fig, ax, path))
 
 
-def plot_precision_weights(df, fit='sim'):
+def plot_precision_weights(df, fit='sim', max_points=4000, path=None):
     """Plot the precision weights over all levels.
     Note that alient events is reflected in the precision weights
     input: df, optional fit ('sim' or 'fit')
@@ -265,12 +300,13 @@ def plot_precision_weights(df, fit='sim'):
     fig, ax = plt.subplots(figsize=(12, 6))
 
     # set columns of interest and number of levels
-    colofintr = [s for s in df.columns if '{}_wt'.format(fit) in s]
+    colofintr = [s for s in df.keys() if '{}_wt'.format(fit) in s]
     n_levels = ['1st level', '2nd level', '3rd level', '4th level', '5th level',
                 '6th level', '7th level', '8th level', '9th level', '10th level'][:len(colofintr)]
 
     # plot precision weights 
-    ax.plot(df[colofintr], lw=2.5)
+    for col in colofintr:
+        _line(ax, df[col], max_points, lw=2.5)
 
     # set x and y label para
     plt.xlabel('Trial nr.', fontsize=16)
@@ -282,36 +318,43 @@ def plot_precision_weights(df, fit='sim'):
     ax.legend(n_levels, fontsize=14)
     plt.suptitle('Precision weights', fontsize=22)
     plt.tight_layout()
-    return(ax)
+    return(_finish(fig, ax, path))
 
 
-def plot_residualdiag(r):
+def plot_residualdiag(r, maxlags=100, max_points=4000, path=None):
     """Plot residuals / difference between pred and response.
     Usefull to check for patterns (indicating model failed to capture ellements of the data)
-    input dictonairy and returns plt plot"""
+    input dictonairy and returns plt plot
+    optional maxlags = number of autocorrelation lags shown (computed with an FFT)"""
     # configure plot size
     fig, ax = plt.subplots(3, 
                            1, 
                            sharex=False, 
                            figsize=(12, 12))
 
+    res  = np.asarray(r['optim']['res'])
+    yhat = np.asarray(r['optim']['yhat'])
 
     # plot residual time series and pimp
-    ax[0].plot(r['optim']['res'])
+    _line(ax[0], res, max_points)
     ax[0].tick_params(labelsize=16)
     ax[0].set_title('Residuals time series', fontsize=18, fontweight='bold')
     ax[0].set_ylabel('Residuals', fontsize=16)
     ax[0].set_xlabel('Trial nr.', fontsize=16)
 
-    # plot risidual autocorrelation 
-    ax[1].acorr(r['optim']['res'], maxlags = int(len(r['optim']['res'])/2), lw=2.5)
+    # plot risidual autocorrelation (symmetric, as ax.acorr)
+    maxlags = min(maxlags, len(res)-1)
+    ac      = _acf(res, maxlags)
+    ax[1].vlines(np.arange(-maxlags, maxlags+1), 0, np.concatenate([ac[:0:-1], ac]), lw=2.5)
+    ax[1].axhline(0, color='black', lw=1)
     ax[1].tick_params(labelsize=16)
     ax[1].set_title('Residuals autocorrelation', fontsize=18, fontweight='bold')
     ax[1].set_ylabel('Coeff.', fontsize=16)
     ax[1].set_xlabel('Lag', fontsize=16)
 
-    # plot risiduals vs predictions
-    ax[2].scatter(r['optim']['yhat'], r['optim']['res'])
+    # plot risiduals vs predictions (every k-th trial for long sequences)
+    step = 1 if max_points is None else max(1, int(np.ceil(len(res) / max_points)))
+    ax[2].scatter(yhat[::step], res[::step])
     ax[2].tick_params(labelsize=16)
     ax[2].set_title('Scatter residuals vs predictions', fontsize=18, fontweight='bold')
     ax[2].set_ylabel('Residuals', fontsize=16)
@@ -320,6 +363,60 @@ def plot_residualdiag(r):
     # set title and layout
     plt.suptitle('Residuals diagnostics\n',fontsize=22);
     plt.tight_layout()
+    return(_finish(fig, ax, path))
+
+
+## Plot helper functions
+
+def _minmax(y, max_points):
+    """internal function, indices of the minimum and maximum of every bucket (visual downsampling)
+    at most max_points indices (max_points // 2 buckets), all indices for short sequences or max_points=None"""
+    n = len(y)
+    if max_points is None or n <= max_points: return(np.arange(n))
+    if max_points < 2: raise ValueError('max_points should be at least 2 (a minimum and maximum), not {}'.format(max_points))
+    size  = int(np.ceil(n / (max_points // 2)))
+    k     = int(np.ceil(n / size))           # buckets, the last one nan padded
+    block = np.full(k * size, np.nan)
+    block[:n] = y
+    block = block.reshape(k, size)
+    start = np.arange(0, k * size, size)
+    low   = start + np.argmin(np.where(np.isnan(block), np.inf, block), axis=1)
+    high  = start + np.argmax(np.where(np.isnan(block), -np.inf, block), axis=1)
+    return(np.unique(np.concatenate([low, high])))
+
+
+def _line(ax, y, max_points, **kwargs):
+    """internal function, line plot of y against trial (row) number"""
+    idx = _minmax(y, max_points)
+    return(ax.plot(idx, np.asarray(y)[idx], **kwargs))
+
+
+def _band(ax, upper, lower, max_points, **kwargs):
+    """internal function, filled band between upper and lower"""
+    idx = np.union1d(_minmax(upper, max_points), _minmax(lower, max_points))
+    return(ax.fill_between(idx, np.asarray(upper)[idx], np.asarray(lower)[idx], **kwargs))
+
+
+def _scatter(ax, y, max_points, **kwargs):
+    """internal function, scatter plot of y against trial (row) number"""
+    idx = _minmax(y, max_points)
+    return(ax.scatter(idx, np.asarray(y)[idx], **kwargs))
+
+
+def _binaryvisible(y):
+    """internal function, moves binary responses slightly inwards to make them better visible
+    (a copy, the dataframe is left untouched)"""
+    y = np.array(y, dtype=float)
+    y[y == 1] = 0.96
+    y[y == 0] = 0.04
+    return(y)
+
+
+def _finish(fig, ax, path):
+    """internal function, writes the figure to path (and closes it) if given"""
+    if path is not None:
+        fig.savefig(path)
+        plt.close(fig)
     return(ax)
 
 ## Print function
@@ -341,5 +438,7 @@ def printfitmodel(r):
     print('\nMODEL QUALITY:')
     for i in [['LME', 'more'], ['AIC', 'less'], ['BIC', 'less']] :
         print(' {}: \t {} \t\t ({} is better)'.format(i[0], r['optim'][i[0]], i[1]))
+    if r['optim'].get('budgetLimited'):
+        print('\nNOTE: optimization stopped at its {} budget, estimates are the best point so far'.format(r['optim']['stopped']))
 
     return
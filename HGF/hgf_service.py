@@ -0,0 +1,210 @@
+""" Local HTTP/JSON service for model fitting and model simulation of the Hierarchical Gaussian Filter
+jobs are queued and executed on a warm worker pool, clients poll for their status and results
+only the python standard library is used for the service itself
+
+usage:  python -m HGF.hgf_service --port 8642 --jobs 4 [--ttl 3600] [--max-done 1000]
+
+        POST   /fit         {"inputs": [...], "responses": [...], "per_model": "ehgf_binary",
+                             "obs_model": "unitsq_sgm", "overrides": {"c_prc": {...}}}
+        POST   /simulate    {"inputs": [...], "prc_model": "ehgf_binary", "prc_pvec": [...],
+                             "obs_model": "unitsq_sgm", "obs_pvec": 5, "seed": 1}
+        GET    /jobs        status of all jobs
+        GET    /jobs/<id>   status of one job, including its result when done
+        DELETE /jobs/<id>   cancel a queued job, or forget a finished one
+
+model names are the function names known to the fit functions (see hgf_fit._storedfunc),
+missing values in inputs / pvecs can be given as null
+finished jobs (and their results) are kept ttl seconds after they finished, and at most max_done of them
+(the oldest are removed first), queued and running jobs are always kept
+
+Model implemented as discribed in: Mathys, C. D., Lomakina, E. I., Daunizeau, J., Iglesias, S., Brodersen, K. H., Friston, K. J., & Stephan, K. E. (2014). Uncertainty in perception and the Hierarchical Gaussian Filter. Frontiers in human neuroscience, 8, 825.
+
+Code adapted by Jorie van Haren (2021) """
+
+# load nessecary packages
+import json
+import time
+import uuid
+import argparse
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor
+
+# load config files, fit and sim functions
+from HGF.hgf_fit import fitModel, _storedfunc, _storedconfig
+from HGF.hgf_sim import simModel
+from HGF.hgf_io import _toJson
+
+###########################
+## MAIN SERVICE FUNCTION ##
+###########################
+
+def make_server(host='127.0.0.1', port=8642, n_jobs=None, ttl=3600, max_done=1000):
+    """create a (not yet running) service on host:port with a pool of n_jobs workers
+    finished jobs are removed ttl seconds after they finished, and when more than max_done are kept
+    call server.serve_forever() to run it and server.shutdown() / server.server_close() to stop"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.pool     = ProcessPoolExecutor(max_workers=n_jobs)
+    server.jobs     = {}
+    server.lock     = threading.Lock()
+    server.ttl      = ttl
+    server.max_done = max_done
+
+    # also stop the pool when the server is closed
+    close = server.server_close
+    def server_close():
+        close()
+        server.pool.shutdown(cancel_futures=True)
+    server.server_close = server_close
+    return(server)
+
+
+def serve(host='127.0.0.1', port=8642, n_jobs=None, ttl=3600, max_done=1000):
+    """run the service until interrupted"""
+    server = make_server(host, port, n_jobs, ttl, max_done)
+    print('HGF service listening on http://{}:{}'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+## Jobs (run inside the pool workers)
+
+def _runJob(kind, spec):
+    """internal function, runs one fit or simulation job and returns a json-able result"""
+    if kind == 'fit':
+        r = fitModel(_array(spec.get('responses', [])),
+                     _array(spec['inputs']),
+                     per_model=_storedconfig(spec.get('per_model', 'ehgf_binary')),
+                     obs_model=_storedconfig(spec.get('obs_model', 'unitsq_sgm')),
+                     opt_model=_storedconfig(spec.get('opt_model', 'quasinewton_optim')),
+                     overwrite_opt=_overrides(spec.get('overrides', False)))
+        keys = ['p_prc', 'p_obs', 'optim', 'traj'] if spec.get('traj', True) else ['p_prc', 'p_obs', 'optim']
+    elif kind == 'simulate':
+        kwargs = {}
+        if spec.get('obs_model'): kwargs['obs_model'] = _storedfunc(spec['obs_model'])
+        if 'obs_pvec' in spec:    kwargs['obs_pvec']  = _array(spec['obs_pvec'])
+        if 'seed' in spec:        kwargs['seed']      = spec['seed']
+        r = simModel(_array(spec['inputs']),
+                     _storedfunc(spec['prc_model']),
+                     _array(spec['prc_pvec']),
+                     overwrite_opt=_overrides(spec.get('overrides', False)),
+                     **kwargs)
+        keys = ['p_prc', 'y', 'traj']
+    else:
+        raise ValueError('unknown job type {}'.format(kind))
+    return({key: _toJson(r[key]) for key in keys if key in r})
+
+
+def _array(x):
+    """internal function, json list to float array (null becomes nan)"""
+    return(np.array([np.nan if i is None else i for i in x], dtype=float) if isinstance(x, list) else np.asarray(x))
+
+
+def _overrides(x):
+    """internal function, json overrides to the overwrite_opt format of fitModel / simModel"""
+    if not x: return(False)
+    return({item: {key: _array(val) if isinstance(val, list) else val for key, val in x[item].items()}
+            for item in x})
+
+
+## Request handling
+
+class _Handler(BaseHTTPRequestHandler):
+    """internal request handler, jobs are stored on the server"""
+
+    def do_POST(self):
+        kind = self.path.strip('/')
+        if kind not in ['fit', 'simulate']:
+            return(self._send(404, {'error': 'unknown endpoint {}'.format(self.path)}))
+        try:
+            spec = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError as e:
+            return(self._send(400, {'error': 'invalid json: {}'.format(e)}))
+
+        # queue the job on the pool
+        job_id = uuid.uuid4().hex
+        job    = {'type': kind, 'finished': None}
+        with self.server.lock:
+            _prune(self.server)
+            job['future'] = self.server.pool.submit(_runJob, kind, spec)
+            job['future'].add_done_callback(lambda fut: job.update(finished=time.time()))
+            self.server.jobs[job_id] = job
+        self._send(202, {'id': job_id, 'status': 'queued'})
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts[0] != 'jobs':
+            return(self._send(404, {'error': 'unknown endpoint {}'.format(self.path)}))
+        with self.server.lock:
+            _prune(self.server)
+            jobs = dict(self.server.jobs)
+        if len(parts) == 1:
+            return(self._send(200, {job_id: _status(job) for job_id, job in jobs.items()}))
+        if parts[1] not in jobs:
+            return(self._send(404, {'error': 'unknown job {}'.format(parts[1])}))
+
+        job = jobs[parts[1]]
+        out = {'id': parts[1], 'type': job['type'], 'status': _status(job)}
+        if out['status'] == 'done':     out['result'] = job['future'].result()
+        elif out['status'] == 'failed': out['error']  = repr(job['future'].exception())
+        self._send(200, out)
+
+    def do_DELETE(self):
+        parts = self.path.strip('/').split('/')
+        with self.server.lock:
+            job = self.server.jobs.get(parts[-1]) if parts[0] == 'jobs' and len(parts) == 2 else None
+            if job is None:
+                return(self._send(404, {'error': 'unknown job {}'.format(self.path)}))
+            if job['future'].running():
+                return(self._send(409, {'error': 'job is running'}))
+            job['future'].cancel()
+            self.server.jobs.pop(parts[-1])
+        self._send(200, {'id': parts[-1], 'status': 'removed'})
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # keep the console for fit output
+
+
+def _prune(server):
+    """internal function, removes finished jobs older than server.ttl and the oldest beyond server.max_done
+    (called with server.lock held)"""
+    now  = time.time()
+    done = sorted((job['finished'], job_id) for job_id, job in server.jobs.items() if job['finished'] is not None)
+    drop = [job_id for finished, job_id in done if server.ttl is not None and now - finished > server.ttl]
+    if server.max_done is not None:
+        keep = [job_id for finished, job_id in done if job_id not in drop]
+        drop += keep[:max(0, len(keep) - server.max_done)]
+    for job_id in drop: server.jobs.pop(job_id, None)
+
+
+def _status(job):
+    """internal function, returns status string of a job"""
+    fut = job['future']
+    if fut.cancelled():    return('cancelled')
+    if fut.running():      return('running')
+    if not fut.done():     return('queued')
+    return('failed' if fut.exception() is not None else 'done')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local HGF fitting service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8642)
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--ttl', type=float, default=3600, help='seconds finished jobs and their results are kept')
+    parser.add_argument('--max-done', type=int, default=1000, help='maximum number of finished jobs kept')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.jobs, args.ttl, args.max_done)
@@ -8,7 +8,6 @@ Code adapted by Jorie van Haren (2021) """
 # load nessecary packages
 import numpy as np
 import sys
-import statsmodels.api as sm
 from scipy import optimize
 
 # load config files and hgf update functions
@@ -27,7 +26,9 @@ def simModel(inputs, prc_model, prc_pvec,
              obs_model=False,
              obs_pvec=False,
              overwrite_opt=False,
-             seed=np.random.randint(99999)):
+             seed=np.random.randint(99999),
+             dtype=None,
+             sink=None):
     """
     Function to simulate responses and/or perceptual states.
     given perceptual and observational models and input into the system
@@ -44,6 +45,11 @@ def simModel(inputs, prc_model, prc_pvec,
                          - In here you may place keys with own options
                          - e.g. overwrite_optr['c_prc']['rhomu'] = np.array(['np.nan, 0.5, 0.5'])
             seed      = random number seed
+            dtype     = (optional) storage dtype of the trajectories (e.g. np.float32 for long simulations),
+                        default None uses the perceptual config (float64)
+            sink      = (optional) output sink (e.g. hgf_io.MemmapSink) for long sequences, states and responses
+                        are computed in chunks of sink.chunksize trials and written to the sink as they are computed,
+                        responses of chunk k are drawn with seed + k
             
     returns: dict r with perceptual states and responses"""
     
@@ -58,7 +64,7 @@ def simModel(inputs, prc_model, prc_pvec,
 
     # create empty dict to store everything
     r = {}
-    r['u'] = np.array(inputs)   # store inputs
+    r['u'] = np.asarray(inputs) # store inputs (no copy)
 
     # check for ignored trials and irregular trials
     r['ign'] = np.argwhere(np.isnan(r['u']))
@@ -74,9 +80,11 @@ def simModel(inputs, prc_model, prc_pvec,
     # override with our own settings
     if overwrite_opt != False:
         for item in ['c_prc', 'c_sim']:
-            if item not in overwrite_opt: overwrite_opt[item] = {}
-            r[item] = {**r[item], **overwrite_opt[item]}
+            r[item] = {**r[item], **overwrite_opt.get(item, {})}
     
+    # storage precision of the trajectories
+    if dtype is not None: r['c_prc']['dtype'] = np.dtype(dtype).name
+
     #  check if levels and length prc_pvec are consistent -- NEW FUNCTION ADD PLEASE
     if round(len(prc_pvec)/5) != r['c_prc']['n_levels']:
         r = _adjust_lvls(prc_pvec, r)
@@ -85,8 +93,9 @@ def simModel(inputs, prc_model, prc_pvec,
     r['p_prc']              = _unpack_para(prc_pvec, r)
     r['p_prc']['p']         = prc_pvec 
 
-    # compute perceptual states
-    r['traj'], infStates    = prc_model(r, r['p_prc']['p'])
+    # compute perceptual states (or later chunk by chunk into the sink)
+    if sink is None:
+        r['traj'], infStates = prc_model(r, r['p_prc']['p'])
 
     # if obs model and pvec is not false we simulate responses
     if (obs_model != False) and (obs_pvec != False):
@@ -104,7 +113,13 @@ def simModel(inputs, prc_model, prc_pvec,
             if 'c_obs' in overwrite_opt: r['c_obs'] = {**r['c_obs'], **overwrite_opt['c_obs']}
         
         # simulate decisions
-        r['y']                  = simz[obs_model](r, infStates, r['p_obs']['p'])
+        if sink is None:
+            r['y']              = simz[obs_model](r, infStates, r['p_obs']['p'])
+    
+    # long sequences, states and responses are written to the sink chunk by chunk
+    if sink is not None:
+        r['traj'] = _simSink(r, prc_model, simz[obs_model] if 'obs_model' in r['c_sim'] else None, sink)
+        if 'y' in r['traj']: r['y'] = r['traj'].pop('y')
     return(r)
 
 
@@ -120,11 +135,11 @@ def unitsq_sgm_sim(r, infStates, p, predpos=0):
     # apply unit-square sigmoid to inferred state
     prob = np.divide(states**ze , states**ze + (1-states)**ze) 
     
-    # set random seed
-    np.random.seed(r['c_sim']['seed'])
+    # own random state (same numbers as seeding the global one, without touching it)
+    rng = np.random.RandomState(r['c_sim']['seed'])
     
     # and simulate
-    y = np.random.binomial(1, prob)
+    y = rng.binomial(1, prob)
     return(y)
 
 
@@ -141,14 +156,29 @@ def gaussian_obs_sim(r, infStates, p, predpos=0):
     # number of trials
     n = len(muhat)
     
-    # set random seed
-    np.random.seed(r['c_sim']['seed'])
+    # own random state (same numbers as seeding the global one, without touching it)
+    rng = np.random.RandomState(r['c_sim']['seed'])
     
     # and simulate
-    y = muhat + np.sqrt(ze) * np.random.randn(n)
+    y = muhat + np.sqrt(ze) * rng.randn(n)
     return(y)
 
 
+def _simSink(r, prc_model, simfun, sink):
+    """internal helper function, simulates r['u'] chunk by chunk into sink (see simModel)
+    returns the trajectories (and responses 'y') of the sink"""
+    size, n, state = sink.chunksize, r['u'].shape[-1], {}
+    for k, start in enumerate(range(0, n, size)):
+        u  = r['u'][..., start:start+size]
+        rc = {**r, 'u': u, 'ign': np.argwhere(np.isnan(u))}
+        traj, infStates = prc_model(rc, r['p_prc']['p'], state=state)
+        if simfun is not None:
+            rc['c_sim'] = {**r['c_sim'], 'seed': r['c_sim']['seed'] + k}
+            traj = {**traj, 'y': simfun(rc, infStates, r['p_obs']['p'])}
+        sink.write(start, traj)
+    return(sink.result())
+
+
 def _adjust_lvls(prc_pvec, r):
     """internal helper function, input the pvec array and r dict
     asks if you want to adjust levels and returns"""
@@ -0,0 +1,248 @@
+""" SQLite result store for large batch runs of the Hierarchical Gaussian Filter
+every fit is stored with its parameters, model quality, convergence info and timing,
+keyed by subject, config fingerprint and data hash, so batch runs can skip fits that were
+already computed and parameters can be queried without loading trajectories
+
+Model implemented as discribed in: Mathys, C. D., Lomakina, E. I., Daunizeau, J., Iglesias, S., Brodersen, K. H., Friston, K. J., & Stephan, K. E. (2014). Uncertainty in perception and the Hierarchical Gaussian Filter. Frontiers in human neuroscience, 8, 825.
+
+Code adapted by Jorie van Haren (2021) """
+
+# load nessecary packages
+import io
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import numpy as np
+
+# load config files, fit and io functions
+from HGF.hgf_config import *
+from HGF.hgf_fit import fitModel
+from HGF.hgf_io import save_fit, load_fit, _toJson
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fits (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    subject     TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    data_hash   TEXT NOT NULL,
+    prc_model   TEXT,
+    obs_model   TEXT,
+    LME         REAL,
+    AIC         REAL,
+    BIC         REAL,
+    negLl       REAL,
+    negLj       REAL,
+    success     INTEGER,
+    nit         INTEGER,
+    nfev        INTEGER,
+    seconds     REAL,
+    created     TEXT DEFAULT CURRENT_TIMESTAMP,
+    p_prc       TEXT,
+    p_obs       TEXT,
+    traj        BLOB,
+    traj_path   TEXT,
+    UNIQUE (subject, fingerprint, data_hash)
+);
+CREATE TABLE IF NOT EXISTS params (
+    fit_id      INTEGER NOT NULL,
+    model       TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    idx         INTEGER NOT NULL,
+    value       REAL
+);
+CREATE INDEX IF NOT EXISTS params_fit  ON params (fit_id);
+CREATE INDEX IF NOT EXISTS params_name ON params (name, idx);
+"""
+
+# columns returned by query_fits (trajectory blobs are never loaded there)
+_COLUMNS = ['id', 'subject', 'fingerprint', 'data_hash', 'prc_model', 'obs_model', 'LME', 'AIC', 'BIC',
+            'negLl', 'negLj', 'success', 'nit', 'nfev', 'seconds', 'created', 'p_prc', 'p_obs', 'traj_path']
+
+##########################
+## MAIN STORE FUNCTIONS ##
+##########################
+
+def open_store(path):
+    """open (or create) a result store at path, returns an sqlite3 connection"""
+    con = sqlite3.connect(path)
+    con.executescript(_SCHEMA)
+    return(con)
+
+
+def config_fingerprint(per_model=ehgf_binary_config,
+                       obs_model=unitsq_sgm_config,
+                       opt_model=quasinewton_optim_config,
+                       overwrite_opt=False):
+    """returns a hash of the full model configuration, as used by fitModel
+    identical configurations (including overwrite_opt settings) give identical fingerprints"""
+    c = {'c_prc': per_model(), 'c_obs': obs_model(), 'c_opt': opt_model()}
+    c['c_prc']['config'] = per_model
+    c['c_obs']['config'] = obs_model
+    c['c_opt']['config'] = opt_model
+    if overwrite_opt != False:
+        for item in c:
+            c[item] = {**c[item], **overwrite_opt.get(item, {})}
+    h = hashlib.sha1()
+    _hashUpdate(h, c)
+    return(h.hexdigest())
+
+
+def data_hash(responses, inputs):
+    """returns a hash of the responses and inputs of a subject"""
+    h = hashlib.sha1()
+    _hashUpdate(h, {'y': np.asarray(responses, dtype=float), 'u': np.asarray(inputs, dtype=float)})
+    return(h.hexdigest())
+
+
+def has_fit(con, subject, fingerprint, dhash):
+    """check whether the store already contains this fit"""
+    row = con.execute('SELECT 1 FROM fits WHERE subject=? AND fingerprint=? AND data_hash=?',
+                      (str(subject), fingerprint, dhash)).fetchone()
+    return(row is not None)
+
+
+def store_fit(con, subject, r, fingerprint, dhash, seconds=None, traj=None, sidecar_dir=None, traj_path=None):
+    """append (or replace) a fit result r in the store
+    optional inputs:
+            seconds     = time the fit took
+            traj        = None (no trajectories), 'blob' (stored inside the database)
+                          or 'sidecar' (stored with save_fit next to the database, see sidecar_dir)
+            sidecar_dir = directory for sidecar files, default the directory of the database
+            traj_path   = reference to an existing save_fit file holding the trajectories
+    output:
+            returns the id of the stored fit"""
+    optim = r['optim']
+    blob  = None
+    if traj == 'blob':
+        buf = io.BytesIO()
+        np.savez(buf, **r['traj'])
+        blob = buf.getvalue()
+    elif traj == 'sidecar':
+        if sidecar_dir is None:
+            sidecar_dir = os.path.dirname(os.path.abspath(con.execute('PRAGMA database_list').fetchone()[2]))
+        traj_path = os.path.join(sidecar_dir, '{}_{}_{}.npz'.format(subject, fingerprint[:12], dhash[:12]))
+        save_fit(traj_path, r)
+
+    with con:
+        # replace an older version of the same fit
+        old = con.execute('SELECT id FROM fits WHERE subject=? AND fingerprint=? AND data_hash=?',
+                          (str(subject), fingerprint, dhash)).fetchone()
+        if old is not None:
+            con.execute('DELETE FROM params WHERE fit_id=?', old)
+            con.execute('DELETE FROM fits WHERE id=?', old)
+
+        cur = con.execute('INSERT INTO fits (subject, fingerprint, data_hash, prc_model, obs_model, '
+                          'LME, AIC, BIC, negLl, negLj, success, nit, nfev, seconds, p_prc, p_obs, traj, traj_path) '
+                          'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                          (str(subject), fingerprint, dhash,
+                           r['c_prc']['model'], r['c_obs']['model'],
+                           _real(optim['LME']), _real(optim['AIC']), _real(optim['BIC']),
+                           _real(optim['negLl']), _real(optim['negLj']),
+                           _int(optim.get('success')), _int(optim.get('nit')), _int(optim.get('nfev')),
+                           seconds,
+                           json.dumps(_toJson(r['p_prc'])), json.dumps(_toJson(r['p_obs'])),
+                           blob, traj_path))
+        fit_id = cur.lastrowid
+
+        # long format parameter table for querying
+        rows = []
+        for model, item in [('prc', 'p_prc'), ('obs', 'p_obs')]:
+            for name, val in r[item].items():
+                if callable(val): continue
+                for idx, v in enumerate(np.atleast_1d(np.asarray(val, dtype=float))):
+                    rows.append((fit_id, model, name, idx, _real(v)))
+        con.executemany('INSERT INTO params (fit_id, model, name, idx, value) VALUES (?, ?, ?, ?, ?)', rows)
+    return(fit_id)
+
+
+def fitStored(con, subject, responses, inputs,
+              per_model=ehgf_binary_config,
+              obs_model=unitsq_sgm_config,
+              opt_model=quasinewton_optim_config,
+              overwrite_opt=False,
+              traj=None,
+              sidecar_dir=None):
+    """fitModel that skips fits already in the store, and stores new fits with their timing
+    output:
+            returns (fit_id, r) where r is None when the fit was already stored"""
+    fingerprint = config_fingerprint(per_model, obs_model, opt_model, overwrite_opt)
+    dhash       = data_hash(responses, inputs)
+    if has_fit(con, subject, fingerprint, dhash):
+        row = con.execute('SELECT id FROM fits WHERE subject=? AND fingerprint=? AND data_hash=?',
+                          (str(subject), fingerprint, dhash)).fetchone()
+        return(row[0], None)
+
+    start = time.time()
+    r = fitModel(responses, inputs, per_model, obs_model, opt_model, overwrite_opt)
+    fit_id = store_fit(con, subject, r, fingerprint, dhash, seconds=time.time()-start,
+                       traj=traj, sidecar_dir=sidecar_dir)
+    return(fit_id, r)
+
+
+def query_fits(con, subject=None, fingerprint=None):
+    """return stored fits (without trajectories) as list of dicts, optionally for one subject / config
+    p_prc and p_obs are returned as dicts of parameter values"""
+    sql, args = 'SELECT {} FROM fits'.format(', '.join(_COLUMNS)), []
+    where = [(col, val) for col, val in [('subject', subject), ('fingerprint', fingerprint)] if val is not None]
+    if where:
+        sql  += ' WHERE ' + ' AND '.join('{}=?'.format(col) for col, val in where)
+        args  = [str(val) for col, val in where]
+    fits = []
+    for row in con.execute(sql + ' ORDER BY id', args):
+        fit = dict(zip(_COLUMNS, row))
+        fit['p_prc'] = json.loads(fit['p_prc'])
+        fit['p_obs'] = json.loads(fit['p_obs'])
+        fits.append(fit)
+    return(fits)
+
+
+def query_params(con, name, idx=None, model='prc', fingerprint=None):
+    """return (subject, idx, value) rows of one parameter over all stored fits
+    e.g. query_params(con, 'om', idx=2) for the third level omegas"""
+    sql  = ('SELECT fits.subject, params.idx, params.value FROM params JOIN fits ON fits.id = params.fit_id '
+            'WHERE params.model=? AND params.name=?')
+    args = [model, name]
+    if idx is not None:         sql, args = sql + ' AND params.idx=?', args + [idx]
+    if fingerprint is not None: sql, args = sql + ' AND fits.fingerprint=?', args + [fingerprint]
+    return(con.execute(sql + ' ORDER BY fits.id, params.idx', args).fetchall())
+
+
+def load_traj(con, fit_id):
+    """load the trajectories of a stored fit (from blob or sidecar file), None if not stored"""
+    blob, traj_path = con.execute('SELECT traj, traj_path FROM fits WHERE id=?', (fit_id,)).fetchone()
+    if blob is not None:
+        with np.load(io.BytesIO(blob)) as npz:
+            return({key: npz[key] for key in npz.files})
+    if traj_path is not None:
+        return(load_fit(traj_path)['traj'])
+    return(None)
+
+
+## Helper functions
+
+def _hashUpdate(h, x):
+    """internal function, feeds (nested) configs deterministically into hash h"""
+    if isinstance(x, dict):
+        for key in sorted(x, key=str):
+            h.update(str(key).encode())
+            _hashUpdate(h, x[key])
+    elif isinstance(x, np.ndarray):
+        h.update('{}{}'.format(x.dtype.str, x.shape).encode())
+        h.update(np.ascontiguousarray(x).tobytes())
+    elif callable(x):
+        h.update(x.__name__.encode())
+    else:
+        h.update(repr(x).encode())
+
+
+def _real(x):
+    """internal function, float for sqlite (nan and inf become NULL)"""
+    x = float(x)
+    return(x if np.isfinite(x) else None)
+
+
+def _int(x):
+    """internal function, int for sqlite (or NULL)"""
+    return(None if x is None else int(x))
@@ -0,0 +1,360 @@
+""" Streaming (chunk by chunk) filtering with the Hierarchical Gaussian Filter
+long input sequences are passed through the perceptual function in chunks, the representations are carried
+over between chunks, the log-likelihood of the observation model is summed over all trials, and
+trajectories are recorded decimated (every k-th trial) or in a ring buffer (last N trials),
+so memory is bounded independently of sequence length
+(the perceptual functions themselves record every trial of a chunk, their updates need the previous trial,
+striding and windowing is done here on the chunks)
+
+usage:  s = stream_init(r, p)                  # r with c_prc (and optionally c_obs / p_obs), p native parameters
+        for u, y in chunks: stream_update(s, u, y)
+        res = stream_result(s)                 # {'n', 'logLl', 'traj', 'state'}
+
+        live = LiveRefit(s, window=2000, every=200)  # non-stationary live streams, s filtered with refitted parameters
+        for u, y in ticks: live.update(u, y)
+        live.metrics()                         # refit latency and staleness of the active parameters
+
+Model implemented as discribed in: Mathys, C. D., Lomakina, E. I., Daunizeau, J., Iglesias, S., Brodersen, K. H., Friston, K. J., & Stephan, K. E. (2014). Uncertainty in perception and the Hierarchical Gaussian Filter. Frontiers in human neuroscience, 8, 825.
+
+Code adapted by Jorie van Haren (2021) """
+
+# load nessecary packages
+import time
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# load config files, fit function and function lookups
+from HGF.hgf_config import quasinewton_optim_config
+from HGF.hgf_fit import fitModel, _storedfunc, _batchOpt
+
+###########################
+## MAIN STREAM FUNCTIONS ##
+###########################
+
+def stream_init(r, p, trans=False, prc_fun=None, obs_fun=None, ptrans_obs=None,
+                stride=1, window=None, record=None, sink=None, hooks=None):
+    """Start a stream for perceptual parameters p
+    input:
+            r = dict with at least c_prc (e.g. {'c_prc': ehgf_binary_config()} or the r of fitModel)
+            p = perceptual parameters, in native space (or transformed space with trans=True)
+    optional inputs:
+            prc_fun    = perceptual function, default r['c_prc']['prc_fun']
+            obs_fun    = observation function for the log-likelihood, default r['c_obs']['obs_fun'] if present
+            ptrans_obs = transformed observation parameters, default r['p_obs']['ptrans'] if present
+            stride     = record every stride-th trial (trials 0, stride, 2*stride, ...)
+            window     = if given, only the last window recorded trials are kept (ring buffer)
+            record     = trajectory fields to record (see hgf.TRAJ_BINARY / TRAJ_CONTINUOUS),
+                         default None uses r['c_prc']['record'] or else keeps all fields
+            sink       = output sink (e.g. hgf_io.MemmapSink), receives every chunk at full resolution
+            hooks      = list of per trial hooks (see hgf_hooks), trial numbers count over all chunks
+    output:
+            returns stream dict s for stream_update and stream_result"""
+    if stride < 1: raise ValueError('stride should be at least 1, not {}'.format(stride))
+    if window is not None and window < 1: raise ValueError('window should be at least 1, not {}'.format(window))
+
+    c_prc = dict(r['c_prc'])  # the ehgf aliases set the model name, keep the callers config untouched
+    if prc_fun is None: prc_fun = c_prc['prc_fun']
+    if isinstance(prc_fun, str): prc_fun = _storedfunc(prc_fun)
+    if trans: p = c_prc['transp_prc_fun'](r, p)
+
+    # observation model is optional (trajectories only)
+    if obs_fun is None and 'c_obs' in r and isinstance(r['c_obs'], dict):
+        obs_fun = r['c_obs'].get('obs_fun')
+    if isinstance(obs_fun, str): obs_fun = _storedfunc(obs_fun)
+    if ptrans_obs is None and 'p_obs' in r:
+        ptrans_obs = r['p_obs']['ptrans']
+
+    s = {'c_prc'     : c_prc,
+         'c_obs'     : r.get('c_obs'),
+         'prc_fun'   : prc_fun,
+         'obs_fun'   : obs_fun,
+         'params'    : (np.asarray(p, dtype=float), ptrans_obs),  # swapped as a whole (see stream_swap)
+         'responses' : ptrans_obs is not None and np.size(ptrans_obs) > 0,  # observation models with parameters
+                                                 # score responses, bayes optimal (no parameters) the inputs
+         'record'    : record,
+         'sink'      : sink,
+         'hooks'     : hooks,
+         'stride'    : int(stride),
+         'window'    : None if window is None else int(window),
+         'state'     : {},           # last trial of the previous chunk, empty starts from the priors
+         'n'         : 0,            # trials seen
+         'logLl'     : 0. if obs_fun is not None else None,
+         'chunks'    : [],           # decimated chunks (no window)
+         'ring'      : None,         # ring buffer (window)
+         'count'     : 0}            # rows written to the ring buffer
+    return(s)
+
+
+def stream_update(s, u, y=None):
+    """Filter the next chunk of inputs u (and responses y for the log-likelihood)
+    u may contain nan for ignored trials, y nan for irregular trials
+    output:
+            returns the log-likelihood of this chunk, None without observation model and for chunks without
+            responses y when the observation model scores responses (e.g. unitsq_sgm, not bayes_optimal)"""
+    u = np.asarray(u, dtype=float)
+    m = u.shape[-1]
+    y = np.array([]) if y is None else np.asarray(y, dtype=float)
+    if y.size and y.shape[-1] != m:
+        raise ValueError('y should have {} responses (one per input), not {}'.format(m, y.shape[-1]))
+    score = s['obs_fun'] is not None and (y.size or not s['responses'])
+    if m == 0: return(0. if score else None)
+
+    # the chunk as r for the model functions
+    rc = {'u': u, 'y': y, 'c_prc': s['c_prc'], 'c_obs': s['c_obs'],
+          'ign': np.argwhere(np.isnan(u)), 'irr': np.argwhere(np.isnan(y))}
+    p, ptrans_obs = s['params']  # one read, a concurrent swap never mixes parameter sets
+    with np.errstate(divide='ignore'):
+        traj, infStates = s['prc_fun'](rc, p, record=s['record'], state=s['state'], hooks=s['hooks'])
+
+    # full likelihood over every trial (the trajectories only for chunks without the responses it needs)
+    logLl = None
+    if score:
+        logp, yhat, res = s['obs_fun'](rc, infStates, ptrans_obs)
+        logLl = np.nansum(logp, dtype=np.float64)
+        s['logLl'] += logLl
+
+    if s['sink'] is not None: s['sink'].write(s['n'], traj)
+    _record(s, traj, m)
+    s['n'] += m
+    return(logLl)
+
+
+def stream_result(s):
+    """Results of a stream
+    output:
+            returns dict with n (trials seen), logLl (summed log-likelihood of the scored chunks, None without observation model),
+            traj (recorded trajectories, including 'trial' with the trial index of every row)
+            and state (last trial, to continue filtering later)"""
+    if s['window'] is None:
+        if s['chunks']:
+            traj = {key: np.concatenate([chunk[key] for chunk in s['chunks']]) for key in s['chunks'][0]}
+        else:
+            traj = {}
+        s['chunks'] = [traj] if traj else []  # keep concatenated, later updates append to it
+    elif s['ring'] is None:
+        traj = {}
+    else:
+        # ring buffer in chronological order
+        size  = len(s['ring']['trial'])
+        order = np.arange(s['count'] - min(s['count'], size), s['count']) % size
+        traj  = {key: val[order] for key, val in s['ring'].items()}
+    return({'n': s['n'], 'logLl': s['logLl'], 'traj': traj,
+            'state': {key: np.copy(val) if isinstance(val, np.ndarray) else val for key, val in s['state'].items()}})
+
+
+def stream_swap(s, p, ptrans_obs=None):
+    """Replace the parameters of a running stream (native perceptual p, transformed observation ptrans_obs)
+    the representations are kept, the next chunk is filtered with the new parameters,
+    both are replaced in one assignment so this is safe to call from another thread"""
+    if ptrans_obs is None: ptrans_obs = s['params'][1]
+    s['params'] = (np.asarray(p, dtype=float), ptrans_obs)
+
+
+def filterStream(r, p, inputs, responses=None, chunksize=10000, **kwargs):
+    """Filter a full sequence chunk by chunk (see stream_init for the optional keyword arguments)
+    input:
+            inputs    = input array (last dimension are trials) or an iterable of input chunks
+            responses = response array or an iterable of response chunks (optional)
+    output:
+            returns dict of stream_result"""
+    s = stream_init(r, p, **kwargs)
+    for u, y in _chunks(inputs, responses, chunksize):
+        stream_update(s, u, y)
+    return(stream_result(s))
+
+
+class LiveRefit:
+    """Sliding window refitting of a live stream
+    the last window inputs (and responses) are kept, every `every` new trials the model is refitted on that window
+    in the background (warm-started from the previous fit), and the parameters of stream s are replaced when the fit
+    is done (stream_swap), the representations of the stream are kept; filtering never waits for a fit
+    input:
+            s      = stream dict of stream_init (1-D inputs)
+    optional inputs:
+            window        = number of most recent trials to fit
+            every         = refit after this many new trials (at most one fit runs at a time),
+                            the first fit starts once the window is filled
+            per_model     = perceptual config, default the config of the stream (set by fitModel) else ehgf_config
+            obs_model     = observation config, default the config of the stream (set by fitModel)
+            opt_model     = optimization config
+            overwrite_opt = as in fitModel (e.g. priors), residual diagnostics are off unless set
+            executor      = concurrent.futures executor for the fits, default one worker thread
+                            (a ProcessPoolExecutor keeps the fits off the filtering process),
+                            the fits run with fitModel(verbose=False), so they print nothing
+    metrics() returns refit latency and staleness of the active parameters"""
+
+    def __init__(self, s, window=1000, every=100, per_model=None, obs_model=None,
+                 opt_model=quasinewton_optim_config, overwrite_opt=False, executor=None):
+        if every < 1:  raise ValueError('every should be at least 1, not {}'.format(every))
+        if window < 2: raise ValueError('window should be at least 2, not {}'.format(window))
+        if per_model is None: per_model = s['c_prc'].get('config')
+        if obs_model is None and isinstance(s['c_obs'], dict): obs_model = s['c_obs'].get('config')
+        if per_model is None or obs_model is None:
+            raise ValueError('per_model and obs_model are needed for streams that were not started from a fitModel result')
+        self.s         = s
+        self.window    = int(window)
+        self.every     = int(every)
+        self.models    = (per_model, obs_model, opt_model)
+        self.over      = _batchOpt(overwrite_opt)
+        self.executor  = executor if executor is not None else ThreadPoolExecutor(max_workers=1)
+        self.own       = executor is None
+        self.u         = np.full(self.window, np.nan)
+        self.y         = np.full(self.window, np.nan)
+        self.count     = 0             # trials written to the window buffers
+        self.has_y     = False         # responses were given
+        self.since     = 0             # trials since the last submitted fit
+        self.future    = None          # last submitted fit
+        self.running   = False         # a fit is in flight, set on submit and cleared by _swap (under lock)
+        self.done      = threading.Event()  # set when no fit is in flight (the last fit is swapped in or failed)
+        self.done.set()
+        self.warm      = None          # transformed parameters of the last fit (warm start)
+        self.lock      = threading.Lock()
+        self.stats     = {'refits': 0, 'failed': 0, 'latency': [], 'fit_seconds': [],
+                          'fit_end': None, 'swapped': None, 'error': None}
+
+    def update(self, u, y=None):
+        """filter the next chunk u (responses y) with the active parameters and refit when due
+        returns the log-likelihood of stream_update"""
+        u = np.atleast_1d(np.asarray(u, dtype=float))
+        if u.ndim != 1: raise ValueError('LiveRefit supports 1-D inputs, not shape {}'.format(u.shape))
+        logLl = stream_update(self.s, u, y)
+
+        # sliding window (ring buffers)
+        y = np.full(len(u), np.nan) if y is None else np.atleast_1d(np.asarray(y, dtype=float))
+        if y.size: self.has_y = True
+        m   = min(len(u), self.window)
+        idx = (self.count + len(u) - m + np.arange(m)) % self.window
+        self.u[idx], self.y[idx] = u[-m:], (y[-m:] if y.size else np.nan)
+        self.count += len(u)
+        self.since += len(u)
+
+        # refit in the background, only one fit at a time
+        if self.since >= self.every and self.count >= self.window:
+            self._submit()
+        return(logLl)
+
+    def metrics(self):
+        """returns dict with refits (swapped fits), failed, pending (fit running), last_latency / mean_latency
+        (seconds from the end of the fitted window to the swap), last_fit_seconds (duration of the fit itself),
+        staleness_trials (trials filtered since the end of the window of the active parameters),
+        staleness_seconds (seconds since the last swap) and error (of the last failed fit)"""
+        with self.lock:
+            st      = dict(self.stats)
+            pending = self.running
+        lat = st.pop('latency')
+        fit = st.pop('fit_seconds')
+        fit_end, swapped = st.pop('fit_end'), st.pop('swapped')
+        st.update({'pending'          : pending,
+                   'last_latency'     : lat[-1] if lat else None,
+                   'mean_latency'     : float(np.mean(lat)) if lat else None,
+                   'last_fit_seconds' : fit[-1] if fit else None,
+                   'staleness_trials' : None if fit_end is None else self.s['n'] - fit_end,
+                   'staleness_seconds': None if swapped is None else time.time() - swapped})
+        return(st)
+
+    def wait(self):
+        """wait for a running fit (and its swap)"""
+        self.done.wait()
+
+    def close(self):
+        """wait for a running fit and shut down the own executor"""
+        self.wait()
+        if self.own: self.executor.shutdown()
+
+    def _submit(self):
+        """internal function, submits a fit on a copy of the window, unless a fit is still in flight"""
+        with self.lock:
+            if self.running: return
+            self.running = True
+            self.done.clear()
+            warm = self.warm
+        order = (self.count - self.window + np.arange(self.window)) % self.window
+        u, y  = self.u[order], (self.y[order] if self.has_y else np.array([]))
+        over  = {item: dict(val) for item, val in self.over.items()}
+        over['c_opt']['init'] = warm
+        end, start = self.s['n'], time.time()
+        try:
+            fut = self.executor.submit(_refit, y, u, *self.models, over)
+        except Exception:  # e.g. a shut down executor, no fit is in flight
+            with self.lock:
+                self.running = False
+                self.done.set()
+            raise
+        self.since  = 0
+        self.future = fut
+        fut.add_done_callback(lambda fut: self._swap(fut, end, start))  # runs here if the fit is already done
+
+    def _swap(self, fut, end, start):
+        """internal function, replaces the stream parameters with a finished fit
+        the in-flight flag is only cleared here, so the next fit is submitted after this swap"""
+        with self.lock:
+            try:
+                p, ptrans_obs, final, seconds = fut.result()
+                stream_swap(self.s, p, ptrans_obs)
+            except Exception as e:  # the stream keeps its parameters
+                self.stats['failed'] += 1
+                self.stats['error']   = repr(e)
+            else:
+                now = time.time()
+                self.warm = final
+                self.stats['refits'] += 1
+                self.stats['latency'].append(now - start)
+                self.stats['fit_seconds'].append(seconds)
+                self.stats['fit_end'], self.stats['swapped'] = end, now
+            finally:
+                self.running = False
+                self.done.set()
+
+
+## Helper functions
+
+def _refit(responses, inputs, per_model, obs_model, opt_model, overwrite_opt):
+    """internal function, fit of a LiveRefit window (module level, so it can run on a process pool)
+    returns native perceptual parameters, transformed observation parameters, transformed final
+    parameters (warm start of the next fit) and the duration of the fit"""
+    start = time.time()
+    r = fitModel(responses, inputs, per_model=per_model, obs_model=obs_model, opt_model=opt_model,
+                 overwrite_opt=overwrite_opt, verbose=False)
+    if not np.isfinite(r['optim']['negLl']): raise FloatingPointError('refit did not converge to a finite negLl')
+    return(r['p_prc']['p'], r['p_obs']['ptrans'], np.asarray(r['optim']['final']), time.time() - start)
+
+
+def _record(s, traj, m):
+    """internal function, records every stride-th trial of a chunk of m trials"""
+    trial = np.arange(s['n'], s['n'] + m)
+    keep  = (trial % s['stride']) == 0
+    if not keep.any(): return
+    rows = {key: val[keep] for key, val in traj.items()}  # copies, so chunk arrays are freed
+    rows['trial'] = trial[keep]
+
+    if s['window'] is None:
+        s['chunks'].append(rows)
+        return
+
+    # ring buffer, only the last window rows of this chunk can survive
+    k = len(rows['trial'])
+    if k > s['window']:
+        rows = {key: val[-s['window']:] for key, val in rows.items()}
+        s['count'] += k - s['window']
+        k = s['window']
+    if s['ring'] is None:
+        s['ring'] = {key: np.empty((s['window'],) + val.shape[1:], dtype=val.dtype) for key, val in rows.items()}
+    idx = (s['count'] + np.arange(k)) % s['window']
+    for key, val in rows.items():
+        s['ring'][key][idx] = val
+    s['count'] += k
+
+
+def _chunks(inputs, responses, chunksize):
+    """internal function, yields (u, y) chunks from arrays or iterables of chunks"""
+    if isinstance(inputs, (np.ndarray, list)):
+        inputs = np.asarray(inputs, dtype=float)
+        n = inputs.shape[-1]
+        for start in range(0, n, chunksize):
+            y = None if responses is None or len(responses) == 0 else np.asarray(responses[start:start+chunksize], dtype=float)
+            yield(inputs[..., start:start+chunksize], y)
+    else:
+        resp = iter(responses) if responses is not None else None
+        for u in inputs:
+            yield(u, next(resp) if resp is not None else None)
@@ -9,7 +9,8 @@ setup(name='HGF',
     author='Jorie van Haren',
     author_email='jjg.vanharen@maastrichtuniversity.nl',
     packages=['HGF'],
-    install_requires=['numpy'],
+    install_requires=['numpy', 'scipy>=1.9'],  # BFGS hess_inv0 (continued racing starts)
+    entry_points={'console_scripts': ['hgf=HGF.hgf_cli:main']},
     version=VERSION,
     license='MIT',
     description='A Hierarchical Gaussian Filter Toolbox for Python',
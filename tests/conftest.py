@@ -0,0 +1,57 @@
+""" Shared fixtures of the tests of the Hierarchical Gaussian Filter
+demo inputs, fitting without printed output and the warning filters of every test """
+
+import io
+import pathlib
+import contextlib
+import numpy as np
+import pytest
+
+from HGF.hgf_fit import fitModel
+from HGF.hgf_config import hgf_config, bayes_optimal_config
+
+DEMO = pathlib.Path(__file__).resolve().parent.parent / 'demo_files'
+
+
+def pytest_collection_modifyitems(items):
+    """warnings that exploring parameters gives in every test"""
+    for item in items:
+        item.add_marker(pytest.mark.filterwarnings('ignore::RuntimeWarning'))       # overflow in exploring parameters
+        item.add_marker(pytest.mark.filterwarnings('ignore::DeprecationWarning'))   # scalar conversion of 1-element arrays
+        item.add_marker(pytest.mark.filterwarnings('ignore::scipy.optimize.OptimizeWarning'))  # precision loss of short fits
+
+
+@pytest.fixture(scope='session')
+def demo():
+    """directory of the demo files"""
+    return(DEMO)
+
+
+@pytest.fixture(scope='session')
+def usdchf():
+    """continuous demo inputs"""
+    return(np.loadtxt(DEMO / 'example_usdchf.txt'))
+
+
+@pytest.fixture(scope='session')
+def binary_input():
+    """binary demo inputs"""
+    return(np.loadtxt(DEMO / 'example_binary_input.txt'))
+
+
+@pytest.fixture(scope='session')
+def quiet():
+    """quiet() is a context manager that swallows printed output (of functions without verbose)"""
+    return(lambda: contextlib.redirect_stdout(io.StringIO()))
+
+
+@pytest.fixture(scope='session')
+def fit_model():
+    """fitModel(responses, inputs, **kwargs) without its printed output"""
+    return(lambda responses, inputs, **kwargs: fitModel(np.asarray(responses), inputs, verbose=False, **kwargs))
+
+
+@pytest.fixture(scope='session')
+def usdchf_fit(usdchf, fit_model):
+    """hgf / bayes_optimal fit of the continuous demo inputs (shared, do not change it)"""
+    return(fit_model([], usdchf, per_model=hgf_config, obs_model=bayes_optimal_config))
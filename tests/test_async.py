@@ -0,0 +1,82 @@
+""" Tests of the asyncio wrappers of the Hierarchical Gaussian Filter (timeouts, cancellation, concurrency limit) """
+
+import time
+import asyncio
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+import HGF.hgf_async as hgf_async
+from HGF.hgf_async import fit_async, fit_many_async
+
+
+class _Fits:
+    """stand-in for fitModel that sleeps and records how many fits run at the same time"""
+
+    def __init__(self, seconds=0.05):
+        self.seconds, self.lock = seconds, threading.Lock()
+        self.running, self.peak, self.calls = 0, 0, []
+
+    def __call__(self, responses, inputs, **kwargs):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.calls.append(inputs)
+        time.sleep(self.seconds)
+        with self.lock:
+            self.running -= 1
+        return({'inputs': inputs})
+
+
+@pytest.fixture
+def fits(monkeypatch):
+    fits = _Fits()
+    monkeypatch.setattr(hgf_async, 'fitModel', fits)
+    return(fits)
+
+
+def test_fit_timeout(fits):
+    """a fit that takes longer than timeout raises asyncio.TimeoutError"""
+    fits.seconds = 0.5
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(fit_async([], 'slow', executor=pool, timeout=0.05))
+
+
+def test_fit_many_limit(fits):
+    """limit caps the fits in flight, results come back in cohort order"""
+    cohort = {'s{}'.format(s): ([], s) for s in range(8)}
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        res = asyncio.run(fit_many_async(cohort, executor=pool, limit=2))
+    assert fits.peak == 2
+    assert list(res) == list(cohort) and [r['inputs'] for r in res.values()] == list(range(8))
+
+    fits.peak = 0
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        asyncio.run(fit_many_async(list(cohort.values()), executor=pool))
+    assert fits.peak > 2
+
+
+def test_fit_many_timeout_exceptions(fits):
+    """with return_exceptions timed out fits return their exception instead of raising it"""
+    fits.seconds = 0.3
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        res = asyncio.run(fit_many_async([([], 0), ([], 1)], executor=pool, timeout=0.05, return_exceptions=True))
+    assert all(isinstance(r, asyncio.TimeoutError) for r in res)
+
+
+def test_cancel_queued_fit(fits):
+    """a cancelled fit that did not start yet never runs"""
+    async def main(pool):
+        first  = asyncio.ensure_future(fit_async([], 'first', executor=pool))
+        second = asyncio.ensure_future(fit_async([], 'second', executor=pool))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        return(await first)
+
+    fits.seconds = 0.2
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert asyncio.run(main(pool)) == {'inputs': 'first'}
+    assert fits.calls == ['first']
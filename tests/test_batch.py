@@ -0,0 +1,106 @@
+""" Tests of the batch fitting of the Hierarchical Gaussian Filter (model comparison on a worker pool) """
+
+import os
+import tempfile
+import numpy as np
+import pytest
+
+from HGF.hgf import ehgf_binary, unitsq_sgm
+from HGF.hgf_sim import simModel
+from HGF.hgf_batch import compareModels, fitGroup, bms
+from HGF.hgf_config import hgf_binary_config, ehgf_binary_config, unitsq_sgm_config
+
+SHM    = '/dev/shm'
+MODELS = [(hgf_binary_config, unitsq_sgm_config, False),
+          (ehgf_binary_config, unitsq_sgm_config, False)]
+
+
+def _broken_config():
+    """perceptual config that fails inside the worker"""
+    raise RuntimeError('broken config')
+
+
+def _leftovers():
+    """shared memory segments and temporary result directories that currently exist"""
+    shm = set(os.listdir(SHM)) if os.path.isdir(SHM) else set()
+    return(shm, {name for name in os.listdir(tempfile.gettempdir()) if name.startswith('hgf_')})
+
+
+@pytest.fixture(scope='module')
+def cohort(binary_input):
+    rng = np.random.RandomState(0)
+    return({'s{}'.format(s): (rng.binomial(1, 0.5, len(binary_input)).astype(float), binary_input) for s in range(3)})
+
+
+@pytest.fixture(scope='module')
+def serial(cohort, quiet):
+    with quiet():
+        return(compareModels(cohort, MODELS, n_jobs=1, max_eval=100))
+
+
+def test_compareModels_process(cohort, serial, quiet):
+    """compareModels on worker processes equals the serial run"""
+    before = _leftovers()
+    with quiet():
+        pooled = compareModels(cohort, MODELS, n_jobs=3, backend='process', max_eval=100)
+    assert pooled['subjects'] == serial['subjects'] and pooled['models'] == serial['models']
+    for item in ['LME', 'AIC', 'BIC']:
+        np.testing.assert_array_equal(pooled[item], serial[item])
+    for key in ['alpha', 'exp_r', 'xp', 'g']:
+        np.testing.assert_array_equal(pooled['bms'][key], serial['bms'][key])
+    for s in range(len(cohort)):
+        for m in range(len(MODELS)):
+            a, b = pooled['fits'][s][m], serial['fits'][s][m]
+            for key in ['final', 'negLj', 'Sigma']:
+                np.testing.assert_array_equal(a['optim'][key], b['optim'][key])
+
+            # trajectories and per trial results come back as read-only maps of the worker files,
+            # every trajectory at its own columns of the shared trajectory buffer
+            assert a['traj'].keys() == b['traj'].keys()
+            for key in a['traj']:
+                assert isinstance(a['traj'][key], np.memmap) and not a['traj'][key].flags.writeable
+                np.testing.assert_array_equal(a['traj'][key], b['traj'][key])
+            for key in ['yhat', 'res']:
+                np.testing.assert_array_equal(a['optim'][key], b['optim'][key])
+            np.testing.assert_array_equal(a['u'], b['u'])
+    assert _leftovers() == before
+
+
+def test_worker_failure_cleanup(cohort, quiet):
+    """a failing fit raises in the caller and leaves no shared memory segments or result files behind"""
+    before = _leftovers()
+    with quiet(), pytest.raises(RuntimeError, match='broken config'):
+        compareModels(cohort, MODELS + [(_broken_config, unitsq_sgm_config, False)], n_jobs=3, max_eval=20)
+    assert _leftovers() == before
+
+
+def test_fitGroup_converges(binary_input, quiet):
+    """the group prior of subjects simulated around one parameter set converges (the subject posteriors
+    have numerical hessians, the BFGS estimates of warm-started fits of few iterations kept it oscillating)"""
+    rng, cohort = np.random.RandomState(0), {}
+    for s in range(3):
+        p = np.array([np.nan, 0, 1, np.nan, 1, 1, np.nan, 0, 0, 1, 1, np.nan, -2.5 + 0.3*rng.randn(), -6])
+        with quiet():
+            cohort['s{}'.format(s)] = (simModel(binary_input, ehgf_binary, p, unitsq_sgm, 5, seed=s)['y'], binary_input)
+    g = fitGroup(cohort, ehgf_binary_config, unitsq_sgm_config, n_jobs=1, max_iter=20)
+    assert g['converged'] and g['iterations'] < 20 and g['history'][-1]['change'] < 1e-3
+    assert all(np.isfinite(h['negLj']) for h in g['history'])
+    assert g['history'][-1]['negLj'] < g['history'][0]['negLj']
+    assert np.all(np.sqrt(g['priorsas'][g['free']]) > np.sqrt(1e-3))
+    for r in g['fits']:
+        np.testing.assert_allclose(r['optim']['H'] @ r['optim']['Sigma'], np.eye(len(g['free'])), atol=1e-6)
+
+
+def test_bms():
+    """random effects BMS prefers the model with the higher evidence in most subjects, equal evidence is a tie"""
+    lme = np.array([[-100., -110.], [-100., -105.], [-120., -100.], [-90., -95.], [-80., -99.]])
+    out = bms(lme)
+    assert out['exp_r'][0] > 0.6 and out['xp'][0] > 0.8
+    np.testing.assert_allclose(out['alpha'].sum(), 1 + 1 + len(lme))
+    np.testing.assert_allclose(out['g'].sum(axis=1), 1)
+    assert np.argmax(out['g'][2]) == 1 and np.all(np.argmax(out['g'][[0, 1, 3, 4]], axis=1) == 0)
+    np.testing.assert_array_equal(bms(lme)['xp'], out['xp'])   # seeded sampling
+
+    tie = bms(np.zeros((4, 3)))
+    np.testing.assert_allclose(tie['exp_r'], 1/3)
+    np.testing.assert_allclose(tie['xp'], 1/3, atol=0.01)
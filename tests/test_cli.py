@@ -0,0 +1,103 @@
+""" Tests of the hgf command line entry point """
+
+import sqlite3
+import numpy as np
+import pytest
+
+from HGF.hgf import ehgf_binary, unitsq_sgm
+from HGF.hgf_cli import main, _parser
+from HGF.hgf_io import load_fit
+from HGF.hgf_sim import simModel
+
+P_BINARY = 'nan,0,1,nan,1,1,nan,0,0,1,1,nan,-2.5,-6'
+
+
+@pytest.fixture
+def data(tmp_path, binary_input, quiet):
+    """directory with two subjects of simulated responses to the binary demo inputs"""
+    path = tmp_path / 'data'
+    path.mkdir()
+    p = np.array([float(i) for i in P_BINARY.split(',')])
+    for s in range(2):
+        with quiet():
+            r = simModel(binary_input, ehgf_binary, p, unitsq_sgm, 5, seed=s)
+        np.savetxt(path / 's{}_input.txt'.format(s), binary_input)
+        np.savetxt(path / 's{}_response.txt'.format(s), r['y'])
+    return(path)
+
+
+def test_repeat_only_for_bench():
+    """--repeat belongs to bench, fit and simulate reject it"""
+    assert _parser().parse_args(['bench', 'data', '--repeat', '3']).repeat == 3
+    for command in [['fit', 'data', '-o', 'out'], ['simulate', 'data', '-o', 'out', '--prc-model', 'hgf', '--prc-pvec', '1']]:
+        with pytest.raises(SystemExit):
+            _parser().parse_args(command + ['--repeat', '3'])
+
+
+def test_main(data, tmp_path, capsys):
+    """fit, simulate and bench over a directory of subjects"""
+    out = tmp_path / 'fits'
+    assert main(['fit', str(data), '-o', str(out), '-j', '2', '--max-eval', '30']) == 0
+    for s in range(2):
+        r = load_fit(str(next(out.glob('s{}_fit*.npz'.format(s)))))
+        assert r['optim']['nfev'] > 0 and r['traj']['mu'].shape[0] == len(np.loadtxt(data / 's0_input.txt'))
+
+    sims = tmp_path / 'sims'
+    assert main(['simulate', str(data), '-o', str(sims), '-j', '2', '--prc-model', 'ehgf_binary',
+                 '--prc-pvec', P_BINARY, '--obs-model', 'unitsq_sgm', '--obs-pvec', '5']) == 0
+    assert len(list(sims.glob('s*_sim*.npz'))) == 2
+
+    capsys.readouterr()
+    assert main(['bench', str(data), '-j', '2', '--repeat', '2', '--max-eval', '20']) == 0
+    assert 'BENCH: 4 runs' in capsys.readouterr().out
+
+
+def test_main_no_subjects(tmp_path):
+    """an empty data directory is an error"""
+    assert main(['fit', str(tmp_path), '-o', str(tmp_path / 'out')]) == 1
+
+
+def _run(capsys, *argv):
+    """runs main, returns the number of subjects it ran"""
+    capsys.readouterr()
+    assert main(list(argv)) == 0
+    line = [line for line in capsys.readouterr().out.splitlines() if 'to run' in line][0]
+    return(int(line.split(', ')[-1].split()[0]))
+
+
+def test_resume(data, tmp_path, capsys):
+    """a rerun skips finished subjects, refits subjects without a result file and refits all with other options"""
+    out  = str(tmp_path / 'fits')
+    args = ['fit', str(data), '-o', out, '-j', '2', '--max-eval', '20']
+    assert _run(capsys, *args) == 2
+    assert _run(capsys, *args) == 0
+    files = sorted((tmp_path / 'fits').glob('*.npz'))
+    files[0].unlink()
+    assert _run(capsys, *args) == 1
+
+    # other options write their own result files
+    assert _run(capsys, *args[:-1], '25') == 2
+    assert _run(capsys, 'fit', str(data), '-o', out, '-j', '2', '--max-eval', '20', '--obs-model', 'unitsq_sgm',
+                '--per-model', 'hgf_binary') == 2
+    assert len(list((tmp_path / 'fits').glob('*.npz'))) == 6
+
+
+def test_store_resume(data, tmp_path, capsys):
+    """with --store a subject is skipped only when its fit is stored and its result file exists"""
+    out, store = str(tmp_path / 'fits'), str(tmp_path / 'fits.sqlite')
+    args = ['fit', str(data), '-o', out, '-j', '2', '--max-eval', '20', '--store', store]
+    assert _run(capsys, *args) == 2
+    assert _run(capsys, *args) == 0
+    assert _run(capsys, *args[:-1], str(tmp_path / 'other.sqlite')) == 2   # files exist, but not in this store
+
+    con = sqlite3.connect(store)
+    con.execute("DELETE FROM fits WHERE subject='s0'")
+    con.commit()
+    con.close()
+    assert _run(capsys, *args) == 1                                      # stored row missing
+    next((tmp_path / 'fits').glob('s1_*.npz')).unlink()
+    assert _run(capsys, *args) == 1                                      # result file missing
+    assert _run(capsys, *args[:-3], '25', *args[-2:]) == 2               # other options
+    con = sqlite3.connect(store)
+    assert con.execute('SELECT COUNT(*) FROM fits').fetchone()[0] == 4
+    con.close()
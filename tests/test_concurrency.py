@@ -0,0 +1,80 @@
+""" Concurrency stress tests: fits running at the same time in threads give the results of serial fits
+(shared config dicts and overwrite_opt are not changed by the fits, see _restrictfun and _fitPrepped) """
+
+import copy
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+from HGF.hgf_fit import _restrictfun
+from HGF.hgf_batch import compareModels
+from HGF.hgf_config import hgf_binary_config, ehgf_binary_config, unitsq_sgm_config
+
+N = 8
+
+
+@pytest.fixture(scope='module')
+def cohort(binary_input):
+    rng = np.random.RandomState(0)
+    return([(rng.binomial(1, 0.5, len(binary_input)).astype(float), binary_input) for s in range(N // 2)])
+
+
+def _assertSame(a, b):
+    """fits a and b are identical"""
+    for key in ['LME', 'AIC', 'BIC', 'negLj', 'final', 'Sigma']:
+        np.testing.assert_array_equal(a['optim'][key], b['optim'][key])
+    assert a['traj'].keys() == b['traj'].keys()
+    for key in a['traj']:
+        np.testing.assert_array_equal(a['traj'][key], b['traj'][key])
+
+
+def test_fitModel_threads(cohort, fit_model):
+    """N fitModel calls at once, all sharing one overwrite_opt dict, equal the serial fits"""
+    over     = {'c_prc': {'priorsas': hgf_binary_config()['priorsas']}, 'c_opt': {'maxEval': 150}}
+    saved    = copy.deepcopy(over)
+    defaults = hgf_binary_config()
+    tasks = [(y, u, model) for y, u in cohort for model in [hgf_binary_config, ehgf_binary_config]]
+    fit   = lambda task: fit_model(task[0], task[1], per_model=task[2], obs_model=unitsq_sgm_config, overwrite_opt=over)
+
+    serial = [fit(task) for task in tasks]
+    for rep in range(2):
+        with ThreadPoolExecutor(max_workers=N) as pool:
+            threaded = list(pool.map(fit, tasks))
+        for a, b in zip(serial, threaded): _assertSame(a, b)
+
+    # the shared options and the config defaults are untouched
+    assert over.keys() == saved.keys() and over['c_opt'] == saved['c_opt']
+    np.testing.assert_array_equal(over['c_prc']['priorsas'], saved['c_prc']['priorsas'])
+    for key in ['priormus', 'priorsas', 'model']:
+        np.testing.assert_array_equal(hgf_binary_config()[key], defaults[key])
+
+
+def test_compareModels_threads(cohort, quiet):
+    """compareModels on a thread pool equals the serial run"""
+    models = [(hgf_binary_config, unitsq_sgm_config, False),
+              (ehgf_binary_config, unitsq_sgm_config, {'c_opt': {'maxEval': 150}})]
+    with quiet():
+        serial   = compareModels(cohort, models, n_jobs=1, max_eval=150)
+        threaded = compareModels(cohort, models, n_jobs=N, backend='thread', max_eval=150)
+    np.testing.assert_array_equal(serial['LME'], threaded['LME'])
+    for s in range(len(cohort)):
+        for m in range(len(models)):
+            _assertSame(serial['fits'][s][m], threaded['fits'][s][m])
+    assert models[1][2] == {'c_opt': {'maxEval': 150}}
+
+
+def test_restrictfun_threads():
+    """_restrictfun evaluated from many threads on one shared argument array"""
+    arg  = np.arange(6, dtype=float)
+    free = np.array([1, 4])
+    f    = lambda p: (float(np.sum(p * np.arange(1, 7))), None)
+    vals = np.random.RandomState(1).randn(2000, 2)
+    with ThreadPoolExecutor(max_workers=N) as pool:
+        got = list(pool.map(lambda v: _restrictfun(f, arg, free, v), vals))
+    want = []
+    for v in vals:
+        p = arg.copy()
+        p[free] = v
+        want.append(f(p)[0])
+    np.testing.assert_array_equal(got, want)
+    np.testing.assert_array_equal(arg, np.arange(6, dtype=float))
@@ -0,0 +1,35 @@
+""" Tests of the configs of the Hierarchical Gaussian Filter """
+
+import numpy as np
+
+from HGF.hgf_io import save_fit, load_fit
+from HGF.hgf_store import open_store, store_fit, query_fits
+from HGF.hgf_config import PrcConfig, hgf_binary_config, unitsq_sgm_config
+
+
+def test_prcconfig_mapping():
+    """a frozen config reads as its dict"""
+    c = hgf_binary_config()
+    f = PrcConfig.from_dict(c)
+    assert set(f) == set(c) and len(f) == len(c)
+    assert dict(f.items()).keys() == set(f.keys())
+    for key, val in f.items():
+        np.testing.assert_array_equal(val, c[key])
+    assert {**f}.keys() == dict(f.items()).keys()
+
+
+def test_prcconfig_save_and_store(binary_input, fit_model, tmp_path):
+    """fits with a frozen c_prc can be saved and stored"""
+    y = np.random.RandomState(0).binomial(1, 0.5, len(binary_input)).astype(float)
+    r = fit_model(y, binary_input, per_model=hgf_binary_config, obs_model=unitsq_sgm_config, overwrite_opt={'c_opt': {'maxEval': 50}})
+    r['c_prc'] = PrcConfig.from_dict(r['c_prc'])
+
+    path = save_fit(str(tmp_path / 'fit.npz'), r)
+    loaded = load_fit(path)
+    np.testing.assert_array_equal(loaded['c_prc']['priormus'], r['c_prc']['priormus'])
+    assert loaded['c_prc']['model'] == r['c_prc']['model']
+
+    con = open_store(str(tmp_path / 'fits.sqlite'))
+    store_fit(con, 's1', r, 'fingerprint', 'hash', traj='blob')
+    assert query_fits(con)[0]['prc_model'] == r['c_prc']['model']
+    con.close()
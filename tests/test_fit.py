@@ -0,0 +1,109 @@
+""" Tests of model fitting of the Hierarchical Gaussian Filter """
+
+import numpy as np
+import pytest
+from scipy import optimize
+
+from HGF.hgf import hgf, bayes_optimal
+from HGF.hgf_config import hgf_config, bayes_optimal_config
+from HGF.hgf_fit import _race, _randStarts, _posdef
+
+
+def test_float32_matches_float64(usdchf, fit_model):
+    """float32 trajectory storage gives the fit of float64 (the objective is computed in float64),
+    with float32 trajectories close to the float64 ones"""
+    kwargs = {'per_model': hgf_config, 'obs_model': bayes_optimal_config}
+    r64 = fit_model([], usdchf, **kwargs)
+    r32 = fit_model([], usdchf, overwrite_opt={'c_prc': {'dtype': 'float32'}}, **kwargs)
+
+    assert r64['optim']['success'] and r32['optim']['success']
+    assert r32['optim']['nit'] == r64['optim']['nit']
+    np.testing.assert_allclose(r32['optim']['final'], r64['optim']['final'], rtol=1e-10)
+    np.testing.assert_allclose(r32['optim']['LME'], r64['optim']['LME'], rtol=1e-10)
+    for field in ['mu', 'sa', 'mu_hat', 'sa_hat']:
+        assert r32['traj'][field].dtype == np.float32
+        np.testing.assert_allclose(r32['traj'][field], r64['traj'][field], rtol=1e-4)
+
+
+def test_float32_loglikelihood(usdchf_fit):
+    """at fixed parameters the log-likelihood of float32 trajectories is close to float64"""
+    r = usdchf_fit
+    logLl = {}
+    for dtype in [np.float64, np.float32]:
+        traj, infStates = hgf(r, r['p_prc']['p'], dtype=dtype)
+        logLl[dtype] = np.nansum(bayes_optimal(r, infStates, r['p_obs']['ptrans'])[0], dtype=np.float64)
+    np.testing.assert_allclose(logLl[np.float32], logLl[np.float64], rtol=1e-6)
+
+
+@pytest.mark.parametrize('budget, value', [('maxEval', 5), ('maxTime', 1e-9)])
+def test_budget_stops_fit(usdchf, usdchf_fit, fit_model, budget, value):
+    """a tiny budget stops the fit early at a finite point and is reported in r['optim']"""
+    assert not usdchf_fit['optim']['budgetLimited'] and usdchf_fit['optim']['stopped'] is None
+    r = fit_model([], usdchf, per_model=hgf_config, obs_model=bayes_optimal_config,
+                  overwrite_opt={'c_opt': {budget: value}})
+    assert r['optim']['budgetLimited'] and r['optim']['stopped'] == budget
+    assert r['optim']['nfev'] < usdchf_fit['optim']['nfev'] and r['optim']['nit'] < usdchf_fit['optim']['nit']
+    assert np.all(np.isfinite(r['optim']['final'])) and np.isfinite(r['optim']['LME'])
+
+
+@pytest.mark.parametrize('starts', [0, 3])
+@pytest.mark.parametrize('max_eval', [7, 23])
+def test_maxEval_per_evaluation(usdchf, fit_model, starts, max_eval):
+    """maxEval is checked before every evaluation, also inside an iteration and when racing starts,
+    a run ended inside an iteration gets its hessian numerically"""
+    r = fit_model([], usdchf, per_model=hgf_config, obs_model=bayes_optimal_config,
+                  overwrite_opt={'c_opt': {'maxEval': max_eval, 'nRandInit': starts}})
+    assert r['optim']['stopped'] == 'maxEval' and r['optim']['nfev'] == max_eval
+    assert np.isfinite(r['optim']['LME']) and np.all(np.isfinite(r['optim']['Sigma']))
+    np.testing.assert_allclose(r['optim']['H'] @ r['optim']['Sigma'], np.eye(len(r['optim']['Sigma'])), atol=1e-6)
+
+
+def _twoBasins(x):
+    """objective with a minimum near x[0] = 2 (value about -8) and a worse one near x[0] = -2 (about 8)"""
+    return((x[0]**2 - 4)**2 - 4*x[0] + np.sum((x[1:] - 1)**2))
+
+
+def test_race_prunes_and_resumes():
+    """starts in the worse basin are pruned, the others continue from their point and inverse hessian"""
+    calls = []
+    def opt_fun(fun, x0, **kwargs):
+        res = optimize.minimize(fun, x0, **kwargs)
+        calls.append((np.array(x0), kwargs['options']['hess_inv0'], dict(res)))  # _race sums into res
+        return(res)
+    c_opt = {'opt_fun': opt_fun, 'opt_method': 'BFGS', 'tolGrad': 1e-8, 'maxIter': 200, 'raceIter': 2, 'raceMargin': 4}
+    starts = np.array([[2.5, 0, 0], [-2.5, 0, 0], [1.8, 1.5, 0.5], [-1.8, 1, 1]])
+    spent = {'nfev': 0, 'nit': 0, 'stopped': None}
+    res, race = _race(_twoBasins, starts, c_opt, None, spent, verbose=False)
+
+    assert race['bestStart'] in [0, 2] and race['pruned'][1] > 0 and race['pruned'][3] > 0
+    assert race['pruned'][0] == 0 and race['pruned'][2] == 0
+    np.testing.assert_allclose(res['x'], optimize.minimize(_twoBasins, starts[0], method='BFGS', tol=1e-8)['x'], atol=1e-5)
+    assert res['nfev'] == sum(call[2]['nfev'] for call in calls)
+
+    # every run continues where its previous round ended, pruned runs stop
+    runs = {i: [] for i in range(len(starts))}
+    for x0, hess_inv0, out in calls:
+        i = [i for i in runs if np.array_equal(x0, runs[i][-1][2]['x'] if runs[i] else starts[i])][0]
+        if runs[i]:
+            np.testing.assert_array_equal(hess_inv0, _posdef(runs[i][-1][2]['hess_inv']))
+        else:
+            assert hess_inv0 is None
+        runs[i].append((x0, hess_inv0, out))
+    for i in [1, 3]:
+        assert len(runs[i]) == race['pruned'][i]
+    for i in [0, 2]:  # every round until converged
+        assert len(runs[i]) == race['rounds'] or (len(runs[i]) < race['rounds'] and runs[i][-1][2]['status'] != 1)
+
+
+def test_race_seed(usdchf, fit_model):
+    """racing is reproducible for a random seed, the seed sets the extra starts"""
+    over = lambda seed: {'c_opt': {'nRandInit': 2, 'randSeed': seed, 'maxEval': 300}}
+    kwargs = {'per_model': hgf_config, 'obs_model': bayes_optimal_config}
+    a, b = [fit_model([], usdchf, overwrite_opt=over(1), **kwargs) for _ in range(2)]
+    for key in ['final', 'startVals', 'pruned', 'LME', 'nfev']:
+        np.testing.assert_array_equal(a['optim'][key], b['optim'][key])
+    init, idx, sas = np.zeros(4), np.arange(4), np.ones(4)
+    np.testing.assert_array_equal(_randStarts(init, idx, sas, {'nRandInit': 3, 'randSeed': 1}),
+                                  _randStarts(init, idx, sas, {'nRandInit': 3, 'randSeed': 1}))
+    assert not np.array_equal(_randStarts(init, idx, sas, {'nRandInit': 3, 'randSeed': 1}),
+                              _randStarts(init, idx, sas, {'nRandInit': 3, 'randSeed': 2}))
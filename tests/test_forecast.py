@@ -0,0 +1,19 @@
+""" Tests of the forecast evaluation of the Hierarchical Gaussian Filter """
+
+import numpy as np
+
+from HGF.hgf_forecast import forecastEval
+
+
+def test_horizon_longer_than_series(usdchf_fit):
+    """horizons beyond the series give all nan forecasts and no scores, the other horizons are unchanged"""
+    u   = usdchf_fit['u'][:20]
+    res = forecastEval(usdchf_fit, usdchf_fit['p_prc']['p'], u, horizons=[1, 5, 20, 21, 25, 50])
+    ref = forecastEval(usdchf_fit, usdchf_fit['p_prc']['p'], u, horizons=[1, 5, 20])
+    assert res['mean'].shape == (6, 20)
+    np.testing.assert_array_equal(res['mean'][:3], ref['mean'])
+    np.testing.assert_array_equal(res['var'][:3], ref['var'])
+    assert np.isfinite(res['mean'][2, 19]) and np.isnan(res['mean'][2, :19]).all()
+    assert np.isnan(res['mean'][3:]).all() and np.isnan(res['var'][3:]).all()
+    assert res['scores'][21]['n'] == 0 and res['scores'][25]['n'] == 0 and res['scores'][50]['n'] == 0
+    np.testing.assert_allclose(res['mean'][0], res['mu_hat'])
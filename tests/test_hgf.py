@@ -0,0 +1,108 @@
+""" Tests of the perceptual functions of the Hierarchical Gaussian Filter """
+
+import numpy as np
+import pytest
+
+from HGF.hgf import hgf, ehgf_binary, traj_width
+from HGF.hgf_config import hgf_config, ehgf_binary_config
+
+# native parameters (as in the simulation examples)
+P_CONTINUOUS = np.array([6, 0.10, 0.001, -0.01, 0, 0, 0.05, 1.2, 2.5, 0.5])
+P_BINARY     = np.array([np.nan, 0, 1, np.nan, 1, 1, np.nan, 0, 0, 1, 1, np.nan, -2.5, -6])
+
+
+def _r(u, config):
+    """r dict of the perceptual functions for inputs u"""
+    return({'u': u, 'y': np.array([]), 'c_prc': config(), 'ign': np.argwhere(np.isnan(u)), 'irr': np.array([], dtype=int)})
+
+
+@pytest.fixture
+def inputs(usdchf, binary_input):
+    return({'continuous': usdchf * 5, 'binary': binary_input})
+
+
+@pytest.mark.parametrize('kind, prc_fun, config, p', [('continuous', hgf, hgf_config, P_CONTINUOUS),
+                                                       ('binary', ehgf_binary, ehgf_binary_config, P_BINARY)])
+def test_ignored_trials(inputs, kind, prc_fun, config, p):
+    """a nan input is ignored on its own trial: the representations are carried over from the trial before,
+    and the other trials are the same as for the sequence without that trial"""
+    u = inputs[kind].copy()
+    skip = [5, 40, 41]
+    u[skip] = np.nan
+    with np.errstate(divide='ignore'):
+        traj, infStates = prc_fun(_r(u, config), p)
+        ref, _          = prc_fun(_r(np.delete(u, skip), config), p)
+
+    keep = np.setdiff1d(np.arange(len(u)), skip)
+    for k in skip:
+        np.testing.assert_array_equal(traj['mu'][k], traj['mu'][k-1])
+        np.testing.assert_array_equal(traj['sa'][k], traj['sa'][k-1])
+    for field in ['mu', 'sa', 'mu_hat', 'sa_hat']:
+        assert np.all(np.isfinite(traj[field][keep][:, 1:]))
+        np.testing.assert_allclose(traj[field][keep], ref[field], rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize('kind, prc_fun, config, p', [('continuous', hgf, hgf_config, P_CONTINUOUS),
+                                                       ('binary', ehgf_binary, ehgf_binary_config, P_BINARY)])
+@pytest.mark.parametrize('record', [['mu'], ['mu_hat', 'sa'], ['wt'], ['da', 'ud', 'epsi']])
+def test_record_subset(inputs, kind, prc_fun, config, p, record):
+    """a record subset returns only those fields, with the values of a full run (also from r['c_prc']['record'])"""
+    r = _r(inputs[kind], config)
+    with np.errstate(divide='ignore'):
+        full, full_states = prc_fun(r, p)
+        traj, infStates   = prc_fun(r, p, record=record)
+        r['c_prc']['record'] = record
+        cfg, _            = prc_fun(r, p)
+    for res in [traj, cfg]:
+        assert sorted(res) == sorted(record)
+        for field in record:
+            np.testing.assert_array_equal(res[field], full[field])
+    np.testing.assert_array_equal(infStates, full_states)
+    with pytest.raises(ValueError, match='Unknown trajectory fields'):
+        prc_fun(r, p, record=['mu', 'nope'])
+
+
+@pytest.mark.parametrize('kind, prc_fun, config, p', [('continuous', hgf, hgf_config, P_CONTINUOUS),
+                                                       ('binary', ehgf_binary, ehgf_binary_config, P_BINARY)])
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_out_buffer(inputs, kind, prc_fun, config, p, dtype):
+    """a caller supplied out buffer is written in place, traj and infStates are views into it"""
+    r = _r(inputs[kind], config)
+    record = ['mu', 'sa', 'da']
+    out = np.zeros((len(r['u']) + 1, traj_width(r, record, dtype)), dtype=dtype)
+    with np.errstate(divide='ignore'):
+        ref, ref_states = prc_fun(r, p, record=record, dtype=dtype)
+        traj, infStates = prc_fun(r, p, record=record, out=out)
+    assert np.shares_memory(infStates, out) and infStates.base is not None
+    for field in record:
+        assert traj[field].dtype == dtype and np.shares_memory(traj[field], out)
+        np.testing.assert_array_equal(traj[field], ref[field])
+    np.testing.assert_array_equal(infStates, ref_states)
+    np.testing.assert_array_equal(out[1:,:infStates.shape[1]*4].reshape(infStates.shape), infStates)
+
+    # writes to the buffer show in the results
+    out[-1] = 7
+    assert np.all(infStates[-1] == 7) and np.all(traj['mu'][-1] == 7)
+    with pytest.raises(ValueError, match='out should have shape'):
+        prc_fun(r, p, record=record, out=out[:-1])
+
+
+@pytest.mark.parametrize('kind, prc_fun, config, p', [('continuous', hgf, hgf_config, P_CONTINUOUS),
+                                                       ('binary', ehgf_binary, ehgf_binary_config, P_BINARY)])
+def test_irregular_intervals(inputs, kind, prc_fun, config, p):
+    """[2, x] inputs with time deltas: unit deltas equal the regular run, the delta of trial k acts on trial k"""
+    u = inputs[kind][:200]
+    r = _r(u, config)
+    irr = {**r, 'u': np.stack([u, np.ones(len(u))]), 'c_prc': {**r['c_prc'], 'irregular_intervals': True}}
+    with np.errstate(divide='ignore'):
+        ref, ref_states = prc_fun(r, p)
+        traj, infStates = prc_fun(irr, p)
+        for field in ref:
+            np.testing.assert_array_equal(traj[field], ref[field])
+        np.testing.assert_array_equal(infStates, ref_states)
+
+        irr['u'][1,7] = 3.
+        traj, _ = prc_fun(irr, p)
+    for field in ['mu', 'sa', 'mu_hat', 'sa_hat']:
+        np.testing.assert_array_equal(traj[field][:7], ref[field][:7])
+    assert not np.allclose(traj['sa_hat'][7], ref['sa_hat'][7])
@@ -0,0 +1,168 @@
+""" Tests of storing and loading results and inputs of the Hierarchical Gaussian Filter """
+
+import os
+import json
+import zipfile
+import numpy as np
+import pytest
+
+from HGF.hgf import ehgf_binary, unitsq_sgm
+from HGF.hgf_io import save_fit, load_fit, convert_inputs, load_inputs, MemmapSink, _memmapMember, STORED_DICTS, STORED_ARRAYS, LAZY
+from HGF.hgf_sim import simModel
+from HGF.hgf_config import ehgf_binary_config, unitsq_sgm_config
+
+P_BINARY = np.array([np.nan, 0, 1, np.nan, 1, 1, np.nan, 0, 0, 1, 1, np.nan, -2.5, -6])
+
+
+@pytest.fixture(scope='module')
+def results(binary_input, fit_model, quiet):
+    """a fit and a simulation (whose c_obs is the config function itself)"""
+    with quiet():
+        sim = simModel(binary_input, ehgf_binary, P_BINARY, unitsq_sgm, 5, seed=1)
+    fit = fit_model(sim['y'], binary_input, per_model=ehgf_binary_config, obs_model=unitsq_sgm_config,
+                    overwrite_opt={'c_opt': {'maxEval': 50}})
+    assert callable(sim['c_obs'])
+    return({'fit': fit, 'sim': sim})
+
+
+def _assertSame(a, b):
+    """stored values a equal the values b of the result (functions by identity, nan equal to nan)"""
+    if callable(b) or b is None:
+        assert a is b
+    elif isinstance(b, dict):
+        assert a.keys() == b.keys()
+        for key in b: _assertSame(a[key], b[key])
+    else:
+        np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize('kind', ['fit', 'sim'])
+@pytest.mark.parametrize('mmap', [True, False])
+def test_roundtrip(results, tmp_path, kind, mmap):
+    """save_fit / load_fit return every stored part of r, per trial arrays mapped read-only with mmap"""
+    r = results[kind]
+    loaded = load_fit(save_fit(str(tmp_path / 'r.npz'), r), mmap=mmap)
+    stored = [item for item in STORED_DICTS + STORED_ARRAYS if item in r]
+    assert sorted(loaded) == sorted(stored)
+    for item in stored:
+        _assertSame(loaded[item], r[item])
+    assert isinstance(loaded['traj']['mu'], np.memmap) == mmap
+    if mmap: assert not loaded['traj']['mu'].flags.writeable
+
+
+@pytest.mark.parametrize('kind', ['fit', 'sim'])
+def test_without_traj(results, tmp_path, kind):
+    """traj=False leaves out the trajectories when saving, and all per trial data when loading"""
+    r = results[kind]
+    path = save_fit(str(tmp_path / 'r.npz'), r, traj=False)
+    assert 'traj' not in load_fit(path) and 'u' in load_fit(path)
+    loaded = load_fit(save_fit(str(tmp_path / 'full.npz'), r), traj=False)
+    assert not set(loaded) & {'traj', 'u', 'y'}
+    _assertSame(loaded['p_prc'], r['p_prc'])
+    _assertSame(loaded['c_obs'], r['c_obs'])
+    if kind == 'fit':
+        assert 'yhat' not in loaded['optim'] and loaded['optim']['LME'] == r['optim']['LME']
+
+
+@pytest.mark.parametrize('kind', ['fit', 'sim'])
+def test_memmap_member(results, tmp_path, kind):
+    """every mapped member equals np.load of the same member (also with the fn/c_obs member of simModel)"""
+    path = save_fit(str(tmp_path / 'r.npz'), results[kind])
+    with np.load(path, allow_pickle=False) as npz, zipfile.ZipFile(path) as zf:
+        if kind == 'sim': assert 'fn/c_obs' in npz.files
+        mapped = 0
+        for name in npz.files:
+            val = _memmapMember(path, zf, name + '.npy')
+            if val is None:
+                assert npz[name].size == 0 or npz[name].dtype.hasobject
+                continue
+            mapped += any(name == item or name.startswith(item + '/') for item in LAZY)
+            assert val.dtype == npz[name].dtype and val.shape == npz[name].shape
+            np.testing.assert_array_equal(val, npz[name])
+    assert mapped > 0
+
+
+@pytest.fixture
+def timed(tmp_path):
+    """text file of values and irregular time stamps (with a comment and an empty line), and its columns"""
+    rng    = np.random.RandomState(0)
+    values = rng.randn(23)
+    stamps = 100 + np.cumsum(rng.uniform(0.5, 3, 23))
+    lines  = ['{!r} {!r}'.format(float(v), float(t)) for v, t in zip(values, stamps)]
+    path   = tmp_path / 'timed.txt'
+    path.write_text('# value time\n' + '\n'.join(lines[:10]) + '\n\n' + '\n'.join(lines[10:]) + '\n')
+    return(str(path), values, stamps)
+
+
+@pytest.mark.parametrize('chunk_lines', [1, 2, 5, 1000])
+def test_convert_inputs(demo, tmp_path, timed, chunk_lines):
+    """chunked conversion equals np.loadtxt, time stamps become deltas also across chunk boundaries
+    (the first trial gets the interval of the second, also when the first chunk holds only that trial)"""
+    src = str(demo / 'example_usdchf.txt')
+    dst = convert_inputs(src, str(tmp_path / 'usdchf.npy'), chunk_lines=chunk_lines)
+    np.testing.assert_array_equal(np.load(dst), np.loadtxt(src))
+
+    path, values, stamps = timed
+    deltas = np.diff(stamps, prepend=2*stamps[0] - stamps[1])
+    u = np.load(convert_inputs(path, column=0, time_column=1, absolute_time=True, chunk_lines=chunk_lines))
+    assert u.shape == (2, len(values))
+    np.testing.assert_array_equal(u[0], values)
+    np.testing.assert_allclose(u[1], deltas, rtol=1e-12)
+    np.testing.assert_allclose(u[1,1:], np.diff(stamps), rtol=0, atol=0)
+
+    u = np.load(convert_inputs(path, time_column=1, chunk_lines=chunk_lines))
+    np.testing.assert_array_equal(u, np.stack([values, stamps]))
+    u = np.load(convert_inputs(path, column=1, chunk_lines=chunk_lines))
+    np.testing.assert_array_equal(u, stamps)
+
+
+def test_load_inputs(demo, tmp_path):
+    """text is converted once into a read-only map, the .npy is reused until the text is newer"""
+    src = tmp_path / 'usdchf.txt'
+    src.write_text((demo / 'example_usdchf.txt').read_text())
+    u = load_inputs(str(src), chunk_lines=100)
+    npy = tmp_path / 'usdchf.npy'
+    assert isinstance(u, np.memmap) and not u.flags.writeable and npy.exists()
+    np.testing.assert_array_equal(u, np.loadtxt(src))
+
+    # reused (an older text is not read again), converted again once the text is newer
+    stamp = os.path.getmtime(npy)
+    os.utime(src, (stamp - 10, stamp - 10))
+    assert os.path.getmtime(npy) == stamp and load_inputs(str(src)).shape == u.shape
+    src.write_text('1\n2\n3\n')
+    os.utime(src, (stamp + 10, stamp + 10))
+    np.testing.assert_array_equal(load_inputs(str(src)), [1, 2, 3])
+    loaded = load_inputs(str(npy), mmap=False)
+    assert not isinstance(loaded, np.memmap) and loaded.flags.writeable
+
+
+@pytest.mark.parametrize('irregular', [False, True])
+def test_memmap_sink(binary_input, tmp_path, quiet, irregular):
+    """simModel into a MemmapSink equals the in-memory run (with [2, x] irregular-interval inputs as well),
+    the responses of the first chunk are drawn with the seed itself"""
+    u, over = binary_input, False
+    if irregular:
+        u    = np.stack([binary_input, np.random.RandomState(0).uniform(0.5, 2, len(binary_input))])
+        over = {'c_prc': {'irregular_intervals': True}}
+    n, size = u.shape[-1], 64
+    with quiet():
+        ref  = simModel(u, ehgf_binary, P_BINARY, unitsq_sgm, 5, overwrite_opt=over, seed=3)
+        sink = MemmapSink(str(tmp_path / 'sim'), n, chunksize=size)
+        sim  = simModel(u, ehgf_binary, P_BINARY, unitsq_sgm, 5, overwrite_opt=over, seed=3, sink=sink)
+    assert sim['traj'].keys() == ref['traj'].keys()
+    for field in ref['traj']:
+        assert isinstance(sim['traj'][field], np.memmap)
+        np.testing.assert_allclose(sim['traj'][field], ref['traj'][field], rtol=1e-12, atol=0)
+        np.testing.assert_array_equal(np.load(str(tmp_path / 'sim' / '{}.npy'.format(field))), sim['traj'][field])
+    assert sim['y'].shape == ref['y'].shape and set(np.unique(sim['y'])) <= {0, 1}
+    np.testing.assert_array_equal(sim['y'][:size], ref['y'][:size])
+    with open(tmp_path / 'sim' / 'progress.json') as f:
+        assert json.load(f) == {'n': n, 'written': n, 'fields': sorted(list(ref['traj']) + ['y'])}
+
+    # the perceptual function itself, in a lower storage precision
+    r = {**ref, 'ign': np.argwhere(np.isnan(ref['u']))}
+    traj, infStates = ehgf_binary(r, P_BINARY, dtype=np.float32, sink=MemmapSink(str(tmp_path / 'prc'), n, size))
+    low, _ = ehgf_binary(r, P_BINARY, dtype=np.float32)
+    assert infStates is None and traj['mu'].dtype == np.float32
+    for field in low:
+        np.testing.assert_allclose(traj[field], low[field], rtol=1e-5)
@@ -0,0 +1,45 @@
+""" Tests of multi-stream filtering with the Hierarchical Gaussian Filter """
+
+import numpy as np
+import pytest
+
+from HGF.hgf import hgf, ehgf, bayes_optimal
+from HGF.hgf_config import hgf_config, ehgf_config, bayes_optimal_config
+from HGF.hgf_multi import filterMulti, TRAJ_MULTI
+
+P_CONTINUOUS = np.array([6, 0.10, 0.001, -0.01, 0, 0, 0.05, 1.2, 2.5, 0.5])
+
+
+@pytest.fixture
+def streams(usdchf):
+    """four series of 300 trials with missing (nan) trials at different positions, also at the start and end"""
+    U = np.stack([usdchf[:300], usdchf[300:600], usdchf[:300] * 1.01, usdchf[:300][::-1]]) * 5
+    U[0, [0, 17, 18]] = np.nan
+    U[1, [120]]       = np.nan
+    U[3, [250, 299]]  = np.nan
+    return(U)
+
+
+@pytest.mark.parametrize('prc_fun, config', [(hgf, hgf_config), (ehgf, ehgf_config)])
+@pytest.mark.parametrize('irregular', [False, True])
+def test_streams_equal_single_runs(streams, prc_fun, config, irregular):
+    """every stream of filterMulti equals a separate run of the perceptual function on that series,
+    including its nan trials, with shared or per stream time deltas, and the log-likelihood per stream"""
+    c_prc  = config()
+    deltas = None
+    if irregular:
+        c_prc['irregular_intervals'] = True
+        deltas = np.random.RandomState(0).uniform(0.5, 2, streams.shape)
+    r   = {'c_prc': c_prc, 'c_obs': bayes_optimal_config(), 'p_obs': {'ptrans': np.array([])}}
+    res = filterMulti(r, P_CONTINUOUS, streams, deltas=deltas)
+    for s, u in enumerate(streams):
+        rs = {'u': u if deltas is None else np.stack([u, deltas[s]]), 'y': np.array([]), 'c_prc': c_prc,
+              'ign': np.argwhere(np.isnan(u)), 'irr': np.array([], dtype=int)}
+        with np.errstate(divide='ignore'):
+            traj, infStates = prc_fun(rs, P_CONTINUOUS)
+        for field in TRAJ_MULTI:
+            np.testing.assert_allclose(res['traj'][field][s], traj[field], rtol=1e-12, atol=1e-300, err_msg=field)
+        np.testing.assert_allclose(res['infStates'][s], infStates, rtol=1e-12)
+        logp = bayes_optimal(rs, infStates, np.array([]))[0]
+        np.testing.assert_allclose(res['logLl'][s], np.nansum(logp), rtol=1e-12)
+    assert np.all(np.isfinite(res['logLl']))
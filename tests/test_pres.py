@@ -0,0 +1,172 @@
+""" Tests of the presentation functions of the Hierarchical Gaussian Filter """
+
+import tracemalloc
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+from HGF.hgf import ehgf_binary, unitsq_sgm, _sgm
+from HGF.hgf_sim import simModel
+from HGF.hgf_pres import constructDataframe, constructLongDataframe, plot_binary_expect, _minmax
+from HGF.hgf_config import hgf_config, bayes_optimal_config, ehgf_binary_config, unitsq_sgm_config
+
+P_BINARY = np.array([np.nan, 0, 1, np.nan, 1, 1, np.nan, 0, 0, 1, 1, np.nan, -2.5, -6])
+
+
+@pytest.mark.parametrize('res_diag', [True, False])
+def test_dataframe_resAC(usdchf, fit_model, res_diag):
+    """the residual autocorrelation of the fit is a column of the dataframe (nan without residual diagnostics)"""
+    r = fit_model([], usdchf, per_model=hgf_config, obs_model=bayes_optimal_config,
+                  overwrite_opt={'c_opt': {'resDiag': res_diag, 'maxEval': 50}})
+    df = constructDataframe(r)
+    assert 'fit_resAC' in df
+    if res_diag:
+        np.testing.assert_array_equal(df['fit_resAC'].values[1:len(r['optim']['resAC'])+1], r['optim']['resAC'])
+    else:
+        assert df['fit_resAC'].isna().all()
+
+
+def _oldDataframe(r, sim):
+    """constructDataframe as it was before the columnar builder (DataFrame.append replaced by pd.concat),
+    reference for the column order and values"""
+    df_dict = {}
+    df_dict['u'] = sim['u']
+    df_dict['y'] = sim['y']
+    df_dict['trial'] = np.arange(1, len(sim['u'])+1)
+    df_dict['fit_yhat']   = r['optim']['yhat']
+    df_dict['fit_res']    = r['optim']['res']
+    df_dict['fit_resAC']  = r['optim']['resAC']
+    for item in r['traj'].keys():
+        for lvl in range(len(r['traj'][item][0,:])):
+            df_dict['fit_{}_lvl{}'.format(item, lvl+1)] = r['traj'][item][:,lvl]
+    for item in sim['traj'].keys():
+        for lvl in range(len(sim['traj'][item][0,:])):
+            df_dict['sim_{}_lvl{}'.format(item, lvl+1)] = sim['traj'][item][:,lvl]
+    df = pd.DataFrame(df_dict)
+    df = pd.concat([pd.DataFrame([[np.nan] * len(df.columns)], columns=df.columns), df], ignore_index=True)
+    for prefix, res in [('fit', r), ('sim', sim)]:
+        for lvl in range(len(res['traj']['mu'][0,:])):
+            df.loc[0, '{}_mu_lvl{}'.format(prefix, lvl+1)] = res['p_prc']['mu_0'][lvl]
+            df.loc[0, '{}_sa_lvl{}'.format(prefix, lvl+1)] = res['p_prc']['sa_0'][lvl]
+    if 'binary' in r['c_prc']['model']:
+        df = df.assign(fit_mu_lvl2_sgm= _sgm(df['fit_mu_lvl2'], 1))
+        df = df.assign(sim_mu_lvl2_sgm= _sgm(df['sim_mu_lvl2'], 1))
+    for prefix, res in [('fit', r), ('sim', sim)]:
+        for lvl in range(len(res['traj']['mu'][0,:])):
+            mu, sa = df['{}_mu_lvl{}'.format(prefix, lvl+1)], df['{}_sa_lvl{}'.format(prefix, lvl+1)]
+            df = df.assign(**{'{}_mu_lvl{}_upper'.format(prefix, lvl+1): mu + np.sqrt(sa)})
+            df = df.assign(**{'{}_mu_lvl{}_lower'.format(prefix, lvl+1): mu - np.sqrt(sa)})
+    return(df)
+
+
+@pytest.fixture(scope='module')
+def binary_results(binary_input, fit_model, quiet):
+    """two simulations and a fit of the first (residual autocorrelation over all lags, as the old frame needs)"""
+    with quiet():
+        sims = [simModel(binary_input, ehgf_binary, P_BINARY, unitsq_sgm, 5, seed=s) for s in range(2)]
+    r = fit_model(sims[0]['y'], binary_input, per_model=ehgf_binary_config, obs_model=unitsq_sgm_config,
+                  overwrite_opt={'c_opt': {'maxEval': 30, 'resLags': None}})
+    return(r, sims)
+
+
+def _assertColumns(df, ref):
+    assert list(df.columns) == list(ref.columns)
+    for col in ref:
+        np.testing.assert_allclose(df[col].values, ref[col].values.astype(float), rtol=1e-15, atol=0, err_msg=col)
+
+
+@pytest.mark.parametrize('parts', ['both', 'fit', 'sim'])
+def test_dataframe_matches_old(binary_results, parts):
+    """the columnar frame has the column order and values of the old construction,
+    fit-only and sim-only frames are the old frame without the columns of the other source"""
+    r, sims = binary_results
+    ref = _oldDataframe(r, sims[0])
+    if parts == 'both':
+        df = constructDataframe(r, sims[0])
+    elif parts == 'fit':
+        df, ref = constructDataframe(r), ref[[col for col in ref if not col.startswith('sim_')]]
+    else:
+        df, ref = constructDataframe(sim=sims[0]), ref[[col for col in ref if not col.startswith('fit_')]]
+    _assertColumns(df, ref)
+    cols = constructDataframe(r, sims[0], frame=False)
+    assert list(cols) == list(constructDataframe(r, sims[0]).columns)
+
+
+def test_long_dataframe_matches_wide(binary_results):
+    """every subject and level of the long frame equals the columns of its wide sim-only frame"""
+    r, sims = binary_results
+    long = constructLongDataframe({'a': sims[0], 'b': sims[1]}, source='sim')
+    l, n = sims[0]['c_prc']['n_levels'], len(sims[0]['u'])
+    assert len(long) == 2 * l * (n+1) and set(long['source']) == {'sim'}
+    for subject, sim in zip(['a', 'b'], sims):
+        wide = constructDataframe(sim=sim)
+        rows = long[long['subject'] == subject]
+        for lvl in range(1, l+1):
+            part = rows[rows['level'] == lvl]
+            np.testing.assert_array_equal(part['trial'], np.arange(n+1))
+            for col in ['u', 'y']:
+                np.testing.assert_array_equal(part[col].values, wide[col].values)
+            for field in sim['traj']:
+                name = 'sim_{}_lvl{}'.format(field, lvl)
+                expected = wide[name].values if name in wide else np.full(n+1, np.nan)
+                np.testing.assert_array_equal(part[field].values, expected, err_msg=name)
+            for bound in ['upper', 'lower']:
+                np.testing.assert_array_equal(part['mu_{}'.format(bound)].values, wide['sim_mu_lvl{}_{}'.format(lvl, bound)].values)
+
+
+def test_dataframe_single_allocation(binary_input, quiet):
+    """building the frame allocates its data once (memory peak about the size of the frame itself)"""
+    u = np.tile(binary_input, 100)
+    with quiet():
+        sim = simModel(u, ehgf_binary, P_BINARY, unitsq_sgm, 5, seed=0)
+    tracemalloc.start()
+    df = constructDataframe(sim=sim)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    size = df.shape[0] * df.shape[1] * 8
+    assert size <= peak < 1.1 * size
+
+
+@pytest.mark.parametrize('max_points', [2, 3, 4, 7, 100, 101])
+def test_minmax_buckets(max_points):
+    """at most max_points indices, the minimum and maximum of every bucket are kept (nan ignored)"""
+    y = np.random.RandomState(max_points).randn(1003)
+    y[[0, 500, 1002]] = np.nan
+    idx = _minmax(y, max_points)
+    assert len(idx) <= max_points and np.all(np.diff(idx) > 0)
+    size = int(np.ceil(len(y) / (max_points // 2)))
+    for start in range(0, len(y), size):
+        kept = y[idx[(idx >= start) & (idx < start + size)]]
+        assert np.nanmin(kept) == np.nanmin(y[start:start+size]) and np.nanmax(kept) == np.nanmax(y[start:start+size])
+    np.testing.assert_array_equal(_minmax(y, None), np.arange(len(y)))
+    np.testing.assert_array_equal(_minmax(y[:max_points], max_points), np.arange(max_points))
+
+
+@pytest.mark.parametrize('max_points', [0, 1])
+def test_minmax_too_few_points(max_points):
+    with pytest.raises(ValueError, match='max_points'):
+        _minmax(np.arange(10.), max_points)
+
+
+@pytest.mark.parametrize('max_points', [None, 10000, 41])
+def test_binary_scatter_points(binary_results, max_points):
+    """the binary stimuli and responses are drawn at every trial, downsampled every bucket still shows
+    each of the values (0 / 1) it holds"""
+    r, sims = binary_results
+    df = constructDataframe(r, sims[0])
+    ax = plot_binary_expect(df, sims[0], max_points=max_points)
+    stimuli, responses = ax[-1].collections[:2]
+    for points, col in [(stimuli, df['u'].values), (responses, np.where(df['y'] == 1, 0.96, np.where(df['y'] == 0, 0.04, np.nan)))]:
+        x, y = points.get_offsets().T
+        np.testing.assert_array_equal(y, col[x.astype(int)])
+        if max_points is None or max_points >= len(col):
+            np.testing.assert_array_equal(x, np.arange(len(col)))
+        else:
+            size = int(np.ceil(len(col) / (max_points // 2)))
+            for start in range(0, len(col), size):
+                drawn = y[(x >= start) & (x < start + size)]
+                assert set(drawn[~np.isnan(drawn)]) == set(col[start:start+size][~np.isnan(col[start:start+size])])
+    plt.close('all')
@@ -0,0 +1,48 @@
+""" Tests of the fitting service of the Hierarchical Gaussian Filter """
+
+import time
+import types
+import numpy as np
+from concurrent.futures import Future
+
+import HGF.hgf_service as hgf_service
+from HGF.hgf_service import _prune, _runJob
+
+
+def _job(finished):
+    """finished job (finished seconds ago), or a queued one with finished None"""
+    fut = Future()
+    if finished is not None: fut.set_result({})
+    return({'type': 'fit', 'future': fut, 'finished': None if finished is None else time.time() - finished})
+
+
+def test_prune_ttl_and_cap():
+    """finished jobs expire after ttl and only the newest max_done are kept, queued jobs stay"""
+    jobs   = {'queued': _job(None), 'old': _job(100), 'a': _job(30), 'b': _job(20), 'c': _job(10)}
+    server = types.SimpleNamespace(jobs=dict(jobs), ttl=60, max_done=None)
+    _prune(server)
+    assert set(server.jobs) == {'queued', 'a', 'b', 'c'}
+    server.max_done = 2
+    _prune(server)
+    assert set(server.jobs) == {'queued', 'b', 'c'}
+    server.ttl, server.max_done = 0, None
+    _prune(server)
+    assert set(server.jobs) == {'queued'}
+
+
+def test_simulate_pvecs(monkeypatch):
+    """perceptual and observation parameters of a simulation job both become float arrays (null is nan)"""
+    seen = {}
+    def simModel(inputs, prc_model, prc_pvec, **kwargs):
+        seen.update(kwargs, prc_pvec=prc_pvec)
+        return({'p_prc': prc_pvec, 'y': inputs, 'traj': {}})
+    monkeypatch.setattr(hgf_service, 'simModel', simModel)
+
+    _runJob('simulate', {'inputs': [0, 1], 'prc_model': 'ehgf_binary', 'prc_pvec': [None, 0, 1],
+                         'obs_model': 'unitsq_sgm', 'obs_pvec': [None, 5]})
+    for key in ['prc_pvec', 'obs_pvec']:
+        assert isinstance(seen[key], np.ndarray) and seen[key].dtype == float
+    np.testing.assert_array_equal(seen['obs_pvec'], [np.nan, 5])
+    _runJob('simulate', {'inputs': [0, 1], 'prc_model': 'ehgf_binary', 'prc_pvec': [None, 0, 1],
+                         'obs_model': 'unitsq_sgm', 'obs_pvec': 5})
+    assert seen['obs_pvec'] == 5
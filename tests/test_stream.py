@@ -0,0 +1,64 @@
+""" Tests of streaming and live refitting with the Hierarchical Gaussian Filter """
+
+import threading
+import numpy as np
+import pytest
+
+import HGF.hgf_stream as hgf_stream
+from HGF.hgf_stream import stream_init, stream_update, stream_result, LiveRefit
+from HGF.hgf_config import ehgf_binary_config, unitsq_sgm_config, bayes_optimal_binary_config
+
+P_BINARY = np.array([np.nan, 0, 1, np.nan, 1, 1, np.nan, 0, 0, 1, 1, np.nan, -2.5, -6])
+
+
+def test_liverefit_swaps_silently(usdchf, usdchf_fit, capfd):
+    """background refits are swapped into the stream and print nothing"""
+    live = LiveRefit(stream_init(usdchf_fit, usdchf_fit['p_prc']['p']), window=300, every=300)
+    capfd.readouterr()
+    for start in range(0, 600, 100):
+        live.update(usdchf[start:start+100])
+    live.close()
+    m = live.metrics()
+    assert m['refits'] >= 1 and m['failed'] == 0 and not m['pending']
+    assert capfd.readouterr().out == ''
+
+
+def test_liverefit_one_fit_in_flight(usdchf, usdchf_fit, monkeypatch):
+    """no new fit is submitted until the running one is swapped in, wait() waits for that swap"""
+    gate, calls = threading.Event(), []
+    def refit(responses, inputs, *args):
+        calls.append(len(inputs))
+        gate.wait()
+        return(usdchf_fit['p_prc']['p'], usdchf_fit['p_obs']['ptrans'], usdchf_fit['optim']['final'], 0.)
+    monkeypatch.setattr(hgf_stream, '_refit', refit)
+
+    live = LiveRefit(stream_init(usdchf_fit, usdchf_fit['p_prc']['p']), window=100, every=50)
+    live.wait()                                    # nothing in flight yet
+    for start in range(0, 400, 50):
+        live.update(usdchf[start:start+50])
+    assert len(calls) == 1 and live.metrics()['pending'] and not live.done.is_set()
+
+    gate.set()
+    live.wait()
+    m = live.metrics()
+    assert m['refits'] == 1 and not m['pending']
+    live.update(usdchf[400:450])                   # due again, submitted after the swap
+    live.close()
+    assert len(calls) == 2 and live.metrics()['refits'] == 2
+
+
+def test_update_without_responses(binary_input):
+    """chunks without responses are filtered but not scored by observation models that score responses,
+    bayes optimal models score the inputs, responses of another length are an error"""
+    r = {'c_prc': ehgf_binary_config(), 'c_obs': unitsq_sgm_config()}
+    s = stream_init(r, P_BINARY, ptrans_obs=np.log([5.]))
+    y = (binary_input[:100] > 0.5).astype(float)
+    assert stream_update(s, binary_input[:50]) is None
+    assert stream_update(s, binary_input[50:60], np.array([])) is None
+    scored = stream_update(s, binary_input[60:100], y[60:100])
+    assert np.isfinite(scored) and stream_result(s)['logLl'] == scored and s['n'] == 100
+    with pytest.raises(ValueError, match='responses'):
+        stream_update(s, binary_input[100:110], y[:5])
+
+    s = stream_init({'c_prc': ehgf_binary_config(), 'c_obs': bayes_optimal_binary_config()}, P_BINARY)
+    assert np.isfinite(stream_update(s, binary_input[:50]))